@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmark: src.workflows.event_channel vs the old thought-queue poll.
+
+A worker thread sends a few thoughts, goes quiet (Gemini thinking), then
+returns. The quiet time is staggered across runs so it does not line up
+with the 100 ms poll. Reported per run:
+
+- transition: ms from the worker returning to the consumer loop ending
+  (the delay before the next phase can start)
+- wakeups/s: consumer loop wakeups per second while the worker is quiet
+
+    cd narratives/agent && python -m benchmarks.bench_event_channel
+"""
+
+import queue
+import statistics
+import threading
+import time
+
+from src.workflows.event_channel import EventChannel
+
+THOUGHTS = 5
+IDLE_S = 0.5
+# Added to IDLE_S in run i: i * STAGGER_S
+STAGGER_S = 0.013
+REPEAT = 10
+
+
+def old_loop(idle_s: float) -> tuple:
+    """The loop the MCP/KB phases used before EventChannel."""
+    thought_queue = queue.Queue()
+    timing = {}
+
+    def work():
+        for i in range(THOUGHTS):
+            thought_queue.put({'thought': f"thought {i}", 'phase': 'mcp'})
+        time.sleep(idle_s)
+        timing['returned'] = time.perf_counter()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    wakeups = 0
+    while thread.is_alive() or not thought_queue.empty():
+        wakeups += 1
+        try:
+            thought_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    thread.join()
+    return time.perf_counter() - timing['returned'], wakeups - THOUGHTS
+
+
+def new_loop(idle_s: float) -> tuple:
+    timing = {}
+
+    def work(channel):
+        for i in range(THOUGHTS):
+            channel.thought(f"thought {i}", 'mcp')
+        time.sleep(idle_s)
+        timing['returned'] = time.perf_counter()
+
+    channel = EventChannel()
+    channel.start(work)
+    wakeups = 0
+    for _ in channel:
+        wakeups += 1
+    return time.perf_counter() - timing['returned'], wakeups - THOUGHTS
+
+
+def bench(fn) -> tuple:
+    idle = [IDLE_S + i * STAGGER_S for i in range(REPEAT)]
+    runs = [fn(idle_s) for idle_s in idle]
+    transition_ms = statistics.mean(t for t, _ in runs) * 1000
+    wakeups_per_s = sum(w for _, w in runs) / sum(idle)
+    return transition_ms, wakeups_per_s
+
+
+def main():
+    print(f"{THOUGHTS} thoughts, then {IDLE_S * 1000:.0f}+ ms idle, {REPEAT} runs")
+    for label, fn in (("poll (100 ms)", old_loop), ("event channel", new_loop)):
+        transition_ms, wakeups_per_s = bench(fn)
+        print(f"{label:>14}: transition {transition_ms:6.2f} ms  idle wakeups {wakeups_per_s:5.1f}/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmark: src.sse decoder vs the old iter_lines() SSE loop.
+
+Both sides get the same synthetic Gemini stream split into the same byte
+chunks, so the numbers compare decode + parse CPU per chunk only (no I/O).
+
+    cd narratives/agent && python -m benchmarks.bench_sse
+"""
+
+import json
+import time
+
+import requests
+
+from src.sse import _ORJSON_AVAILABLE, EVENT_TEXT, EVENT_THOUGHT, EVENT_USAGE, iter_gemini_events
+
+EVENTS = 200
+REPEAT = 50
+
+
+def build_stream() -> bytes:
+    """A thought-streaming Gemini response: thoughts, then text, then usage."""
+    events = []
+    for i in range(EVENTS):
+        part = {"text": f"Chunk {i}: " + "lorem ipsum dolor sit amet " * 12}
+        if i < EVENTS // 4:
+            part["thought"] = True
+        data = {
+            "candidates": [{"content": {"parts": [part], "role": "model"}, "index": 0}],
+            "modelVersion": "gemini-3-flash-preview",
+            "responseId": "bench",
+        }
+        if i == EVENTS - 1:
+            data["usageMetadata"] = {"promptTokenCount": 1200, "candidatesTokenCount": 4000, "totalTokenCount": 5200}
+        events.append(b"data: " + json.dumps(data).encode() + b"\r\n\r\n")
+    return b"".join(events)
+
+
+def old_loop(chunks: list) -> tuple:
+    """The loop the Gemini/KB/MCP call sites used before src.sse."""
+    response = requests.models.Response()
+    response.iter_content = lambda chunk_size=None, decode_unicode=False: iter(chunks)
+    text, thoughts, usage = "", "", None
+    for line in response.iter_lines():
+        if line:
+            line_str = line.decode('utf-8')
+            if line_str.startswith('data: '):
+                try:
+                    data = json.loads(line_str[6:])
+                    if 'usageMetadata' in data:
+                        usage = data['usageMetadata']
+                    if 'candidates' in data and data['candidates']:
+                        candidate = data['candidates'][0]
+                        if 'content' in candidate and 'parts' in candidate['content']:
+                            for part in candidate['content']['parts']:
+                                if 'text' in part:
+                                    if part.get('thought', False):
+                                        thoughts += part['text']
+                                    else:
+                                        text += part['text']
+                except json.JSONDecodeError:
+                    continue
+    return text, thoughts, usage
+
+
+def new_loop(chunks: list) -> tuple:
+    text, thoughts, usage = "", "", None
+    for kind, value in iter_gemini_events(chunks):
+        if kind == EVENT_USAGE:
+            usage = value
+        elif kind == EVENT_THOUGHT:
+            thoughts += value
+        elif kind == EVENT_TEXT:
+            text += value
+    return text, thoughts, usage
+
+
+def split(stream: bytes, size: int = 0) -> list:
+    """Per-event chunks (size=0, how Gemini frames them) or fixed-size slices."""
+    if not size:
+        return [event + b"\r\n\r\n" for event in stream.split(b"\r\n\r\n") if event]
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def bench(fn, chunks: list) -> float:
+    """Best-of-5 microseconds per chunk."""
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            fn(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best / REPEAT / len(chunks) * 1e6
+
+
+def main():
+    stream = build_stream()
+    print(f"{EVENTS} events, {len(stream) / 1024:.0f} KiB, orjson={'yes' if _ORJSON_AVAILABLE else 'no'}")
+    for label, size in (("per-event chunks", 0), ("1400 B chunks", 1400), ("16 KiB chunks", 16 * 1024)):
+        chunks = split(stream, size)
+        assert old_loop(chunks) == new_loop(chunks)
+        old_us, new_us = bench(old_loop, chunks), bench(new_loop, chunks)
+        print(f"{label:>17}: old {old_us:7.2f} us/chunk  new {new_us:7.2f} us/chunk  ({old_us / new_us:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
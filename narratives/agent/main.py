@@ -27,7 +27,8 @@ Usage:
 """
 
 from src.config import _bootstrap_config_from_url
-from src.mcp.client import get_tools, initialize_mcp, MCP_PORT
+from src.mcp.client import initialize_mcp, MCP_PORT
+from src.mcp.tool_catalog import get_tools
 from src.server.app import app, PROXY_PORT
 from src.server.routes import register_all
 
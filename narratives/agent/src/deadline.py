@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-turn latency budget shared by every phase of a chat turn.
+
+``chat_stream`` creates one ``Deadline`` per turn and carries it in
+``ctx['deadline']``. Each Gemini / MCP call derives its HTTP timeout from the
+time left (``request_timeout``) instead of a fixed 300s, and the key-retry
+passes stop at the turn deadline.
+
+The last ``synthesis_min_seconds`` of the budget are reserved for synthesis:
+MCP, KB and chart calls are bounded by the time left minus that reserve, and
+the synthesis call (through ``for_synthesis()``) is never given a timeout
+below it, even when the turn is already past its deadline.
+
+When time runs low the pipeline gives things up in a fixed order, each with
+its own "minimum time left" threshold under ``config["deadline"]``:
+
+1. ``skip_kb_below_seconds``: skip the knowledge-base search, or stop
+   waiting for it (it runs alongside MCP) and answer without its result
+2. ``stop_mcp_below_seconds``: start no further MCP tool-loop iterations
+3. ``drop_charts_below_seconds``: skip chart validation / stop waiting on the
+   chart-config thread
+
+Synthesis always runs, with at least ``synthesis_min_seconds`` to answer.
+
+The deadline is off by default (``config["deadline"]["enabled"]``); without
+it every call keeps the fixed 300s timeout.
+"""
+
+import copy
+
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Default ceiling for a single HTTP call when no deadline applies.
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 300
+# Never hand a request less than this, even past the deadline: a call that
+# starts anyway should fail on its own terms, not instantly.
+MIN_REQUEST_TIMEOUT_SECONDS = 1.0
+
+DEFAULT_TURN_BUDGET_SECONDS = 120
+DEFAULT_SYNTHESIS_MIN_SECONDS = 20
+DEFAULT_SKIP_KB_BELOW_SECONDS = 45
+DEFAULT_STOP_MCP_BELOW_SECONDS = 30
+DEFAULT_DROP_CHARTS_BELOW_SECONDS = 5
+
+STAGE_KB = "kb"
+STAGE_MCP = "mcp"
+STAGE_CHARTS = "charts"
+
+
+class Deadline:
+    """A point in time (``time.time()`` based) a chat turn should finish by."""
+
+    def __init__(self, budget_seconds: float, start: float = None, thresholds: dict = None,
+                 synthesis_min_seconds: float = DEFAULT_SYNTHESIS_MIN_SECONDS):
+        self.budget_seconds = budget_seconds
+        self.synthesis_min_seconds = synthesis_min_seconds
+        # Held back from this holder's calls, and the smallest timeout they get
+        self.reserve_seconds = synthesis_min_seconds
+        self.min_timeout = MIN_REQUEST_TIMEOUT_SECONDS
+        self.expires_at = (start if start is not None else time.time()) + budget_seconds
+        self.thresholds = {
+            STAGE_KB: DEFAULT_SKIP_KB_BELOW_SECONDS,
+            STAGE_MCP: DEFAULT_STOP_MCP_BELOW_SECONDS,
+            STAGE_CHARTS: DEFAULT_DROP_CHARTS_BELOW_SECONDS,
+        }
+        if thresholds:
+            self.thresholds.update(thresholds)
+        self.degraded = []
+
+    @classmethod
+    def from_config(cls, config: dict, start: float = None) -> Optional["Deadline"]:
+        """Build the turn deadline from ``config["deadline"]``, or None when
+        it is disabled (the default; calls then keep the 300s per-request
+        timeout)."""
+        settings = (config or {}).get("deadline", {})
+        if not settings.get("enabled", False):
+            return None
+        return cls(
+            settings.get("turn_budget_seconds", DEFAULT_TURN_BUDGET_SECONDS),
+            start=start,
+            thresholds={
+                STAGE_KB: settings.get("skip_kb_below_seconds", DEFAULT_SKIP_KB_BELOW_SECONDS),
+                STAGE_MCP: settings.get("stop_mcp_below_seconds", DEFAULT_STOP_MCP_BELOW_SECONDS),
+                STAGE_CHARTS: settings.get("drop_charts_below_seconds", DEFAULT_DROP_CHARTS_BELOW_SECONDS),
+            },
+            synthesis_min_seconds=settings.get("synthesis_min_seconds", DEFAULT_SYNTHESIS_MIN_SECONDS),
+        )
+
+    def for_synthesis(self) -> "Deadline":
+        """The same deadline for the synthesis call: it may spend the reserve,
+        and its timeout is never below ``synthesis_min_seconds``."""
+        view = copy.copy(self)  # shares ``degraded``
+        view.reserve_seconds = 0
+        view.min_timeout = max(self.synthesis_min_seconds, MIN_REQUEST_TIMEOUT_SECONDS)
+        return view
+
+    def remaining(self) -> float:
+        """Seconds left (negative once expired)."""
+        return self.expires_at - time.time()
+
+    def spendable(self) -> float:
+        """Seconds this holder's calls may use: the time left minus the
+        synthesis reserve (all of it for ``for_synthesis()``)."""
+        return self.remaining() - self.reserve_seconds
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def should_degrade(self, stage: str) -> bool:
+        """True when too little time is left to run ``stage`` (``STAGE_*``)."""
+        return self.remaining() < self.thresholds[stage]
+
+    def degrade(self, stage: str, session_logger=None) -> bool:
+        """``should_degrade`` that also records and logs the decision
+        (``DEADLINE_DEGRADED`` in the session log)."""
+        if not self.should_degrade(stage):
+            return False
+        self.mark_degraded(stage, session_logger)
+        return True
+
+    def mark_degraded(self, stage: str, session_logger=None) -> None:
+        """Record and log that ``stage`` was degraded, for callers that have
+        already decided (e.g. a timed wait for it ran out)."""
+        remaining = round(self.remaining(), 1)
+        self.degraded.append(stage)
+        logger.warning(f"Turn deadline: {remaining}s left, degrading '{stage}'")
+        if session_logger:
+            session_logger.log("DEADLINE_DEGRADED", {
+                "stage": stage,
+                "remaining_s": remaining,
+                "threshold_s": self.thresholds[stage],
+            })
+
+
+def request_timeout(deadline: Optional[Deadline], cap: float = DEFAULT_REQUEST_TIMEOUT_SECONDS) -> float:
+    """HTTP timeout for one call: the time ``deadline`` can spend, capped at
+    ``cap`` and never below its minimum (``MIN_REQUEST_TIMEOUT_SECONDS``, or
+    ``synthesis_min_seconds`` for synthesis)."""
+    if deadline is None:
+        return cap
+    return max(min(deadline.spendable(), cap), deadline.min_timeout)
+
+
+def retry_deadline(deadline: Optional[Deadline]) -> Optional[float]:
+    """The ``deadline`` argument for ``iter_key_attempts`` (None = its default):
+    the turn deadline, less the synthesis reserve outside synthesis."""
+    return deadline.expires_at - deadline.reserve_seconds if deadline is not None else None
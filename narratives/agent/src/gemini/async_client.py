@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""asyncio twin of ``src.gemini.client``.
+
+Same payloads, key scheduling, model ladder, hedging, context caching, retry
+passes, session logging and yielded shapes as the blocking client, but
+network waits are awaited on an ``httpx.AsyncClient`` instead of parking an
+OS thread, so one worker can hold many concurrent Gemini streams:
+
+    result = await gemini_request(messages, system, model)
+    async for chunk in await gemini_request(..., stream=True, include_thoughts=True):
+        ...  # {'type': 'thought'|'text', 'content': str}
+
+The chat pipeline runs the knowledge-base search this way
+(``execute_kb_query_async`` on the process-wide ``background_loop``, see
+``run_coroutine``). The AsyncClient comes from the shared pool
+(``get_http_pool().async_client``), so its connections show up in
+``/api/stats`` alongside the blocking ones.
+
+Everything but the waiting (payload, cache plan, key failures, event
+collection, usage logging) comes from ``src.gemini.call_plan`` and
+``hedging.HedgeRace``, shared with the blocking client.
+"""
+
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import threading
+import time
+from typing import AsyncGenerator, Optional
+
+import httpx
+
+from src.deadline import Deadline, request_timeout, retry_deadline
+from src.gemini.call_plan import CallPlan, StreamCollector, prepare_call, report_failure
+from src.gemini.hedging import (
+    RACE_WAIT,
+    RACE_WON,
+    HedgedStream,
+    HedgeRace,
+    RacerBase,
+    hedge_attempt,
+    hedge_delay,
+)
+from src.gemini.http_pool import get_http_pool
+from src.gemini.key_scheduler import RETRYABLE_STATUS_CODES, KeyAttempt, parse_retry_after
+from src.gemini.model_ladder import aiter_model_attempts
+from src.gemini.payload import PayloadBuilder
+from src.session_logger import SessionLogger
+from src.sse import aiter_gemini_events
+
+logger = logging.getLogger(__name__)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """The process-wide event loop for coroutines started from worker
+    threads (started on first use, on a daemon thread)."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="gemini-async", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run_coroutine(coro) -> concurrent.futures.Future:
+    """Run ``coro`` on ``background_loop()``; callable from any thread.
+    Cancelling the returned future cancels the coroutine."""
+    return asyncio.run_coroutine_threadsafe(coro, background_loop())
+
+
+async def open_stream(url: str, payload, timeout: float = 300) -> httpx.Response:
+    """POST ``payload`` (a dict, or bytes from ``PayloadBuilder``) and return
+    the response with the body still unread.
+
+    The caller must ``aclose()`` the response (``iter_stream_events`` does so once
+    the body is consumed).
+    """
+    pool = get_http_pool()
+    client = pool.async_client(asyncio.get_running_loop())
+    body = {"content": payload} if isinstance(payload, (bytes, bytearray)) else {"json": payload}
+    request = client.build_request(
+        "POST", url, **body,
+        headers={"Content-Type": "application/json"},
+        timeout=timeout, extensions=pool.async_request_extensions(),
+    )
+    return await client.send(request, stream=True)
+
+
+async def retry_on_status(attempt, response: httpx.Response, label: str = "") -> bool:
+    """Async counterpart of ``KeyAttempt.retry_on_status``: on 429/500/503
+    read and close the body, put the key into cooldown and return True."""
+    if response.status_code not in RETRYABLE_STATUS_CODES:
+        return False
+    await response.aread()
+    await response.aclose()
+    attempt.record_retryable_status(response.status_code, parse_retry_after(response), label)
+    return True
+
+
+async def iter_stream_events(stream: HedgedStream) -> AsyncGenerator[tuple, None]:
+    """Yield typed Gemini events (see ``src.sse``) from a stream, then close it."""
+    try:
+        async for event in aiter_gemini_events(stream.chunks):
+            yield event
+    finally:
+        await stream.response.aclose()
+
+
+async def call_thought_callback(callback, text: str):
+    """Call a thought callback that may be a plain function or a coroutine."""
+    result = callback(text)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _request(request_for: callable, api_key: str) -> tuple:
+    request = request_for(api_key)
+    if inspect.isawaitable(request):
+        request = await request
+    return request
+
+
+class _Racer(RacerBase):
+    """One in-flight copy of the request, run as a task up to its first body
+    chunk (async ``hedging._Racer``)."""
+
+    def __init__(self, attempt: KeyAttempt, request_for: callable, timeout: float):
+        super().__init__(attempt)
+        self.task = asyncio.ensure_future(self._run(request_for, timeout))
+
+    async def _run(self, request_for: callable, timeout: float):
+        start = time.time()
+        try:
+            url, payload = await _request(request_for, self.attempt.api_key)
+            self.response = await open_stream(url, payload, timeout=timeout)
+            if self.response.status_code == 200:
+                self._chunks = self.response.aiter_bytes()
+                self.first_chunk = await anext(self._chunks, b"")
+                self.first_byte_ms = (time.time() - start) * 1000
+        except asyncio.CancelledError:
+            await self._close()
+            raise
+        except Exception as e:
+            self.error = e
+
+    async def chunks(self):
+        if self._chunks is None:
+            async for chunk in self.response.aiter_bytes():
+                yield chunk
+            return
+        if self.first_chunk:
+            yield self.first_chunk
+        async for chunk in self._chunks:
+            yield chunk
+
+    async def cancel(self):
+        """Stop this copy; its key is released without a health penalty."""
+        self.attempt.cancelled()
+        if not self.task.done():
+            self.task.cancel()  # the task closes its own response
+        else:
+            await self._close()
+
+    async def _close(self):
+        if self.response is not None:
+            try:
+                await self.response.aclose()
+            except Exception:
+                pass
+
+    async def record_failure(self, label: str):
+        """Report this copy's 429/5xx or exception on its own attempt."""
+        if not self.record_error(label):
+            await retry_on_status(self.attempt, self.response, label=label)
+
+
+async def open_hedged_stream(
+    attempt: KeyAttempt,
+    keys: list,
+    request_for: callable,
+    call_type: Optional[str],
+    session_logger: Optional[SessionLogger] = None,
+    timeout: float = 300,
+    label: str = "",
+) -> HedgedStream:
+    """Async ``hedging.open_hedged_stream``: same arguments, race and logging.
+
+    ``request_for`` may also be a coroutine function. ``.chunks`` of the
+    result is an async iterator; read it with ``iter_stream_events``.
+    """
+    delay = hedge_delay(call_type)
+    if delay is None or len(keys) < 2:
+        url, payload = await _request(request_for, attempt.api_key)
+        response = await open_stream(url, payload, timeout=timeout)
+        return HedgedStream(attempt, response, response.aiter_bytes())
+
+    race = HedgeRace(_Racer(attempt, request_for, timeout), call_type, delay, session_logger)
+    racers = {race.primary.task: race.primary}
+    pending = {race.primary.task}
+    finished = []  # done, not yet looked at; primary first
+    loop = asyncio.get_running_loop()
+    hedge_at = loop.time() + delay
+
+    while True:
+        if not finished:
+            wait = max(hedge_at - loop.time(), 0) if race.hedge is None else None
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                duplicate = hedge_attempt(attempt, keys, call_type, delay, session_logger)
+                if duplicate is None:
+                    race.hedge = False  # No spare key; just wait for the primary
+                else:
+                    race.hedge = _Racer(duplicate, request_for, timeout)
+                    racers[race.hedge.task] = race.hedge
+                    pending.add(race.hedge.task)
+                continue
+            finished = sorted((racers[task] for task in done), key=lambda r: r is not race.primary)
+        racer = finished.pop(0)
+        outstanding = [racers[task] for task in pending] + finished
+
+        outcome = race.outcome(racer, outstanding)
+        if outcome == RACE_WON:
+            for loser in outstanding:
+                await loser.cancel()
+            if race.primary_failed(racer, outstanding):
+                await race.primary.record_failure(label)
+            return race.won(racer, len(outstanding))
+        if racer is not race.primary:
+            await racer.record_failure(label)
+        if outcome == RACE_WAIT:
+            continue
+        return race.primary.raise_or_return()
+
+
+async def _open_stream(plan: CallPlan, attempt: KeyAttempt, model: str, call_type: Optional[str],
+                       deadline: Optional[Deadline]) -> HedgedStream:
+    """Async ``client._open_stream``: hedged, with the context-cached body
+    when the plan has one, resent once uncached if it is rejected."""
+    async def request_for(key):
+        if plan.cache_plan is None:
+            return plan.url(model, key), plan.payload
+        # Creating a cache entry is a blocking call
+        return plan.url(model, key), await asyncio.to_thread(plan.body_for, key, model)
+
+    hedged = await open_hedged_stream(attempt, plan.keys, request_for, call_type, plan.session_logger,
+                                      timeout=request_timeout(deadline))
+    if plan.cache_plan is not None and plan.cache_plan.rejects(hedged.attempt.api_key, model, hedged.response.status_code):
+        await hedged.response.aclose()
+        hedged = await open_hedged_stream(hedged.attempt, plan.keys, request_for, call_type, plan.session_logger,
+                                          timeout=request_timeout(deadline))
+    return hedged
+
+
+async def gemini_request(
+    messages: list,
+    system_instruction: str,
+    model: str,
+    tools: list = None,
+    temperature: float = 0.3,
+    thinking_level: str = None,
+    response_schema: dict = None,
+    stream: bool = False,
+    session_logger: Optional[SessionLogger] = None,
+    include_thoughts: bool = False,
+    demo_mode: bool = False,
+    call_type: str = None,
+    deadline: Optional[Deadline] = None
+) -> AsyncGenerator | dict:
+    """Async ``gemini_request``: same arguments and results as the blocking one
+    (``call_type`` selects the model fallback ladder, hedging and context
+    caching).
+
+    Returns:
+        If stream=False: dict with response
+        If stream=True and include_thoughts=False: async generator yielding text chunks (str)
+        If stream=True and include_thoughts=True: async generator yielding dicts {'type': 'thought'|'text', 'content': str}
+    """
+    plan = prepare_call(
+        messages, system_instruction, model, tools, temperature, thinking_level, response_schema,
+        stream=stream, include_thoughts=include_thoughts, session_logger=session_logger,
+        demo_mode=demo_mode, call_type=call_type
+    )
+    if isinstance(plan, dict):
+        return plan
+
+    attempt = None
+    async for model, attempt in aiter_model_attempts(plan.keys, model, call_type, session_logger, deadline=retry_deadline(deadline)):
+        start_time = time.time()
+
+        try:
+            if stream:
+                hedged = await _open_stream(plan, attempt, model, call_type, deadline)
+                # A hedge on another key may have won the race
+                attempt = hedged.attempt
+                if await retry_on_status(attempt, hedged.response):
+                    continue
+                # The key stays in flight until the caller finishes the stream
+                attempt.succeeded(hold=True)
+                return _stream_gemini_response(
+                    hedged, session_logger, return_dicts=include_thoughts,
+                    on_complete=attempt.release, hedge_duplicates=hedged.duplicates
+                )
+
+            response = await open_stream(plan.url(model, attempt.api_key), plan.payload,
+                                         timeout=request_timeout(deadline))
+            if await retry_on_status(attempt, response):
+                continue
+            await response.aread()
+            await response.aclose()
+            attempt.succeeded()
+            result = response.json()
+            plan.log_response(model, result, start_time)
+            return result
+
+        except Exception as e:
+            report_failure(attempt, e, session_logger, details={"attempt": attempt.number, "model": model})
+            continue
+
+    return plan.exhausted(attempt)
+
+
+async def _stream_gemini_response(
+    stream: HedgedStream,
+    session_logger: Optional[SessionLogger] = None,
+    return_dicts: bool = False,
+    on_complete: callable = None,
+    hedge_duplicates: int = 0
+) -> AsyncGenerator:
+    """Async twin of ``client._stream_gemini_response``.
+
+    Yields:
+        If return_dicts=True: {'type': 'thought'|'text', 'content': str}
+        If return_dicts=False: str (text only)
+    """
+    collector = StreamCollector()
+    try:
+        async for kind, value in iter_stream_events(stream):
+            item = collector.stream_item(kind, value, return_dicts)
+            if item is not None:
+                yield item
+    finally:
+        if on_complete:
+            on_complete()
+
+    collector.log_stream_complete(session_logger, hedge_duplicates)
+
+
+async def gemini_request_with_thought_streaming(
+    messages: list,
+    system_instruction: str,
+    model: str,
+    tools: list = None,
+    temperature: float = 0.3,
+    thinking_level: str = None,
+    response_schema: dict = None,
+    session_logger: Optional[SessionLogger] = None,
+    thought_callback: callable = None,
+    demo_mode: bool = False,
+    call_type: str = None,
+    deadline: Optional[Deadline] = None,
+    payload_builder: Optional[PayloadBuilder] = None,
+    function_call_callback: callable = None
+) -> dict:
+    """Async ``gemini_request_with_thought_streaming``.
+
+    ``thought_callback`` may be a plain function or a coroutine function;
+    either way it receives each thought chunk as it arrives.
+    ``function_call_callback(part, stream_attempt)`` is called as in the
+    blocking client.
+
+    Returns:
+        dict: Complete response (same format as non-streaming gemini_request)
+    """
+    plan = prepare_call(
+        messages, system_instruction, model, tools, temperature, thinking_level, response_schema,
+        stream=True, include_thoughts=True, session_logger=session_logger,
+        demo_mode=demo_mode, call_type=call_type, payload_builder=payload_builder
+    )
+    if isinstance(plan, dict):
+        return plan
+
+    attempt = None
+    stream_attempt = -1
+    async for model, attempt in aiter_model_attempts(plan.keys, model, call_type, session_logger, deadline=retry_deadline(deadline)):
+        stream_attempt += 1
+        collector = StreamCollector(function_call_callback, stream_attempt)
+
+        try:
+            hedged = await _open_stream(plan, attempt, model, call_type, deadline)
+            # A hedge on another key may have won the race
+            attempt = hedged.attempt
+            if await retry_on_status(attempt, hedged.response):
+                continue
+            attempt.succeeded(hold=True)
+
+            async for kind, value in iter_stream_events(hedged):
+                thought = collector.add(kind, value)
+                if thought and thought_callback:
+                    await call_thought_callback(thought_callback, thought)
+
+            attempt.release()
+            return collector.finish(model, session_logger, hedged.duplicates)
+
+        except Exception as e:
+            report_failure(attempt, e, session_logger, details={"attempt": attempt.number, "model": model})
+            continue
+
+    return plan.exhausted(attempt)
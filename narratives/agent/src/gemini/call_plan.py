@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Everything about a Gemini call except its I/O.
+
+The blocking client (``src.gemini.client``) and the asyncio one
+(``src.gemini.async_client``) differ only in how they wait: ``for`` or
+``async for`` over key attempts, streams and events. What they send and how
+they account for it lives here, so the two cannot drift apart:
+
+- ``prepare_call`` builds the payload and context-cache plan, picks the keys
+  and logs ``GEMINI_REQUEST``; the ``CallPlan`` it returns gives each key's
+  URL and body and logs the response.
+- ``report_failure`` and ``CallPlan.exhausted`` handle a failed attempt and
+  the give-up error.
+- ``StreamCollector`` turns the typed SSE events (``src.sse``) into the
+  response dict, fires the function-call callback and logs token usage.
+"""
+
+import logging
+import time
+from typing import Optional
+
+from src.config import get_api_keys, load_config
+from src.gemini.context_cache import CachePlan, context_cache_plan
+from src.gemini.key_scheduler import OUTCOME_TIMEOUT, KeyAttempt, failure_outcome
+from src.gemini.payload import PayloadBuilder, build_gemini_payload
+from src.session_logger import SessionLogger
+from src.sse import (
+    EVENT_FUNCTION_CALL,
+    EVENT_GROUNDING,
+    EVENT_TEXT,
+    EVENT_THOUGHT,
+    EVENT_USAGE,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://generativelanguage.googleapis.com/v1beta/models"
+
+
+def api_base(config: dict) -> str:
+    return config.get("gemini", {}).get("api_base", DEFAULT_API_BASE)
+
+
+class CallPlan:
+    """One prepared Gemini call: its keys, body and per-key request."""
+
+    __slots__ = ("api_base", "keys", "payload", "cache_plan", "endpoint", "session_logger")
+
+    def __init__(self, api_base: str, keys: list, payload, cache_plan: Optional[CachePlan],
+                 stream: bool, session_logger: Optional[SessionLogger]):
+        self.api_base = api_base
+        self.keys = keys
+        self.payload = payload
+        self.cache_plan = cache_plan
+        self.endpoint = "streamGenerateContent" if stream else "generateContent"
+        self.session_logger = session_logger
+
+    def url(self, model: str, api_key: str) -> str:
+        url = f"{self.api_base}/{model}:{self.endpoint}?key={api_key}"
+        return url + "&alt=sse" if self.endpoint == "streamGenerateContent" else url
+
+    def body_for(self, api_key: str, model: str):
+        """The body to send on ``api_key``: context-cached when there is a
+        cache plan (this may create the cache entry, a blocking call)."""
+        if self.cache_plan is None:
+            return self.payload
+        return self.cache_plan.body_for(api_key, model)
+
+    def request_for(self, model: str) -> callable:
+        """``request_for(api_key) -> (url, body)`` for ``open_hedged_stream``."""
+        return lambda api_key: (self.url(model, api_key), self.body_for(api_key, model))
+
+    def log_response(self, model: str, result: dict, start_time: float) -> None:
+        """Log a non-streamed response and its token usage."""
+        if self.session_logger:
+            self.session_logger.log_gemini_response(model, result, (time.time() - start_time) * 1000)
+            self.session_logger.add_usage(result.get("usageMetadata"))
+
+    def exhausted(self, attempt: Optional[KeyAttempt]) -> dict:
+        """The error result once every key (and fallback model) has failed."""
+        last_error = attempt.last_error if attempt else None
+        error_msg = f"All {len(self.keys)} API keys failed. Last error: {last_error}"
+        logger.error(error_msg)
+        if self.session_logger:
+            self.session_logger.log_error("GEMINI_ALL_KEYS_EXHAUSTED", error_msg, {"total_keys": len(self.keys)})
+        return {"error": error_msg}
+
+
+def prepare_call(
+    messages: list,
+    system_instruction: str,
+    model: str,
+    tools: list = None,
+    temperature: float = 0.3,
+    thinking_level: str = None,
+    response_schema: dict = None,
+    stream: bool = False,
+    include_thoughts: bool = False,
+    session_logger: Optional[SessionLogger] = None,
+    demo_mode: bool = False,
+    call_type: str = None,
+    payload_builder: Optional[PayloadBuilder] = None,
+) -> CallPlan | dict:
+    """Build and log the request shared by every attempt of one call.
+
+    includeThoughts is only requested for streams whose caller wants the
+    thoughts. Streams may reference an explicit ``cachedContents`` entry for
+    the static prefix (see ``src.gemini.context_cache``). With
+    ``payload_builder`` its body is sent and ``messages`` is only logged.
+
+    Returns:
+        The ``CallPlan``, or an error dict when no API keys are configured.
+    """
+    config = load_config()
+
+    # Get all available keys (demo or regular based on mode)
+    keys = get_api_keys(demo_mode=demo_mode)
+    if not keys:
+        return {"error": "No Gemini API keys configured in config.json"}
+
+    if payload_builder is not None:
+        payload = payload_builder.body()
+    else:
+        payload = build_gemini_payload(
+            messages, system_instruction, tools, temperature, thinking_level,
+            response_schema, include_thoughts=(stream and include_thoughts)
+        )
+
+    cache_plan = None
+    if stream:
+        cache_plan = context_cache_plan(
+            api_base(config), call_type, payload_builder if payload_builder is not None else payload, session_logger
+        )
+
+    plan = CallPlan(api_base(config), keys, payload, cache_plan, stream, session_logger)
+
+    # Log request (once, before attempting)
+    if session_logger:
+        session_logger.log_gemini_request(model, plan.endpoint, {
+            "messages_count": len(messages),
+            "has_tools": bool(tools),
+            "tool_count": len(tools) if tools else 0,
+            "temperature": temperature,
+            "thinking_level": thinking_level,
+            "has_response_schema": bool(response_schema),
+            "stream": stream,
+            "include_thoughts": stream and include_thoughts,
+            "total_keys_available": len(keys)
+        })
+    return plan
+
+
+def report_failure(attempt: KeyAttempt, error: Exception, session_logger: Optional[SessionLogger],
+                   error_event: str = "GEMINI_API_ERROR", details: dict = None, label: str = "") -> None:
+    """Record a failed attempt (timeout, broken stream or other error) on its
+    key and log it; the caller then moves on to the next attempt."""
+    outcome = failure_outcome(error)
+    if outcome == OUTCOME_TIMEOUT:
+        attempt.failed(OUTCOME_TIMEOUT, "Request timeout")
+        logger.warning(f"{label}Request timeout, trying next key...")
+        return
+    attempt.failed(outcome, str(error))
+    logger.error(f"{label}Gemini API error: {error}")
+    if session_logger:
+        session_logger.log_error(error_event, str(error), details or {"attempt": attempt.number})
+
+
+class StreamCollector:
+    """The events of one Gemini stream, accumulated as they are read.
+
+    Args:
+        function_call_callback: Optional ``callback(part, stream_attempt)``
+            called with each complete ``functionCall`` part as it is parsed.
+        stream_attempt: Passed to ``function_call_callback``.
+    """
+
+    __slots__ = ("text", "thoughts", "function_calls", "usage", "grounding",
+                 "function_call_callback", "stream_attempt", "start_time")
+
+    def __init__(self, function_call_callback: callable = None, stream_attempt: int = 0):
+        self.text = ""
+        self.thoughts = ""
+        self.function_calls = []
+        # Token counts arrive on the final SSE chunk (cumulative for this
+        # call); the latest seen is kept.
+        self.usage = None
+        self.grounding = {}
+        self.function_call_callback = function_call_callback
+        self.stream_attempt = stream_attempt
+        self.start_time = time.time()
+
+    def add(self, kind: str, value) -> Optional[str]:
+        """Record one ``(kind, value)`` event. Returns the text of a thought
+        (for the caller's thought callback, plain or awaited), else None."""
+        if kind == EVENT_USAGE:
+            self.usage = value
+        elif kind == EVENT_GROUNDING:
+            self.grounding = value
+        elif kind == EVENT_FUNCTION_CALL:
+            self.function_calls.append(value)
+            if self.function_call_callback:
+                self.function_call_callback(value, self.stream_attempt)
+        elif kind == EVENT_THOUGHT:
+            self.thoughts += value
+            return value
+        elif kind == EVENT_TEXT:
+            self.text += value
+        return None
+
+    def stream_item(self, kind: str, value, return_dicts: bool):
+        """Record an event and return what a streaming ``gemini_request``
+        yields for it, or None: ``{'type', 'content'}`` dicts, or text
+        strings only when ``return_dicts`` is False."""
+        self.add(kind, value)
+        if kind == EVENT_THOUGHT and return_dicts:
+            return {'type': 'thought', 'content': value}
+        if kind == EVENT_TEXT:
+            return {'type': 'text', 'content': value} if return_dicts else value
+        return None
+
+    def result(self) -> dict:
+        """The response in the non-streaming format."""
+        result_parts = list(self.function_calls)
+        if self.text:
+            result_parts.append({"text": self.text})
+        result = {
+            "candidates": [{
+                "content": {
+                    "parts": result_parts,
+                    "role": "model"
+                }
+            }]
+        }
+        if self.usage:
+            result["usageMetadata"] = self.usage
+        return result
+
+    def log_usage(self, session_logger: Optional[SessionLogger], hedge_duplicates: int = 0) -> None:
+        """Accumulate this call's token usage (and its cancelled hedges')
+        into the request total."""
+        if session_logger:
+            session_logger.add_usage(self.usage)
+            session_logger.add_hedge_usage(self.usage, hedge_duplicates)
+
+    def finish(self, model: str, session_logger: Optional[SessionLogger], hedge_duplicates: int = 0) -> dict:
+        """Log the usage and the collected response; returns ``result()``."""
+        self.log_usage(session_logger, hedge_duplicates)
+        result = self.result()
+        if session_logger:
+            session_logger.log_gemini_response(model, result, (time.time() - self.start_time) * 1000)
+            if self.thoughts:
+                session_logger.log("THOUGHTS_STREAMED", {
+                    "thoughts_length": len(self.thoughts)
+                })
+        return result
+
+    def log_stream_complete(self, session_logger: Optional[SessionLogger], hedge_duplicates: int = 0) -> None:
+        """Log the usage and ``GEMINI_STREAM_COMPLETE`` for a stream handed
+        to the caller chunk by chunk."""
+        self.log_usage(session_logger, hedge_duplicates)
+        if session_logger:
+            session_logger.log("GEMINI_STREAM_COMPLETE", {
+                "duration_ms": round((time.time() - self.start_time) * 1000, 2),
+                "total_text_length": len(self.text),
+                "total_thoughts_length": len(self.thoughts)
+            })
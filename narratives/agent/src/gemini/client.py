@@ -13,46 +13,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import logging
-import random
 import time
 from typing import Generator, Optional
 
-import requests
-
-from src.config import get_api_keys, inject_datetime, load_config
+from src.config import load_config
+from src.deadline import Deadline, request_timeout, retry_deadline
+from src.gemini.call_plan import CallPlan, StreamCollector, prepare_call, report_failure
+from src.gemini.hedging import HedgedStream, open_hedged_stream
+from src.gemini.http_pool import get_http_pool
+from src.gemini.model_ladder import iter_model_attempts
+from src.gemini.payload import PayloadBuilder, post_payload
 from src.session_logger import SessionLogger
+from src.sse import iter_gemini_events
 
 logger = logging.getLogger(__name__)
 
 
-def build_thinking_config(thinking_value: str, include_thoughts: bool = False) -> dict:
-    """Build thinking configuration for Gemini 3 models.
-
-    Args:
-        thinking_value: Thinking level ('minimal', 'low', 'medium', 'high')
-        include_thoughts: If True, includes thought summaries in the response
-
-    Returns:
-        dict: thinkingConfig for Gemini generationConfig
-    """
-    # Gemini 3 Flash valid levels
-    valid_levels = ["minimal", "low", "medium", "high"]
-    level = thinking_value.lower() if thinking_value.lower() in valid_levels else "low"
-
-    config = {
-        "thinkingConfig": {
-            "thinkingLevel": level  # Gemini 3 format (string)
-        }
-    }
-
-    if include_thoughts:
-        config["thinkingConfig"]["includeThoughts"] = True
-
-    return config
-
-
 def gemini_request(
     messages: list,
     system_instruction: str,
@@ -64,7 +41,9 @@ def gemini_request(
     stream: bool = False,
     session_logger: Optional[SessionLogger] = None,
     include_thoughts: bool = False,
-    demo_mode: bool = False
+    demo_mode: bool = False,
+    call_type: str = None,
+    deadline: Optional[Deadline] = None
 ) -> Generator | dict:
     """Make a request to the Gemini API with key rotation and retry.
 
@@ -81,217 +60,111 @@ def gemini_request(
         include_thoughts: If True (and stream=True), yields dicts with 'type' and 'content'
                          for both thoughts and text. If False, yields plain text strings.
         demo_mode: If True, uses demo API keys reserved for internal demos.
+        call_type: Optional call type ('mcp', 'kb', 'synthesis'); selects the
+                   model fallback ladder (see src.gemini.model_ladder), and streams
+                   are hedged when enabled for it (see src.gemini.hedging).
+        deadline: Optional turn ``Deadline``; per-call timeouts and key retries
+                  are bounded by the time it has left.
 
     Returns:
         If stream=False: dict with response
         If stream=True and include_thoughts=False: Generator yielding text chunks (str)
         If stream=True and include_thoughts=True: Generator yielding dicts {'type': 'thought'|'text', 'content': str}
     """
-    config = load_config()
-    api_base = config.get("gemini", {}).get("api_base", "https://generativelanguage.googleapis.com/v1beta/models")
-
-    # Get all available keys (demo or regular based on mode)
-    all_keys = get_api_keys(demo_mode=demo_mode)
-    if not all_keys:
-        return {"error": "No Gemini API keys configured in config.json"}
-
-    # Shuffle keys for random order
-    keys_to_try = all_keys.copy()
-    random.shuffle(keys_to_try)
-
-    # Build the payload (same for all attempts)
-    payload = {
-        "contents": messages,
-        "generationConfig": {
-            "temperature": temperature,
-        }
-    }
-
-    if system_instruction:
-        payload["systemInstruction"] = {
-            "parts": [{"text": inject_datetime(system_instruction)}]
-        }
-
-    if tools:
-        payload["tools"] = [{"functionDeclarations": tools}]
-
-    if thinking_level:
-        # Enable includeThoughts in API if caller wants thought streaming
-        payload["generationConfig"].update(
-            build_thinking_config(thinking_level, include_thoughts=(stream and include_thoughts))
-        )
-
-    if response_schema:
-        payload["generationConfig"]["responseMimeType"] = "application/json"
-        payload["generationConfig"]["responseSchema"] = response_schema
-
-    endpoint = "streamGenerateContent" if stream else "generateContent"
-
-    # Log request (once, before attempting)
-    if session_logger:
-        session_logger.log_gemini_request(model, endpoint, {
-            "messages_count": len(messages),
-            "has_tools": bool(tools),
-            "tool_count": len(tools) if tools else 0,
-            "temperature": temperature,
-            "thinking_level": thinking_level,
-            "has_response_schema": bool(response_schema),
-            "stream": stream,
-            "total_keys_available": len(all_keys)
-        })
-
-    last_error = None
-    attempt_count = 0
-
-    for api_key in keys_to_try:
-        attempt_count += 1
-
-        # Build URL with current key
-        url = f"{api_base}/{model}:{endpoint}"
-        if stream:
-            url += f"?key={api_key}&alt=sse"
-        else:
-            url += f"?key={api_key}"
-
-        # Log retry attempt (if not first attempt)
-        if attempt_count > 1 and session_logger:
-            session_logger.log("GEMINI_KEY_ROTATION", {
-                "attempt": attempt_count,
-                "total_keys": len(all_keys),
-                "reason": str(last_error)
-            })
-
+    plan = prepare_call(
+        messages, system_instruction, model, tools, temperature, thinking_level, response_schema,
+        stream=stream, include_thoughts=include_thoughts, session_logger=session_logger,
+        demo_mode=demo_mode, call_type=call_type
+    )
+    if isinstance(plan, dict):
+        return plan
+
+    # Keys are tried healthiest-first (see key_scheduler), each at most once;
+    # with a fallback ladder for call_type, then on the next model
+    attempt = None
+    for model, attempt in iter_model_attempts(plan.keys, model, call_type, session_logger, deadline=retry_deadline(deadline)):
         start_time = time.time()
 
         try:
             if stream:
-                response = requests.post(
-                    url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    stream=True,
-                    timeout=300
-                )
-                # Check for rate limit before streaming
-                if response.status_code == 429:
-                    last_error = "Rate limited (429)"
-                    logger.warning(f"API key rate limited, switching to next key...")
+                hedged = _open_stream(plan, attempt, model, call_type, deadline)
+                # A hedge on another key may have won the race
+                attempt = hedged.attempt
+                # Check for rate limit / server errors before streaming
+                if attempt.retry_on_status(hedged.response):
                     continue  # Immediately try next key
-                if response.status_code in [500, 503]:
-                    last_error = f"Server error ({response.status_code})"
-                    logger.warning(f"Server error {response.status_code}, switching to next key...")
-                    continue  # Try next key
-                return _stream_gemini_response(response, session_logger, return_dicts=include_thoughts)
-            else:
-                response = requests.post(
-                    url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=300
+                # The key stays in flight until the caller finishes the stream
+                attempt.succeeded(hold=True)
+                return _stream_gemini_response(
+                    hedged.chunks, session_logger, return_dicts=include_thoughts,
+                    on_complete=attempt.release, hedge_duplicates=hedged.duplicates
                 )
 
-                # Check for rate limit - immediately switch key
-                if response.status_code == 429:
-                    last_error = "Rate limited (429)"
-                    logger.warning(f"API key rate limited, switching to next key...")
-                    continue  # Immediately try next key
-
-                # Check for other retryable errors (500, 503)
-                if response.status_code in [500, 503]:
-                    last_error = f"Server error ({response.status_code})"
-                    logger.warning(f"Server error {response.status_code}, switching to next key...")
-                    continue  # Try next key
-
-                result = response.json()
-
-                # Log response
-                if session_logger:
-                    duration_ms = (time.time() - start_time) * 1000
-                    session_logger.log_gemini_response(model, result, duration_ms)
-                    session_logger.add_usage(result.get("usageMetadata"))
-
-                return result
+            response = post_payload(get_http_pool(), plan.url(model, attempt.api_key), plan.payload,
+                                    timeout=request_timeout(deadline))
+            # Check for rate limit / server errors - immediately switch key
+            if attempt.retry_on_status(response):
+                continue  # Immediately try next key
+            attempt.succeeded()
+            result = response.json()
+            plan.log_response(model, result, start_time)
+            return result
 
-        except requests.exceptions.Timeout:
-            last_error = "Request timeout"
-            logger.warning(f"Request timeout, trying next key...")
-            continue
         except Exception as e:
-            last_error = str(e)
-            logger.error(f"Gemini API error: {e}")
-            if session_logger:
-                session_logger.log_error("GEMINI_API_ERROR", str(e), {"attempt": attempt_count, "model": model})
+            report_failure(attempt, e, session_logger, details={"attempt": attempt.number, "model": model})
             continue
 
     # All keys exhausted
-    error_msg = f"All {len(all_keys)} API keys failed. Last error: {last_error}"
-    logger.error(error_msg)
-    if session_logger:
-        session_logger.log_error("GEMINI_ALL_KEYS_EXHAUSTED", error_msg, {"total_keys": len(all_keys)})
-    return {"error": error_msg}
+    return plan.exhausted(attempt)
+
 
+def _open_stream(plan: CallPlan, attempt, model: str, call_type: Optional[str],
+                 deadline: Optional[Deadline]) -> HedgedStream:
+    """``open_hedged_stream`` for one model, sending the context-cached body
+    when the plan has one. If Gemini rejects the cache reference (expired or
+    deleted) the request is resent once, uncached, on that key."""
+    request_for = plan.request_for(model)
+    hedged = open_hedged_stream(attempt, plan.keys, request_for, call_type, plan.session_logger,
+                                timeout=request_timeout(deadline))
+    if plan.cache_plan is not None and plan.cache_plan.rejected(hedged.attempt.api_key, model, hedged.response):
+        hedged = open_hedged_stream(hedged.attempt, plan.keys, request_for, call_type, plan.session_logger,
+                                    timeout=request_timeout(deadline))
+    return hedged
 
-def _stream_gemini_response(response, session_logger: Optional[SessionLogger] = None, return_dicts: bool = False) -> Generator:
+
+def _stream_gemini_response(
+    chunks,
+    session_logger: Optional[SessionLogger] = None,
+    return_dicts: bool = False,
+    on_complete: callable = None,
+    hedge_duplicates: int = 0
+) -> Generator:
     """Parse streaming response from Gemini API.
 
     Args:
-        response: The requests response object with streaming enabled
+        chunks: Raw body chunks of the streaming response (``HedgedStream.chunks``)
         session_logger: Optional SessionLogger for logging
         return_dicts: If True, yields dicts with 'type' and 'content' keys
                       for both thoughts and text. If False, yields plain text strings.
+        on_complete: Optional callback run once the stream ends or is abandoned
+                     (used to release the API key back to the scheduler).
+        hedge_duplicates: Cancelled hedge requests to bill against this call's prompt.
 
     Yields:
         If return_dicts=True: {'type': 'thought'|'text', 'content': str}
         If return_dicts=False: str (text only, for backward compatibility)
     """
-    start_time = time.time()
-    total_text = ""
-    total_thoughts = ""
-    usage_metadata = None
-
-    for line in response.iter_lines():
-        if line:
-            line_str = line.decode('utf-8')
-            if line_str.startswith('data: '):
-                try:
-                    data = json.loads(line_str[6:])
-                    # Token counts arrive on the final SSE chunk (cumulative for
-                    # this call); keep the latest seen.
-                    if 'usageMetadata' in data:
-                        usage_metadata = data['usageMetadata']
-                    if 'candidates' in data and data['candidates']:
-                        candidate = data['candidates'][0]
-                        if 'content' in candidate and 'parts' in candidate['content']:
-                            for part in candidate['content']['parts']:
-                                if 'text' in part:
-                                    # Check if this is a thought summary or regular text
-                                    is_thought = part.get('thought', False)
-                                    if is_thought:
-                                        total_thoughts += part['text']
-                                        if return_dicts:
-                                            yield {'type': 'thought', 'content': part['text']}
-                                        # Skip thoughts in legacy mode (return_dicts=False)
-                                    else:
-                                        total_text += part['text']
-                                        if return_dicts:
-                                            yield {'type': 'text', 'content': part['text']}
-                                        else:
-                                            yield part['text']
-                except json.JSONDecodeError:
-                    continue
-
-    # Accumulate this call's token usage into the request total.
-    if session_logger:
-        session_logger.add_usage(usage_metadata)
-
-    # Log streaming completion
-    if session_logger:
-        duration_ms = (time.time() - start_time) * 1000
-        session_logger.log("GEMINI_STREAM_COMPLETE", {
-            "duration_ms": round(duration_ms, 2),
-            "total_text_length": len(total_text),
-            "total_thoughts_length": len(total_thoughts)
-        })
+    collector = StreamCollector()
+    try:
+        for kind, value in iter_gemini_events(chunks):
+            item = collector.stream_item(kind, value, return_dicts)
+            if item is not None:
+                yield item
+    finally:
+        if on_complete:
+            on_complete()
+
+    collector.log_stream_complete(session_logger, hedge_duplicates)
 
 
 def gemini_request_with_thought_streaming(
@@ -304,7 +177,11 @@ def gemini_request_with_thought_streaming(
     response_schema: dict = None,
     session_logger: Optional[SessionLogger] = None,
     thought_callback: callable = None,
-    demo_mode: bool = False
+    demo_mode: bool = False,
+    call_type: str = None,
+    deadline: Optional[Deadline] = None,
+    payload_builder: Optional[PayloadBuilder] = None,
+    function_call_callback: callable = None
 ) -> dict:
     """Make a streaming Gemini request, calling thought_callback for thoughts but returning complete response.
 
@@ -323,177 +200,67 @@ def gemini_request_with_thought_streaming(
         thought_callback: Optional callback function called with each thought chunk.
                          Signature: callback(thought_text: str) -> None
         demo_mode: If True, uses demo API keys reserved for internal demos.
+        call_type: Optional call type ('mcp', 'kb', 'synthesis'); selects the
+                   model fallback ladder and hedging (see src.gemini.model_ladder
+                   and src.gemini.hedging).
+        deadline: Optional turn ``Deadline``; per-call timeouts and key retries
+                  are bounded by the time it has left.
+        payload_builder: Optional ``gemini_payload_builder`` (built with
+                  include_thoughts=True) whose body is sent instead of one built
+                  from the arguments above; ``messages`` is then only logged.
+        function_call_callback: Optional callback called with each complete
+                  ``functionCall`` part as soon as it is parsed, before the
+                  stream ends (e.g. to start the tool call early).
+                  Signature: callback(part: dict, stream_attempt: int) -> None.
+                  ``stream_attempt`` counts the streams read for this request
+                  from 0; parts from a lower one came from a stream that broke
+                  and was sent again, and are not in the result.
 
     Returns:
         dict: Complete response (same format as non-streaming gemini_request)
     """
-    config = load_config()
-    api_base = config.get("gemini", {}).get("api_base", "https://generativelanguage.googleapis.com/v1beta/models")
-
-    # Get all available keys (demo or regular based on mode)
-    all_keys = get_api_keys(demo_mode=demo_mode)
-    if not all_keys:
-        return {"error": "No Gemini API keys configured in config.json"}
-
-    # Shuffle keys for random order
-    keys_to_try = all_keys.copy()
-    random.shuffle(keys_to_try)
-
-    # Build payload
-    payload = {
-        "contents": messages,
-        "generationConfig": {
-            "temperature": temperature,
-        }
-    }
-
-    if system_instruction:
-        payload["systemInstruction"] = {
-            "parts": [{"text": inject_datetime(system_instruction)}]
-        }
-
-    if tools:
-        payload["tools"] = [{"functionDeclarations": tools}]
-
-    if thinking_level:
-        # Enable includeThoughts for streaming thought summaries
-        payload["generationConfig"].update(
-            build_thinking_config(thinking_level, include_thoughts=True)
-        )
-
-    if response_schema:
-        payload["generationConfig"]["responseMimeType"] = "application/json"
-        payload["generationConfig"]["responseSchema"] = response_schema
-
-    # Log request
-    if session_logger:
-        session_logger.log_gemini_request(model, "streamGenerateContent", {
-            "messages_count": len(messages),
-            "has_tools": bool(tools),
-            "tool_count": len(tools) if tools else 0,
-            "temperature": temperature,
-            "thinking_level": thinking_level,
-            "include_thoughts": True,
-            "total_keys_available": len(all_keys)
-        })
-
-    last_error = None
-    attempt_count = 0
-
-    for api_key in keys_to_try:
-        attempt_count += 1
-
-        # Build URL for streaming
-        url = f"{api_base}/{model}:streamGenerateContent?key={api_key}&alt=sse"
-
-        # Log retry attempt (if not first attempt)
-        if attempt_count > 1 and session_logger:
-            session_logger.log("GEMINI_KEY_ROTATION", {
-                "attempt": attempt_count,
-                "total_keys": len(all_keys),
-                "reason": str(last_error)
-            })
-
-        start_time = time.time()
+    plan = prepare_call(
+        messages, system_instruction, model, tools, temperature, thinking_level, response_schema,
+        stream=True, include_thoughts=True, session_logger=session_logger,
+        demo_mode=demo_mode, call_type=call_type, payload_builder=payload_builder
+    )
+    if isinstance(plan, dict):
+        return plan
+
+    # Keys are tried healthiest-first (see key_scheduler), each at most once;
+    # with a fallback ladder for call_type, then on the next model
+    attempt = None
+    stream_attempt = -1
+    for model, attempt in iter_model_attempts(plan.keys, model, call_type, session_logger, deadline=retry_deadline(deadline)):
+        stream_attempt += 1
+        collector = StreamCollector(function_call_callback, stream_attempt)
 
         try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                stream=True,
-                timeout=300
-            )
-
-            # Check for rate limit before streaming
-            if response.status_code == 429:
-                last_error = "Rate limited (429)"
-                logger.warning(f"API key rate limited, switching to next key...")
-                continue
-            if response.status_code in [500, 503]:
-                last_error = f"Server error ({response.status_code})"
-                logger.warning(f"Server error {response.status_code}, switching to next key...")
+            hedged = _open_stream(plan, attempt, model, call_type, deadline)
+            # A hedge on another key may have won the race
+            attempt = hedged.attempt
+
+            # Check for rate limit / server errors before streaming
+            if attempt.retry_on_status(hedged.response):
                 continue
+            # The key stays in flight while the stream is read
+            attempt.succeeded(hold=True)
 
             # Collect response while streaming thoughts
-            collected_text = ""
-            collected_function_calls = []
-            collected_thoughts = ""
-            collected_usage = None
-
-            for line in response.iter_lines():
-                if line:
-                    line_str = line.decode('utf-8')
-                    if line_str.startswith('data: '):
-                        try:
-                            data = json.loads(line_str[6:])
-                            if 'usageMetadata' in data:
-                                collected_usage = data['usageMetadata']
-                            if 'candidates' in data and data['candidates']:
-                                candidate = data['candidates'][0]
-                                if 'content' in candidate and 'parts' in candidate['content']:
-                                    for part in candidate['content']['parts']:
-                                        if 'functionCall' in part:
-                                            collected_function_calls.append(part)
-                                        elif 'text' in part:
-                                            is_thought = part.get('thought', False)
-                                            if is_thought:
-                                                collected_thoughts += part['text']
-                                                if thought_callback:
-                                                    thought_callback(part['text'])
-                                            else:
-                                                collected_text += part['text']
-                        except json.JSONDecodeError:
-                            continue
-
-            # Accumulate this call's token usage into the request total.
-            if session_logger:
-                session_logger.add_usage(collected_usage)
-
-            # Build response in same format as non-streaming
-            result_parts = []
-            for fc in collected_function_calls:
-                result_parts.append(fc)
-            if collected_text:
-                result_parts.append({"text": collected_text})
-
-            result = {
-                "candidates": [{
-                    "content": {
-                        "parts": result_parts,
-                        "role": "model"
-                    }
-                }]
-            }
-
-            # Log response
-            if session_logger:
-                duration_ms = (time.time() - start_time) * 1000
-                session_logger.log_gemini_response(model, result, duration_ms)
-                if collected_thoughts:
-                    session_logger.log("THOUGHTS_STREAMED", {
-                        "thoughts_length": len(collected_thoughts)
-                    })
+            for kind, value in iter_gemini_events(hedged.chunks):
+                thought = collector.add(kind, value)
+                if thought and thought_callback:
+                    thought_callback(thought)
 
-            return result
+            attempt.release()
+            return collector.finish(model, session_logger, hedged.duplicates)
 
-        except requests.exceptions.Timeout:
-            last_error = "Request timeout"
-            logger.warning(f"Request timeout, trying next key...")
-            continue
         except Exception as e:
-            last_error = str(e)
-            logger.error(f"Gemini API error: {e}")
-            if session_logger:
-                session_logger.log_error("GEMINI_API_ERROR", str(e), {"attempt": attempt_count, "model": model})
+            report_failure(attempt, e, session_logger, details={"attempt": attempt.number, "model": model})
             continue
 
     # All keys exhausted
-    error_msg = f"All {len(all_keys)} API keys failed. Last error: {last_error}"
-    logger.error(error_msg)
-    if session_logger:
-        session_logger.log_error("GEMINI_ALL_KEYS_EXHAUSTED", error_msg, {"total_keys": len(all_keys)})
-    return {"error": error_msg}
+    return plan.exhausted(attempt)
 
 
 def get_api_key_filestore_mapping(demo_mode: bool = False) -> dict:
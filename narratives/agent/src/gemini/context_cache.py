@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Explicit Gemini context caching (``cachedContents``) for static prefixes.
+
+The MCP system prompt and every tool declaration are re-sent, and re-billed
+as input, on every tool-loop iteration of every turn; synthesis re-sends its
+prompt the same way. With ``config["gemini"]["context_cache"]`` enabled, those
+static members (system instruction, tools) are uploaded once as a
+``cachedContents`` entry and requests reference it with ``cachedContent``.
+
+- Entries are keyed by API key (caches belong to the key's project), model
+  and a hash of the system prompt + tool declarations, so a prompt or tools
+  change simply starts a new entry.
+- An entry used within ``renew_before_seconds`` of expiring has its TTL
+  extended (PATCH ``ttl``); unused entries expire on their own.
+- If Gemini rejects a request's cache reference (expired or deleted early:
+  400/403/404), the entry is dropped and the request is resent uncached on
+  the same key.
+- A failed create (e.g. a prompt under the model's minimum cacheable size)
+  is not retried for ``failure_backoff_seconds``; requests go uncached.
+
+Only used with the ``prefix_stable`` prompt layout: with ``inline`` the
+datetime makes the system prompt, and so the entry, change every minute.
+The cachedContents endpoint is derived from ``gemini.api_base``, so a local
+stub serving ``<base>/models`` can serve ``<base>/cachedContents`` too.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+from src.config import load_config
+from src.gemini.http_pool import get_http_pool, release_error_response
+from src.gemini.key_scheduler import key_fingerprint
+from src.gemini.payload import PayloadBuilder
+from src.gemini.prompt_layout import LAYOUT_PREFIX_STABLE, prompt_layout
+from src.session_logger import SessionLogger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 600
+DEFAULT_RENEW_BEFORE_SECONDS = 120
+DEFAULT_FAILURE_BACKOFF_SECONDS = 600
+DEFAULT_CALL_TYPES = ("mcp", "synthesis")
+CACHE_REQUEST_TIMEOUT_SECONDS = 10
+
+# Statuses with which Gemini rejects a request's cachedContent reference.
+CACHE_REJECTED_STATUS_CODES = (400, 403, 404)
+
+# Keep at most this many entries; expired ones are pruned past it.
+MAX_ENTRIES = 256
+
+
+class _Entry:
+    """One cachedContents entry (or a recent failure to create it)."""
+
+    __slots__ = ("name", "expires_at", "failed_until", "lock")
+
+    def __init__(self):
+        self.name = None
+        self.expires_at = 0.0
+        self.failed_until = 0.0
+        # Held while creating / renewing, so concurrent calls wait for one upload
+        self.lock = threading.Lock()
+
+
+class ContextCache:
+    """Process-wide registry of cachedContents entries."""
+
+    def __init__(
+        self,
+        ttl_seconds: int = DEFAULT_TTL_SECONDS,
+        renew_before_seconds: float = DEFAULT_RENEW_BEFORE_SECONDS,
+        failure_backoff_seconds: float = DEFAULT_FAILURE_BACKOFF_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.renew_before_seconds = renew_before_seconds
+        self.failure_backoff_seconds = failure_backoff_seconds
+        self._lock = threading.Lock()
+        self._entries: dict[tuple, _Entry] = {}
+        self._counts = {"hits": 0, "creates": 0, "renewals": 0, "create_failures": 0, "fallbacks": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def _entry(self, key: tuple) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= MAX_ENTRIES:
+                    now = time.time()
+                    for stale in [k for k, e in self._entries.items()
+                                  if e.expires_at <= now and e.failed_until <= now]:
+                        del self._entries[stale]
+                entry = self._entries[key] = _Entry()
+            return entry
+
+    def cached_content(self, api_key: str, api_base: str, model: str, builder: PayloadBuilder,
+                       session_logger: Optional[SessionLogger] = None) -> Optional[str]:
+        """The ``cachedContents/...`` name to send with ``builder`` on
+        ``api_key``, creating or renewing the entry as needed; None to send
+        the request uncached."""
+        entry = self._entry((key_fingerprint(api_key), model, builder.prefix_hash()))
+        with entry.lock:
+            now = time.time()
+            if entry.failed_until > now:
+                return None
+            if entry.name and entry.expires_at - now > self.renew_before_seconds:
+                self._count("hits")
+                return entry.name
+            if entry.name and entry.expires_at > now and self._renew(api_key, api_base, entry):
+                self._count("renewals")
+                self._log(session_logger, "renewed", api_key, model)
+                return entry.name
+            entry.name = self._create(api_key, api_base, model, builder)
+            if entry.name is None:
+                entry.failed_until = now + self.failure_backoff_seconds
+                self._count("create_failures")
+                self._log(session_logger, "create_failed", api_key, model)
+                return None
+            entry.expires_at = now + self.ttl_seconds
+            self._count("creates")
+            self._log(session_logger, "created", api_key, model)
+            return entry.name
+
+    def invalidate(self, api_key: str, model: str, builder: PayloadBuilder) -> None:
+        """Forget an entry Gemini no longer accepts (the next call re-creates it)."""
+        with self._lock:
+            self._entries.pop((key_fingerprint(api_key), model, builder.prefix_hash()), None)
+            self._counts["fallbacks"] += 1
+
+    def _create(self, api_key: str, api_base: str, model: str, builder: PayloadBuilder) -> Optional[str]:
+        try:
+            response = get_http_pool().post(
+                f"{_cache_root(api_base)}/cachedContents?key={api_key}",
+                data=builder.cache_request(model, self.ttl_seconds),
+                headers={"Content-Type": "application/json"},
+                timeout=CACHE_REQUEST_TIMEOUT_SECONDS,
+            )
+            if response.status_code != 200:
+                logger.warning(f"cachedContents create failed ({response.status_code}): {response.text[:200]}")
+                return None
+            return response.json().get("name")
+        except Exception as e:
+            logger.warning(f"cachedContents create failed: {e}")
+            return None
+
+    def _renew(self, api_key: str, api_base: str, entry: _Entry) -> bool:
+        try:
+            response = get_http_pool().request(
+                "PATCH", f"{_cache_root(api_base)}/{entry.name}?key={api_key}&updateMask=ttl",
+                json={"ttl": f"{self.ttl_seconds}s"},
+                headers={"Content-Type": "application/json"},
+                timeout=CACHE_REQUEST_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            logger.warning(f"cachedContents renew failed: {e}")
+            return False
+        if response.status_code != 200:
+            logger.warning(f"cachedContents renew failed ({response.status_code}); creating a new entry")
+            return False
+        entry.expires_at = time.time() + self.ttl_seconds
+        return True
+
+    def _log(self, session_logger: Optional[SessionLogger], action: str, api_key: str, model: str):
+        if session_logger:
+            session_logger.log("GEMINI_CONTEXT_CACHE", {
+                "action": action,
+                "model": model,
+                "key": key_fingerprint(api_key),
+            })
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            live = sum(1 for e in self._entries.values() if e.name and e.expires_at > now)
+            return {"entries": live, **self._counts}
+
+
+def _cache_root(api_base: str) -> str:
+    """``.../v1beta/models`` -> ``.../v1beta``."""
+    return api_base.rsplit("/models", 1)[0]
+
+
+_cache: Optional[ContextCache] = None
+_cache_lock = threading.Lock()
+_warned_layout = False
+
+
+def _settings() -> dict:
+    return load_config().get("gemini", {}).get("context_cache", {})
+
+
+def get_context_cache() -> ContextCache:
+    """Return the process-wide cache registry, created from config on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                settings = _settings()
+                _cache = ContextCache(
+                    ttl_seconds=settings.get("ttl_seconds", DEFAULT_TTL_SECONDS),
+                    renew_before_seconds=settings.get("renew_before_seconds", DEFAULT_RENEW_BEFORE_SECONDS),
+                    failure_backoff_seconds=settings.get("failure_backoff_seconds", DEFAULT_FAILURE_BACKOFF_SECONDS),
+                )
+    return _cache
+
+
+def get_context_cache_stats() -> dict:
+    """Context cache counters for diagnostics (empty before first use)."""
+    return _cache.stats() if _cache is not None else {}
+
+
+class CachePlan:
+    """Per-call glue between a request body and the context cache.
+
+    ``body_for(key, model)`` is what to send on a key; ``rejected(...)`` tells
+    the caller to resend when Gemini refused the cache reference.
+    """
+
+    def __init__(self, api_base: str, builder: PayloadBuilder, session_logger: Optional[SessionLogger]):
+        self.api_base = api_base
+        self.builder = builder
+        self.session_logger = session_logger
+        self._cache = get_context_cache()
+        self._used = {}
+        self._bypass = set()
+
+    def body_for(self, api_key: str, model: str) -> bytes:
+        name = None
+        if (api_key, model) not in self._bypass:
+            name = self._cache.cached_content(api_key, self.api_base, model, self.builder, self.session_logger)
+        if name:
+            self._used[(api_key, model)] = name
+        return self.builder.body(name)
+
+    def rejected(self, api_key: str, model: str, response) -> bool:
+        """True (response closed, entry dropped) if ``response`` refused the
+        cache reference sent on ``api_key``; resend with ``body_for``."""
+        if not self.rejects(api_key, model, response.status_code):
+            return False
+        release_error_response(response)
+        return True
+
+    def rejects(self, api_key: str, model: str, status_code: int) -> bool:
+        """``rejected`` without closing the response (the asyncio client
+        closes its own)."""
+        name = self._used.pop((api_key, model), None)
+        if name is None or status_code not in CACHE_REJECTED_STATUS_CODES:
+            return False
+        self._cache.invalidate(api_key, model, self.builder)
+        self._bypass.add((api_key, model))
+        logger.warning(f"Gemini rejected cached content {name} ({status_code}); resending uncached")
+        if self.session_logger:
+            self.session_logger.log("GEMINI_CONTEXT_CACHE", {
+                "action": "fallback",
+                "model": model,
+                "key": key_fingerprint(api_key),
+                "status": status_code,
+            })
+        return True
+
+
+def context_cache_plan(api_base: str, call_type: Optional[str], payload,
+                       session_logger: Optional[SessionLogger] = None) -> Optional[CachePlan]:
+    """A ``CachePlan`` for ``payload`` (a dict or ``PayloadBuilder``), or None
+    when context caching is off for ``call_type`` or there is nothing to cache."""
+    settings = _settings()
+    if not call_type or not settings.get("enabled", False):
+        return None
+    if call_type not in settings.get("call_types", DEFAULT_CALL_TYPES):
+        return None
+    if prompt_layout() != LAYOUT_PREFIX_STABLE:
+        global _warned_layout
+        if not _warned_layout:
+            _warned_layout = True
+            logger.warning("gemini.context_cache needs prompt_layout 'prefix_stable'; sending requests uncached")
+        return None
+    builder = payload if isinstance(payload, PayloadBuilder) else PayloadBuilder.from_payload(payload)
+    if not builder.cacheable:
+        return None
+    return CachePlan(api_base, builder, session_logger)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hedged Gemini streams: race a duplicate request on a second key.
+
+When hedging is on for a call type and the first response byte has not
+arrived within the hedge delay, the same request is sent again on another
+key (picked by the key scheduler). Whichever stream produces its first byte
+first wins; the other is cancelled. The delay is the rolling p95 of recent
+time-to-first-byte for that call type once enough samples exist, otherwise
+the configured ``delay_ms``.
+
+Opt-in per call type under ``config["gemini"]["hedging"]``::
+
+    "hedging": {
+        "mcp":       {"enabled": true, "delay_ms": 3000},
+        "kb":        {"enabled": false},
+        "synthesis": {"enabled": true, "delay_ms": 2000, "use_rolling_p95": false}
+    }
+
+A cancelled duplicate has already been billed for its prompt. The winner's
+``promptTokenCount`` is added once per cancelled duplicate via
+``SessionLogger.add_hedge_usage``. Partial output of the loser is not
+reported by the API and is not counted.
+"""
+
+import collections
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+
+from src.config import load_config
+from src.gemini.http_pool import get_http_pool
+from src.gemini.payload import post_payload
+from src.gemini.key_scheduler import (
+    RETRYABLE_STATUS_CODES,
+    KeyAttempt,
+    failure_outcome,
+    get_key_scheduler,
+    key_fingerprint,
+)
+from src.session_logger import SessionLogger
+from src.sse import SSE_READ_SIZE
+
+logger = logging.getLogger(__name__)
+
+CALL_TYPE_MCP = "mcp"
+CALL_TYPE_KB = "kb"
+CALL_TYPE_SYNTHESIS = "synthesis"
+
+DEFAULT_HEDGE_DELAY_MS = 2000
+# Time-to-first-byte samples kept per call type, and how many are needed
+# before the rolling p95 replaces the fixed delay.
+LATENCY_WINDOW_SIZE = 200
+MIN_P95_SAMPLES = 20
+
+
+class LatencyWindow:
+    """Rolling window of time-to-first-byte samples (ms) for one call type."""
+
+    def __init__(self, size: int = LATENCY_WINDOW_SIZE):
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, latency_ms: float) -> None:
+        with self._lock:
+            self._samples.append(latency_ms)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Nearest-rank percentile, or None below ``MIN_P95_SAMPLES`` samples."""
+        with self._lock:
+            if len(self._samples) < MIN_P95_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+_windows: dict[str, LatencyWindow] = {}
+_windows_lock = threading.Lock()
+
+
+def _window(call_type: str) -> LatencyWindow:
+    with _windows_lock:
+        window = _windows.get(call_type)
+        if window is None:
+            window = _windows[call_type] = LatencyWindow()
+        return window
+
+
+def hedge_delay(call_type: Optional[str]) -> Optional[float]:
+    """Seconds to wait for a first byte before hedging, or None if hedging
+    is off for ``call_type``."""
+    if not call_type:
+        return None
+    settings = load_config().get("gemini", {}).get("hedging", {}).get(call_type, {})
+    if not settings.get("enabled", False):
+        return None
+    delay_ms = settings.get("delay_ms", DEFAULT_HEDGE_DELAY_MS)
+    if settings.get("use_rolling_p95", True):
+        p95 = _window(call_type).percentile(0.95)
+        if p95 is not None:
+            delay_ms = p95
+    return delay_ms / 1000
+
+
+class HedgedStream:
+    """The stream a caller should read: the winning attempt, its response and
+    its body chunks (the first chunk already read is replayed)."""
+
+    def __init__(self, attempt: KeyAttempt, response, chunks, duplicates: int = 0):
+        self.attempt = attempt
+        self.response = response
+        self.chunks = chunks
+        # Requests cancelled after being sent (billed but discarded).
+        self.duplicates = duplicates
+
+
+class RacerBase:
+    """What a copy of the request knows once its wait has ended, shared by
+    the threaded ``_Racer`` here and the asyncio one in ``async_client``."""
+
+    def __init__(self, attempt: KeyAttempt):
+        self.attempt = attempt
+        self.response = None
+        self.error = None
+        self.first_chunk = None
+        self.first_byte_ms = None
+        self._chunks = None
+
+    @property
+    def ready(self) -> bool:
+        """Got a first byte, or a non-retryable answer that is final anyway."""
+        if self.error is not None or self.response is None:
+            return False
+        return self.first_chunk is not None or self.response.status_code not in RETRYABLE_STATUS_CODES
+
+    def record_error(self, label: str) -> bool:
+        """Report this copy's exception on its own attempt; False when it got
+        a (429/5xx) response instead, for the caller to report."""
+        if self.error is None:
+            return False
+        self.attempt.failed(failure_outcome(self.error), str(self.error))
+        logger.warning(f"{label}Hedged request failed: {self.error}")
+        return True
+
+    def chunks(self):
+        raise NotImplementedError
+
+    def raise_or_return(self) -> HedgedStream:
+        if self.error is not None:
+            raise self.error
+        return HedgedStream(self.attempt, self.response, self.chunks())
+
+
+# What a finished copy means for the race (``HedgeRace.outcome``)
+RACE_WON = "won"
+RACE_WAIT = "wait"
+RACE_LOST = "lost"
+
+
+class HedgeRace:
+    """The bookkeeping of one hedged race, shared by the threaded and asyncio
+    loops (which only differ in how they wait for the copies)."""
+
+    def __init__(self, primary: RacerBase, call_type: str, delay: float,
+                 session_logger: Optional[SessionLogger]):
+        self.primary = primary
+        # None until the hedge delay passes; False when no spare key was free
+        self.hedge = None
+        self.call_type = call_type
+        self.delay = delay
+        self.session_logger = session_logger
+
+    def outcome(self, racer: RacerBase, outstanding) -> str:
+        """``RACE_WON``: ``racer`` is the stream to read (cancel ``outstanding``
+        and call ``won``). ``RACE_WAIT``: keep waiting for ``outstanding``.
+        ``RACE_LOST``: every copy failed; hand back the primary's outcome.
+
+        A failed duplicate is reported by the caller before it waits on; a
+        failed primary is left to the caller unless a duplicate goes on to win.
+        """
+        if racer.ready:
+            return RACE_WON
+        if outstanding and not (racer is self.primary and self.hedge is None):
+            return RACE_WAIT
+        return RACE_LOST
+
+    def primary_failed(self, winner: RacerBase, outstanding) -> bool:
+        """The primary finished without a stream and a duplicate won."""
+        return winner is not self.primary and self.primary not in outstanding
+
+    def won(self, winner: RacerBase, duplicates: int) -> HedgedStream:
+        """Record the winner's first byte and the race result; the stream."""
+        if winner.first_byte_ms is not None:
+            record_first_byte(self.call_type, winner.first_byte_ms)
+        if self.hedge:
+            log_hedge_result(self.session_logger, self.call_type, winner is self.hedge,
+                             winner.first_byte_ms, duplicates)
+        stream = winner.raise_or_return()
+        stream.duplicates = duplicates
+        return stream
+
+
+class _Racer(RacerBase):
+    """One in-flight copy of the request, run on its own thread up to its
+    first body chunk."""
+
+    def __init__(self, attempt: KeyAttempt, request_for: callable, timeout: float, results: queue.Queue):
+        super().__init__(attempt)
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._done = False
+        self._thread = threading.Thread(
+            target=self._run, args=(*request_for(attempt.api_key), timeout, results), daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, url: str, payload, timeout: float, results: queue.Queue):
+        start = time.time()
+        try:
+            self.response = post_payload(get_http_pool(), url, payload, stream=True, timeout=timeout)
+            if self.response.status_code == 200 and not self._cancelled:
+                self._chunks = self.response.iter_content(chunk_size=SSE_READ_SIZE)
+                self.first_chunk = next(self._chunks, b"")
+                self.first_byte_ms = (time.time() - start) * 1000
+        except Exception as e:
+            self.error = e
+        with self._lock:
+            self._done = True
+            cancelled = self._cancelled
+        if cancelled:
+            self._close()
+        results.put(self)
+
+    def chunks(self):
+        if self._chunks is None:
+            yield from self.response.iter_content(chunk_size=SSE_READ_SIZE)
+            return
+        if self.first_chunk:
+            yield self.first_chunk
+        yield from self._chunks
+
+    def cancel(self):
+        """Stop this copy; its key is released without a health penalty.
+
+        If the thread is still blocked waiting on Gemini it closes the
+        response itself as soon as it wakes up."""
+        with self._lock:
+            self._cancelled = True
+            done = self._done
+        self.attempt.cancelled()
+        if done:
+            self._close()
+
+    def _close(self):
+        if self.response is not None:
+            try:
+                self.response.close()
+            except Exception:
+                pass
+
+    def record_failure(self, label: str):
+        """Report this copy's 429/5xx or exception on its own attempt."""
+        if not self.record_error(label):
+            self.attempt.retry_on_status(self.response, label=label)
+
+
+def open_hedged_stream(
+    attempt: KeyAttempt,
+    keys: list,
+    request_for: callable,
+    call_type: Optional[str],
+    session_logger: Optional[SessionLogger] = None,
+    timeout: float = 300,
+    label: str = "",
+) -> HedgedStream:
+    """POST a streaming request for ``attempt``, hedged if enabled for ``call_type``.
+
+    Args:
+        attempt: The caller's current ``KeyAttempt`` (the primary request).
+        keys: The key pool the duplicate may be drawn from.
+        request_for: ``request_for(api_key) -> (url, payload)`` for a key; the
+            payload is a dict or a body serialized by ``PayloadBuilder``.
+        call_type: ``CALL_TYPE_*``; None disables hedging.
+        session_logger: Optional SessionLogger; logs ``GEMINI_HEDGE_SENT`` and
+            ``GEMINI_HEDGE_RESULT``.
+        timeout: Per-request timeout in seconds.
+        label: Log prefix (e.g. "KB ").
+
+    Returns:
+        The winning ``HedgedStream``. If every copy failed, the primary's
+        outcome is handed back unchanged (its response, to be checked with
+        ``retry_on_status``, or its exception re-raised), so callers keep their
+        usual error handling. Failures of the duplicate are recorded on its own
+        attempt. Callers must read ``.chunks`` rather than the response.
+    """
+    delay = hedge_delay(call_type)
+    if delay is None or len(keys) < 2:
+        url, payload = request_for(attempt.api_key)
+        response = post_payload(get_http_pool(), url, payload, stream=True, timeout=timeout)
+        return HedgedStream(attempt, response, response.iter_content(chunk_size=SSE_READ_SIZE))
+
+    results = queue.Queue()
+    race = HedgeRace(_Racer(attempt, request_for, timeout, results), call_type, delay, session_logger)
+    pending = {race.primary}
+    hedge_at = time.time() + delay
+
+    while True:
+        wait = max(hedge_at - time.time(), 0) if race.hedge is None else None
+        try:
+            racer = results.get(timeout=wait)
+        except queue.Empty:
+            duplicate = hedge_attempt(attempt, keys, call_type, delay, session_logger)
+            if duplicate is None:
+                race.hedge = False  # No spare key; just wait for the primary
+            else:
+                race.hedge = _Racer(duplicate, request_for, timeout, results)
+                pending.add(race.hedge)
+            continue
+        pending.discard(racer)
+
+        outcome = race.outcome(racer, pending)
+        if outcome == RACE_WON:
+            for loser in pending:
+                loser.cancel()
+            if race.primary_failed(racer, pending):
+                race.primary.record_failure(label)
+            return race.won(racer, len(pending))
+        if racer is not race.primary:
+            racer.record_failure(label)
+        if outcome == RACE_WAIT:
+            continue
+        return race.primary.raise_or_return()
+
+
+def hedge_attempt(attempt: KeyAttempt, keys: list, call_type: str, delay: float,
+                  session_logger: Optional[SessionLogger]) -> Optional[KeyAttempt]:
+    """A ``KeyAttempt`` on another key for the duplicate request (logged as
+    ``GEMINI_HEDGE_SENT``), or None when no spare key is free."""
+    scheduler = get_key_scheduler()
+    api_key = scheduler.acquire(keys, exclude={attempt.api_key})
+    if api_key is None:
+        return None
+    if session_logger:
+        session_logger.log("GEMINI_HEDGE_SENT", {
+            "call_type": call_type,
+            "after_ms": round(delay * 1000),
+            "primary_key": key_fingerprint(attempt.api_key),
+            "hedge_key": key_fingerprint(api_key),
+        })
+    logger.info(f"No first byte from {call_type} call after {delay * 1000:.0f}ms; hedging on another key")
+    return KeyAttempt(scheduler, api_key, attempt.number, on_outcome=attempt.on_outcome)
+
+
+def record_first_byte(call_type: str, first_byte_ms: float) -> None:
+    """Add a time-to-first-byte sample to ``call_type``'s rolling window."""
+    _window(call_type).add(first_byte_ms)
+
+
+def log_hedge_result(session_logger: Optional[SessionLogger], call_type: str, hedge_won: bool,
+                     first_byte_ms: Optional[float], duplicates: int):
+    if session_logger:
+        session_logger.log("GEMINI_HEDGE_RESULT", {
+            "call_type": call_type,
+            "winner": "hedge" if hedge_won else "primary",
+            "first_byte_ms": round(first_byte_ms, 1) if first_byte_ms is not None else None,
+            "cancelled": duplicates,
+        })
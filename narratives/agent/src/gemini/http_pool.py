@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared keep-alive connection pool for outbound Gemini traffic.
+
+Every Gemini round trip (tool loop, KB file search, synthesis, chart config,
+follow-ups) goes through ``get_http_pool().post(...)`` so TCP+TLS handshakes to
+generativelanguage.googleapis.com are paid once per pooled connection instead
+of once per call.
+
+Tunables live under ``config["gemini"]["connection_pool"]`` and are read once,
+when the pool is first used (restart the agent to change them):
+
+- ``pool_connections``: number of distinct hosts kept in the pool (default 4)
+- ``pool_maxsize``: max keep-alive connections per host (default 32)
+- ``keepalive_idle_seconds``: TCP keep-alive idle time / HTTP/2 idle expiry
+- ``http2``: use HTTP/2 via httpx (needs the optional ``h2`` package)
+
+The asyncio client (``src.gemini.async_client``) gets an ``httpx.AsyncClient``
+with the same limits from ``get_http_pool().async_client()``, one per event
+loop, and shares the pool's stats counters.
+"""
+
+import json
+import logging
+import socket
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from src.config import load_config
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 is optional: httpx ships with the agent, but HTTP/2 support needs h2.
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 32
+DEFAULT_KEEPALIVE_IDLE_SECONDS = 60
+
+
+class _PoolCounters:
+    """Thread-safe request / new-connection counters for pool stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def add_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def add_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+
+def _counting_pool_class(base, counters: _PoolCounters):
+    """Subclass a urllib3 connection pool so every new connection is counted.
+
+    urllib3 only calls ``_new_conn`` when no idle keep-alive connection is
+    available, so each call is one TCP(+TLS) handshake.
+    """
+    class CountingPool(base):
+        def _new_conn(self):
+            counters.add_connection()
+            return super()._new_conn()
+    return CountingPool
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter with TCP keep-alive enabled and handshake counting."""
+
+    def __init__(self, counters: _PoolCounters, keepalive_idle: int, **kwargs):
+        # Set before super().__init__, which calls init_poolmanager().
+        self._counters = counters
+        self._keepalive_idle = keepalive_idle
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = list(HTTPConnection.default_socket_options)
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, "TCP_KEEPIDLE"):  # Linux only
+            socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self._keepalive_idle))
+        kwargs["socket_options"] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self._counters),
+            "https": _counting_pool_class(HTTPSConnectionPool, self._counters),
+        }
+
+
+class _Http2Response:
+    """The subset of ``requests.Response`` the Gemini call sites use, backed by
+    an httpx streaming response. Transport errors are re-raised as their
+    ``requests`` equivalents so existing ``except`` clauses keep working."""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def iter_lines(self):
+        try:
+            for line in self._response.iter_lines():
+                yield line.encode("utf-8")
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        finally:
+            self._response.close()
+
+    def iter_content(self, chunk_size: Optional[int] = None):
+        # chunk_size is ignored: httpx would buffer up to it, stalling SSE;
+        # frames are handed over as they arrive instead.
+        try:
+            yield from self._response.iter_bytes()
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        finally:
+            self._response.close()
+
+    @property
+    def content(self) -> bytes:
+        try:
+            return self._response.read()
+        finally:
+            self._response.close()
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        self._response.close()
+
+
+class HttpPool:
+    """Process-wide pooled HTTP client shared by every Gemini call site.
+
+    Thread-safe: the underlying urllib3 / httpx connection pools hand each
+    concurrent request its own connection, and stats counters are locked.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        keepalive_idle_seconds: int = DEFAULT_KEEPALIVE_IDLE_SECONDS,
+        http2: bool = False,
+    ):
+        self._counters = _PoolCounters()
+        self.pool_maxsize = pool_maxsize
+        self.http2 = http2 and _HTTP2_AVAILABLE
+        if http2 and not _HTTP2_AVAILABLE:
+            logger.warning("connection_pool.http2 requested but the h2 package is not installed; using HTTP/1.1")
+        self._limits = httpx.Limits(
+            max_connections=pool_maxsize,
+            max_keepalive_connections=pool_maxsize,
+            keepalive_expiry=keepalive_idle_seconds,
+        )
+        # One AsyncClient per event loop: httpx async pools are loop-bound.
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
+
+        # httpx logs every request URL at INFO, and Gemini URLs carry the API
+        # key as a query parameter.
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+        if self.http2:
+            self._client = httpx.Client(http2=True, limits=self._limits)
+        else:
+            self._session = requests.Session()
+            adapter = _KeepAliveAdapter(
+                self._counters,
+                keepalive_idle_seconds,
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+            )
+            self._session.mount("https://", adapter)
+            self._session.mount("http://", adapter)
+
+    def _trace(self, event_name: str, info: dict):
+        """httpcore trace hook: one connect_tcp per new HTTP/2 connection."""
+        if event_name == "connection.connect_tcp.complete":
+            self._counters.add_connection()
+
+    async def _async_trace(self, event_name: str, info: dict):
+        """Async twin of ``_trace`` (httpcore awaits trace hooks on async pools)."""
+        self._trace(event_name, info)
+
+    def async_client(self, loop) -> "httpx.AsyncClient":
+        """Return the pooled ``httpx.AsyncClient`` for ``loop``, creating it once."""
+        with self._async_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(http2=self.http2, limits=self._limits)
+                self._async_clients[loop] = client
+            return client
+
+    def async_request_extensions(self) -> dict:
+        """Request extensions that count new connections into the pool stats."""
+        self._counters.add_request()
+        return {"trace": self._async_trace}
+
+    def post(self, url: str, json: dict = None, data: bytes = None, headers: dict = None,
+             stream: bool = False, timeout: float = None):
+        """POST through the pool. Mirrors ``requests.post`` for the arguments
+        the agent uses and returns a ``requests.Response`` (or a look-alike on
+        the HTTP/2 path)."""
+        return self.request("POST", url, json=json, data=data, headers=headers,
+                            stream=stream, timeout=timeout)
+
+    def request(self, method: str, url: str, json: dict = None, data: bytes = None,
+                headers: dict = None, stream: bool = False, timeout: float = None):
+        """Any-method version of ``post`` (e.g. PATCH for cachedContents)."""
+        self._counters.add_request()
+        if not self.http2:
+            return self._session.request(method, url, json=json, data=data, headers=headers,
+                                         stream=stream, timeout=timeout)
+
+        request = self._client.build_request(
+            method, url, json=json, content=data, headers=headers,
+            timeout=timeout, extensions={"trace": self._trace},
+        )
+        try:
+            response = self._client.send(request, stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(str(e)) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        return _Http2Response(response)
+
+    def stats(self) -> dict:
+        """Connection reuse stats since the pool was created."""
+        requests_sent = self._counters.requests
+        new_connections = self._counters.new_connections
+        reused = max(requests_sent - new_connections, 0)
+        return {
+            "protocol": "HTTP/2" if self.http2 else "HTTP/1.1",
+            "pool_maxsize": self.pool_maxsize,
+            "requests": requests_sent,
+            "new_connections": new_connections,
+            "handshakes_avoided": reused,
+            "reuse_rate": round(reused / requests_sent, 3) if requests_sent else 0.0,
+        }
+
+
+def release_error_response(response) -> None:
+    """Read the (small) body of a streamed error response, then close it.
+
+    A ``stream=True`` response still holds its unread body, so closing it
+    straight away makes urllib3 / httpx discard the socket rather than put
+    it back in the pool, and the retry pays a fresh handshake. Reading the
+    body first lets the connection be reused."""
+    try:
+        response.content
+    except Exception:
+        pass  # Broken connection: close() drops it, which is right anyway
+    finally:
+        response.close()
+
+
+_pool: Optional[HttpPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_http_pool() -> HttpPool:
+    """Return the shared pool, creating it from config on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool_config = load_config().get("gemini", {}).get("connection_pool", {})
+                _pool = HttpPool(
+                    pool_connections=pool_config.get("pool_connections", DEFAULT_POOL_CONNECTIONS),
+                    pool_maxsize=pool_config.get("pool_maxsize", DEFAULT_POOL_MAXSIZE),
+                    keepalive_idle_seconds=pool_config.get("keepalive_idle_seconds", DEFAULT_KEEPALIVE_IDLE_SECONDS),
+                    http2=pool_config.get("http2", False),
+                )
+                logger.info(f"Gemini connection pool created: {_pool.stats()}")
+    return _pool
+
+
+def get_pool_stats() -> dict:
+    """Pool stats for diagnostics, or an empty dict if nothing was sent yet."""
+    return _pool.stats() if _pool is not None else {}
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Health-aware Gemini API key scheduler.
+
+Replaces the per-call ``random.shuffle`` of the key list. One process-wide
+``KeyScheduler`` remembers, per key, when it was last rate limited, how long it
+is cooling down, how many requests are in flight on it and its recent latency,
+and hands out the least-loaded healthy key first. Keys are tracked by value, so
+the regular and demo pools share the scheduler without interfering.
+
+Call sites iterate ``iter_key_attempts(...)`` instead of the raw key list and
+report each attempt's outcome on the yielded ``KeyAttempt``. When a whole pass
+over the pool fails with 429/5xx/timeouts, the iterator waits (jittered
+exponential backoff, never less than the earliest key cooldown or server
+Retry-After) and starts another pass, until the per-request deadline.
+"""
+
+import asyncio
+import email.utils
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import AsyncGenerator, Generator, Iterable, Optional
+
+import httpx
+import requests
+
+from src.config import load_config
+from src.gemini.http_pool import release_error_response
+from src.session_logger import SessionLogger
+
+logger = logging.getLogger(__name__)
+
+# Attempt outcomes reported back to the scheduler.
+OUTCOME_OK = "ok"
+OUTCOME_RATE_LIMITED = "rate_limited"
+OUTCOME_SERVER_ERROR = "server_error"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_STREAM_BROKEN = "stream_broken"
+OUTCOME_ERROR = "error"
+OUTCOME_CANCELLED = "cancelled"
+
+# HTTP statuses that mean "try another key" rather than "give up".
+RETRYABLE_STATUS_CODES = (429, 500, 503)
+
+DEFAULT_RATE_LIMIT_COOLDOWN_SECONDS = 5.0
+DEFAULT_SERVER_ERROR_COOLDOWN_SECONDS = 1.0
+DEFAULT_MAX_COOLDOWN_SECONDS = 60.0
+
+# Weight of the newest sample in the per-key latency moving average.
+LATENCY_EWMA_ALPHA = 0.3
+
+# Wait-and-retry across the whole pool once every key has failed in a pass.
+DEFAULT_RETRY_MAX_WAIT_SECONDS = 10.0
+DEFAULT_RETRY_BASE_BACKOFF_SECONDS = 0.25
+DEFAULT_RETRY_MAX_BACKOFF_SECONDS = 4.0
+
+# Outcomes worth waiting out; anything else (bad request, parse errors, ...)
+# would fail the same way on the next pass.
+_TRANSIENT_OUTCOMES = (OUTCOME_RATE_LIMITED, OUTCOME_SERVER_ERROR, OUTCOME_TIMEOUT)
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Short stable identifier for a key, safe to log or expose in stats."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def parse_retry_after(response) -> Optional[float]:
+    """Seconds the server asked us to wait, if it said.
+
+    Honours the ``Retry-After`` header (delta-seconds or HTTP-date) and, for
+    Gemini 429s, the ``RetryInfo.retryDelay`` (e.g. ``"31s"``) in the error body.
+    """
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return max(float(header), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(email.utils.parsedate_to_datetime(header).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    try:
+        details = json.loads(response.content).get("error", {}).get("details", [])
+    except Exception:
+        return None
+    for detail in details:
+        match = re.fullmatch(r"([0-9.]+)s", str(detail.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class _KeyState:
+    """Mutable health record for one API key (guarded by the scheduler lock)."""
+
+    __slots__ = ("in_flight", "cooldown_until", "last_rate_limited",
+                 "consecutive_failures", "latency_ewma_ms", "requests", "failures")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.last_rate_limited = None
+        self.consecutive_failures = 0
+        self.latency_ewma_ms = None
+        self.requests = 0
+        self.failures = 0
+
+
+class KeyScheduler:
+    """Process-wide, thread-safe picker of the healthiest API key."""
+
+    def __init__(
+        self,
+        rate_limit_cooldown: float = DEFAULT_RATE_LIMIT_COOLDOWN_SECONDS,
+        server_error_cooldown: float = DEFAULT_SERVER_ERROR_COOLDOWN_SECONDS,
+        max_cooldown: float = DEFAULT_MAX_COOLDOWN_SECONDS,
+    ):
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.server_error_cooldown = server_error_cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._states: dict[str, _KeyState] = {}
+
+    def _state(self, api_key: str) -> _KeyState:
+        state = self._states.get(api_key)
+        if state is None:
+            state = self._states[api_key] = _KeyState()
+        return state
+
+    def acquire(self, keys: Iterable[str], exclude: Iterable[str] = ()) -> Optional[str]:
+        """Pick a key from ``keys`` (minus ``exclude``) and mark it in flight.
+
+        Healthy keys (not cooling down) win, ordered by in-flight count, then
+        recent latency, with a random tie-break so idle keys share load. If
+        every candidate is cooling down, the one that recovers soonest is
+        returned so a single pass still tries each key once.
+
+        Returns:
+            The chosen key, or None when no candidates are left.
+        """
+        excluded = set(exclude)
+        now = time.time()
+        with self._lock:
+            candidates = [k for k in keys if k not in excluded]
+            if not candidates:
+                return None
+            healthy = [k for k in candidates if self._state(k).cooldown_until <= now]
+            if healthy:
+                chosen = min(healthy, key=lambda k: (
+                    self._states[k].in_flight,
+                    self._states[k].latency_ewma_ms or 0.0,
+                    random.random(),
+                ))
+            else:
+                chosen = min(candidates, key=lambda k: self._states[k].cooldown_until)
+            state = self._states[chosen]
+            state.in_flight += 1
+            state.requests += 1
+            return chosen
+
+    def release(self, api_key: str, outcome: str, latency_ms: float = None,
+                retry_after: float = None) -> None:
+        """Return a key acquired with ``acquire`` and record how the call went.
+
+        Args:
+            api_key: The key returned by ``acquire``.
+            outcome: One of the ``OUTCOME_*`` constants.
+            latency_ms: Time to response headers, recorded for successful calls.
+            retry_after: Server-provided Retry-After in seconds, if any; it
+                replaces the locally computed cooldown.
+        """
+        now = time.time()
+        with self._lock:
+            state = self._state(api_key)
+            state.in_flight = max(state.in_flight - 1, 0)
+            if outcome == OUTCOME_CANCELLED:
+                return  # Dropped by us (e.g. a losing hedge), not a key problem
+            if outcome == OUTCOME_OK:
+                state.consecutive_failures = 0
+                state.cooldown_until = 0.0
+                if latency_ms is not None:
+                    if state.latency_ewma_ms is None:
+                        state.latency_ewma_ms = latency_ms
+                    else:
+                        state.latency_ewma_ms += LATENCY_EWMA_ALPHA * (latency_ms - state.latency_ewma_ms)
+                return
+
+            state.failures += 1
+            if outcome in (OUTCOME_ERROR, OUTCOME_STREAM_BROKEN):
+                return  # Not a signal about the key's quota or health
+            state.consecutive_failures += 1
+            if outcome == OUTCOME_RATE_LIMITED:
+                state.last_rate_limited = now
+                base = self.rate_limit_cooldown
+            else:
+                base = self.server_error_cooldown
+            if retry_after is not None:
+                # The server knows its quota window better than our guess
+                cooldown = min(retry_after, self.max_cooldown)
+            else:
+                cooldown = min(base * 2 ** (state.consecutive_failures - 1), self.max_cooldown)
+            state.cooldown_until = max(state.cooldown_until, now + cooldown)
+
+    def next_available_in(self, keys: Iterable[str]) -> float:
+        """Seconds until the first of ``keys`` leaves cooldown (0 if one is ready)."""
+        now = time.time()
+        with self._lock:
+            waits = [self._state(k).cooldown_until - now for k in keys]
+        return max(min(waits), 0.0) if waits else 0.0
+
+    def stats(self) -> list:
+        """Per-key health snapshot, keyed by fingerprint (never the raw key)."""
+        now = time.time()
+        with self._lock:
+            return [{
+                "key": key_fingerprint(k),
+                "in_flight": s.in_flight,
+                "cooldown_remaining_s": round(max(s.cooldown_until - now, 0.0), 2),
+                "last_rate_limited_s_ago": round(now - s.last_rate_limited, 1) if s.last_rate_limited else None,
+                "latency_ewma_ms": round(s.latency_ewma_ms, 1) if s.latency_ewma_ms is not None else None,
+                "requests": s.requests,
+                "failures": s.failures,
+            } for k, s in self._states.items()]
+
+
+_scheduler: Optional[KeyScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_key_scheduler() -> KeyScheduler:
+    """Return the process-wide scheduler, creating it from config on first use.
+
+    Tunables live under ``config["gemini"]["key_scheduler"]``.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                sched_config = load_config().get("gemini", {}).get("key_scheduler", {})
+                _scheduler = KeyScheduler(
+                    rate_limit_cooldown=sched_config.get("rate_limit_cooldown_seconds", DEFAULT_RATE_LIMIT_COOLDOWN_SECONDS),
+                    server_error_cooldown=sched_config.get("server_error_cooldown_seconds", DEFAULT_SERVER_ERROR_COOLDOWN_SECONDS),
+                    max_cooldown=sched_config.get("max_cooldown_seconds", DEFAULT_MAX_COOLDOWN_SECONDS),
+                )
+    return _scheduler
+
+
+def get_key_stats() -> list:
+    """Key health for diagnostics, or an empty list before the first call."""
+    return _scheduler.stats() if _scheduler is not None else []
+
+
+def failure_outcome(error: BaseException) -> str:
+    """The ``OUTCOME_*`` for an exception raised by a Gemini call.
+
+    Timeouts and dropped connections / streams cut off part-way (on either
+    the ``requests`` or the ``httpx`` client) are told apart from everything
+    else (bad responses, payload or parsing errors), which is
+    ``OUTCOME_ERROR``."""
+    if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException)):
+        return OUTCOME_TIMEOUT
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                          httpx.TransportError)):
+        return OUTCOME_STREAM_BROKEN
+    return OUTCOME_ERROR
+
+
+class KeyAttempt:
+    """One try of a request on one key, yielded by ``iter_key_attempts``.
+
+    Report the outcome exactly once via ``retry_on_status``, ``succeeded`` or
+    ``failed``. An attempt left unreported is released as a generic error when
+    the next attempt starts.
+    """
+
+    def __init__(self, scheduler: KeyScheduler, api_key: str, number: int, on_outcome: callable = None):
+        self._scheduler = scheduler
+        self.api_key = api_key
+        self.number = number
+        # Optional ``on_outcome(outcome, latency_ms)`` observer (e.g. model health)
+        self.on_outcome = on_outcome
+        self.start_time = time.time()
+        self.last_error = None
+        self.outcome = None
+        self._released = False
+        self._held = False
+
+    def retry_on_status(self, response, label: str = "") -> bool:
+        """Check a response for a retryable status (429/500/503).
+
+        On a retryable status the error body is read and the response closed
+        (returning its connection to the pool), the key is put into cooldown
+        and True is returned so the caller can ``continue`` to the next attempt.
+        """
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            return False
+        retry_after = parse_retry_after(response)
+        release_error_response(response)
+        self.record_retryable_status(response.status_code, retry_after, label)
+        return True
+
+    def record_retryable_status(self, status_code: int, retry_after: float = None, label: str = "") -> None:
+        """Put the key into cooldown for a 429/500/503 the caller already read
+        and closed (the asyncio client cannot use ``retry_on_status``)."""
+        if status_code == 429:
+            self.failed(OUTCOME_RATE_LIMITED, "Rate limited (429)", retry_after=retry_after)
+            logger.warning(f"{label}API key rate limited, switching to next key...")
+        else:
+            self.failed(OUTCOME_SERVER_ERROR, f"Server error ({status_code})", retry_after=retry_after)
+            logger.warning(f"{label}Server error {status_code}, switching to next key...")
+
+    def succeeded(self, hold: bool = False) -> None:
+        """Record a successful response (latency = time to headers).
+
+        Args:
+            hold: Keep the key counted as in flight (e.g. while a returned
+                stream is still being read); call ``release()`` when done.
+        """
+        latency_ms = (time.time() - self.start_time) * 1000
+        if hold:
+            self._held = True
+            self._pending_latency_ms = latency_ms
+            return
+        self._release(OUTCOME_OK, latency_ms)
+
+    def release(self) -> None:
+        """Release a key held by ``succeeded(hold=True)``."""
+        if self._held:
+            self._held = False
+            self._release(OUTCOME_OK, self._pending_latency_ms)
+
+    def cancelled(self) -> None:
+        """Release a request abandoned by the caller, with no health penalty."""
+        self._held = False
+        self._release(OUTCOME_CANCELLED)
+
+    def failed(self, outcome: str, error: str, retry_after: float = None) -> None:
+        """Record a failed attempt (also ends a hold, e.g. a stream that broke
+        part-way) so the next attempt can log the reason."""
+        self.last_error = error
+        self._held = False
+        self._release(outcome, retry_after=retry_after)
+
+    def _release(self, outcome: str, latency_ms: float = None, retry_after: float = None) -> None:
+        if self._released:
+            return
+        self._released = True
+        self.outcome = outcome
+        self._scheduler.release(self.api_key, outcome, latency_ms=latency_ms, retry_after=retry_after)
+        if self.on_outcome is not None:
+            self.on_outcome(outcome, latency_ms)
+
+    @property
+    def held(self) -> bool:
+        return self._held
+
+
+def _retry_settings() -> dict:
+    retry_config = load_config().get("gemini", {}).get("retry", {})
+    return {
+        "enabled": retry_config.get("enabled", True),
+        "max_wait": retry_config.get("max_wait_seconds", DEFAULT_RETRY_MAX_WAIT_SECONDS),
+        "base_backoff": retry_config.get("base_backoff_seconds", DEFAULT_RETRY_BASE_BACKOFF_SECONDS),
+        "max_backoff": retry_config.get("max_backoff_seconds", DEFAULT_RETRY_MAX_BACKOFF_SECONDS),
+    }
+
+
+class _AttemptSequence:
+    """Pass/backoff bookkeeping shared by ``iter_key_attempts`` and its
+    asyncio twin ``aiter_key_attempts``; only the sleep differs."""
+
+    def __init__(self, keys: list, session_logger: Optional[SessionLogger],
+                 log_prefix: str, deadline: Optional[float],
+                 max_passes: Optional[int] = None, on_outcome: callable = None):
+        self.keys = keys
+        self.session_logger = session_logger
+        self.log_prefix = log_prefix
+        self.scheduler = get_key_scheduler()
+        self.settings = _retry_settings()
+        self.deadline = time.time() + self.settings["max_wait"]
+        self.hard_deadline = deadline
+        if deadline is not None:
+            self.deadline = min(self.deadline, deadline)
+        self.tried = set()
+        self.previous = None
+        self.attempt_number = 0
+        self.pass_number = 1
+        self.pass_had_transient = False
+        self.max_passes = max_passes
+        self.on_outcome = on_outcome
+
+    def next(self) -> tuple:
+        """Return ``(attempt, None)``, ``(None, wait_seconds)`` before another
+        pass, or ``(None, None)`` when the pool is exhausted."""
+        if self.attempt_number and self.hard_deadline is not None and time.time() >= self.hard_deadline:
+            return None, None  # Out of time: no further keys, even within a pass
+        api_key = self.scheduler.acquire(self.keys, exclude=self.tried)
+        if api_key is None:
+            return None, self._backoff()
+
+        self.tried.add(api_key)
+        self.attempt_number += 1
+        attempt = KeyAttempt(self.scheduler, api_key, self.attempt_number, on_outcome=self.on_outcome)
+        if self.previous is not None:
+            attempt.last_error = self.previous.last_error
+            if self.session_logger:
+                self.session_logger.log(f"{self.log_prefix}_KEY_ROTATION", {
+                    "attempt": attempt.number,
+                    "total_keys": len(self.keys),
+                    "reason": str(self.previous.last_error),
+                    "key": key_fingerprint(api_key),
+                })
+        self.previous = attempt
+        return attempt, None
+
+    def _backoff(self) -> Optional[float]:
+        """Every key failed this pass: how long to wait, or None to give up."""
+        settings = self.settings
+        if not (settings["enabled"] and self.pass_had_transient and self.tried):
+            return None
+        if self.max_passes is not None and self.pass_number >= self.max_passes:
+            return None
+        backoff = min(settings["base_backoff"] * 2 ** (self.pass_number - 1), settings["max_backoff"])
+        wait = max(random.uniform(backoff / 2, backoff), self.scheduler.next_available_in(self.keys))
+        if time.time() + wait >= self.deadline:
+            return None
+        if self.session_logger:
+            self.session_logger.log(f"{self.log_prefix}_KEY_BACKOFF", {
+                "pass": self.pass_number,
+                "wait_ms": round(wait * 1000),
+                "reason": str(self.previous.last_error),
+            })
+        logger.warning(f"All {len(self.keys)} keys failed (pass {self.pass_number}); retrying in {wait:.2f}s")
+        self.pass_number += 1
+        self.pass_had_transient = False
+        self.tried.clear()
+        return wait
+
+    def moved_on(self, attempt: KeyAttempt) -> None:
+        """The caller asked for another attempt, so ``attempt`` failed."""
+        if not attempt.held:
+            attempt._release(OUTCOME_ERROR)
+        if attempt.outcome in _TRANSIENT_OUTCOMES:
+            self.pass_had_transient = True
+
+    def close(self) -> None:
+        if self.previous is not None and not self.previous.held:
+            self.previous._release(OUTCOME_ERROR)
+
+
+def iter_key_attempts(
+    keys: list,
+    session_logger: Optional[SessionLogger] = None,
+    log_prefix: str = "GEMINI",
+    deadline: float = None,
+    max_passes: int = None,
+    on_outcome: callable = None,
+) -> Generator[KeyAttempt, None, None]:
+    """Yield ``KeyAttempt``s over ``keys``, healthiest first.
+
+    Each pass tries every key at most once. If every key in a pass failed and
+    at least one failure was transient (429/5xx/timeout), the iterator sleeps
+    and starts another pass, as configured under ``config["gemini"]["retry"]``:
+    the wait is a jittered exponential backoff, but never shorter than the
+    time until the first key leaves cooldown (which already honours any
+    Retry-After). No pass starts after now + ``retry.max_wait_seconds``, or
+    after ``deadline`` (a ``time.time()`` value, e.g. the turn deadline) if
+    that comes first; past ``deadline`` no further key is tried at all.
+    ``max_passes`` caps the number of passes (the model ladder gives every
+    model but the last a single pass), and ``on_outcome(outcome, latency_ms)``
+    is called with each attempt's reported outcome.
+
+    Logs ``{log_prefix}_KEY_ROTATION`` before every attempt after the first and
+    ``{log_prefix}_KEY_BACKOFF`` before each wait. The last error is available
+    as ``.last_error`` on the final attempt.
+    """
+    sequence = _AttemptSequence(keys, session_logger, log_prefix, deadline, max_passes, on_outcome)
+    try:
+        while True:
+            attempt, wait = sequence.next()
+            if attempt is None:
+                if wait is None:
+                    return
+                time.sleep(wait)
+                continue
+            yield attempt
+            sequence.moved_on(attempt)
+    finally:
+        sequence.close()
+
+
+async def aiter_key_attempts(
+    keys: list,
+    session_logger: Optional[SessionLogger] = None,
+    log_prefix: str = "GEMINI",
+    deadline: float = None,
+    max_passes: int = None,
+    on_outcome: callable = None,
+) -> AsyncGenerator[KeyAttempt, None]:
+    """asyncio version of ``iter_key_attempts``; backoff waits do not block
+    the event loop."""
+    sequence = _AttemptSequence(keys, session_logger, log_prefix, deadline, max_passes, on_outcome)
+    try:
+        while True:
+            attempt, wait = sequence.next()
+            if attempt is None:
+                if wait is None:
+                    return
+                await asyncio.sleep(wait)
+                continue
+            yield attempt
+            sequence.moved_on(attempt)
+    finally:
+        sequence.close()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-call-type model fallback ladder.
+
+Key rotation cannot help when a whole model is overloaded (503 on every key)
+or slow. For call types with a ladder under ``config["gemini"]["fallback_models"]``::
+
+    "fallback_models": {
+        "mcp":       ["gemini-2.5-flash", "gemini-2.5-flash-lite"],
+        "synthesis": ["gemini-2.5-flash"]
+    }
+
+the requested model is tried first and the listed models after it. Moving
+down happens two ways:
+
+- within a call: every key failed one pass on a model, so the next model is
+  tried (only the last model gets the usual wait-and-retry passes);
+- across calls: a model whose rolling error rate (5xx, timeouts, broken
+  streams; 429s are a key's quota and 4xx / payload errors the caller's, so
+  neither counts) or median latency to
+  response headers crosses the ``config["gemini"]["model_health"]`` limits
+  is demoted for ``demote_seconds``. Demoted models go to the end of the
+  ladder, and come back with a fresh window once the demotion expires.
+
+Every model a ladder call moves to is logged as ``GEMINI_MODEL_SELECTED``,
+so the model behind each response (and its latency) can be attributed.
+"""
+
+import collections
+import logging
+import statistics
+import threading
+import time
+from typing import AsyncGenerator, Generator, Optional
+
+from src.config import load_config
+from src.gemini.key_scheduler import (
+    OUTCOME_OK,
+    OUTCOME_SERVER_ERROR,
+    OUTCOME_STREAM_BROKEN,
+    OUTCOME_TIMEOUT,
+    KeyAttempt,
+    aiter_key_attempts,
+    iter_key_attempts,
+)
+from src.session_logger import SessionLogger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEALTH_WINDOW = 20
+DEFAULT_MIN_SAMPLES = 5
+DEFAULT_MAX_ERROR_RATE = 0.5
+DEFAULT_MAX_MEDIAN_LATENCY_MS = 15000
+DEFAULT_DEMOTE_SECONDS = 60
+
+# Outcomes that say something about the model rather than the key. Plain
+# OUTCOME_ERROR (4xx answers, bad payloads, attempts released unreported) is
+# the caller's problem and must not demote a model.
+_MODEL_ERROR_OUTCOMES = (OUTCOME_SERVER_ERROR, OUTCOME_TIMEOUT, OUTCOME_STREAM_BROKEN)
+
+
+class _ModelState:
+    """Rolling outcomes for one model (guarded by the tracker lock)."""
+
+    __slots__ = ("samples", "demoted_until", "demoted_reason", "requests", "failures")
+
+    def __init__(self, window: int):
+        # (ok, latency_ms) per finished attempt
+        self.samples = collections.deque(maxlen=window)
+        self.demoted_until = 0.0
+        self.demoted_reason = None
+        self.requests = 0
+        self.failures = 0
+
+
+class ModelHealthTracker:
+    """Process-wide, thread-safe error rate / latency record per model."""
+
+    def __init__(
+        self,
+        window: int = DEFAULT_HEALTH_WINDOW,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        max_error_rate: float = DEFAULT_MAX_ERROR_RATE,
+        max_median_latency_ms: Optional[float] = DEFAULT_MAX_MEDIAN_LATENCY_MS,
+        demote_seconds: float = DEFAULT_DEMOTE_SECONDS,
+    ):
+        self.window = window
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.max_median_latency_ms = max_median_latency_ms
+        self.demote_seconds = demote_seconds
+        self._lock = threading.Lock()
+        self._states: dict[str, _ModelState] = {}
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._states.get(model)
+        if state is None:
+            state = self._states[model] = _ModelState(self.window)
+        return state
+
+    def record(self, model: str, outcome: str, latency_ms: float = None) -> None:
+        """Record one attempt's ``OUTCOME_*`` on ``model``; demotes it when
+        the window crosses the error-rate or latency limit."""
+        if outcome == OUTCOME_OK:
+            ok = True
+        elif outcome in _MODEL_ERROR_OUTCOMES:
+            ok = False
+        else:
+            return  # Rate limits and cancelled hedges are not the model's fault
+        now = time.time()
+        with self._lock:
+            state = self._state(model)
+            state.requests += 1
+            if not ok:
+                state.failures += 1
+            if state.demoted_until > now:
+                return  # Already demoted; the window restarts when it expires
+            state.samples.append((ok, latency_ms if ok else None))
+            reason = self._demotion_reason(state)
+            if reason:
+                state.demoted_until = now + self.demote_seconds
+                state.demoted_reason = reason
+                state.samples.clear()
+        if reason:
+            logger.warning(f"Demoting model {model} for {self.demote_seconds}s: {reason}")
+
+    def _demotion_reason(self, state: _ModelState) -> Optional[str]:
+        if len(state.samples) < self.min_samples:
+            return None
+        errors = sum(1 for ok, _ in state.samples if not ok)
+        error_rate = errors / len(state.samples)
+        if error_rate >= self.max_error_rate:
+            return f"error rate {error_rate:.0%} over last {len(state.samples)} calls"
+        latencies = [ms for ok, ms in state.samples if ok and ms is not None]
+        if self.max_median_latency_ms and len(latencies) >= self.min_samples:
+            median = statistics.median(latencies)
+            if median > self.max_median_latency_ms:
+                return f"median latency {median:.0f}ms over last {len(latencies)} calls"
+        return None
+
+    def demoted(self, model: str) -> Optional[str]:
+        """The reason ``model`` is currently demoted, or None."""
+        with self._lock:
+            state = self._states.get(model)
+            if state is None or state.demoted_until <= time.time():
+                return None
+            return state.demoted_reason
+
+    def stats(self) -> list:
+        """Per-model health snapshot for diagnostics."""
+        now = time.time()
+        with self._lock:
+            snapshot = []
+            for model, s in self._states.items():
+                latencies = [ms for ok, ms in s.samples if ok and ms is not None]
+                snapshot.append({
+                    "model": model,
+                    "requests": s.requests,
+                    "failures": s.failures,
+                    "window_error_rate": round(sum(1 for ok, _ in s.samples if not ok) / len(s.samples), 3) if s.samples else None,
+                    "window_median_latency_ms": round(statistics.median(latencies), 1) if latencies else None,
+                    "demoted_remaining_s": round(max(s.demoted_until - now, 0.0), 1),
+                    "demoted_reason": s.demoted_reason if s.demoted_until > now else None,
+                })
+            return snapshot
+
+
+_tracker: Optional[ModelHealthTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_model_health() -> ModelHealthTracker:
+    """Return the process-wide tracker, created from ``config["gemini"]["model_health"]``."""
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                health_config = load_config().get("gemini", {}).get("model_health", {})
+                _tracker = ModelHealthTracker(
+                    window=health_config.get("window", DEFAULT_HEALTH_WINDOW),
+                    min_samples=health_config.get("min_samples", DEFAULT_MIN_SAMPLES),
+                    max_error_rate=health_config.get("max_error_rate", DEFAULT_MAX_ERROR_RATE),
+                    max_median_latency_ms=health_config.get("max_median_latency_ms", DEFAULT_MAX_MEDIAN_LATENCY_MS),
+                    demote_seconds=health_config.get("demote_seconds", DEFAULT_DEMOTE_SECONDS),
+                )
+    return _tracker
+
+
+def get_model_stats() -> list:
+    """Model health for diagnostics, or an empty list before the first ladder call."""
+    return _tracker.stats() if _tracker is not None else []
+
+
+def model_ladder(model: str, call_type: Optional[str]) -> list:
+    """``model`` followed by the configured fallbacks for ``call_type``."""
+    fallbacks = load_config().get("gemini", {}).get("fallback_models", {}).get(call_type, []) if call_type else []
+    ladder = [model]
+    for fallback in fallbacks:
+        if fallback not in ladder:
+            ladder.append(fallback)
+    return ladder
+
+
+class _LadderSequence:
+    """Model ordering and logging shared by ``iter_model_attempts`` and its
+    asyncio twin."""
+
+    def __init__(self, model: str, call_type: Optional[str],
+                 session_logger: Optional[SessionLogger], deadline: Optional[float]):
+        self.call_type = call_type
+        self.requested = model
+        self.session_logger = session_logger
+        self.deadline = deadline
+        ladder = model_ladder(model, call_type)
+        self.active = len(ladder) > 1
+        self.tracker = get_model_health() if self.active else None
+        if self.active:
+            demoted = {m: self.tracker.demoted(m) for m in ladder}
+            # Healthy models keep their ladder order; demoted ones go last
+            self.models = [m for m in ladder if not demoted[m]] + [m for m in ladder if demoted[m]]
+            self.demoted = demoted
+        else:
+            self.models = ladder
+            self.demoted = {}
+
+    def steps(self) -> Generator[tuple, None, None]:
+        """Yield ``(model, max_passes, on_outcome)`` for each model to try."""
+        for index, model in enumerate(self.models):
+            if index and self.deadline is not None and time.time() >= self.deadline:
+                return  # Out of turn budget: do not start on another model
+            if not self.active:
+                yield model, None, None
+                continue
+            if index:
+                reason = f"all keys failed on {self.models[index - 1]}"
+            elif model != self.requested:
+                reason = f"{self.requested} demoted: {self.demoted[self.requested]}"
+            else:
+                reason = "requested"
+            self._log_selected(model, reason)
+            last = index == len(self.models) - 1
+            yield model, (None if last else 1), self._recorder(model)
+
+    def _recorder(self, model: str) -> callable:
+        tracker = self.tracker
+
+        def on_outcome(outcome: str, latency_ms: float = None):
+            tracker.record(model, outcome, latency_ms)
+        return on_outcome
+
+    def _log_selected(self, model: str, reason: str):
+        if model != self.requested:
+            logger.info(f"Using fallback model {model} for {self.call_type} call ({reason})")
+        if self.session_logger:
+            self.session_logger.log("GEMINI_MODEL_SELECTED", {
+                "call_type": self.call_type,
+                "requested_model": self.requested,
+                "model": model,
+                "fallback": model != self.requested,
+                "reason": reason,
+            })
+
+
+def iter_model_attempts(
+    keys: list,
+    model: str,
+    call_type: Optional[str],
+    session_logger: Optional[SessionLogger] = None,
+    log_prefix: str = "GEMINI",
+    deadline: float = None,
+) -> Generator[tuple[str, KeyAttempt], None, None]:
+    """``iter_key_attempts`` over the model ladder: yields ``(model, attempt)``.
+
+    Without a ladder for ``call_type`` this is exactly ``iter_key_attempts``
+    on ``model``. With one, each model but the last gets a single pass over
+    the keys before the next model is tried, every attempt's outcome feeds
+    that model's health, and no new model is started past ``deadline``.
+    """
+    sequence = _LadderSequence(model, call_type, session_logger, deadline)
+    for model, max_passes, on_outcome in sequence.steps():
+        for attempt in iter_key_attempts(keys, session_logger, log_prefix=log_prefix, deadline=deadline,
+                                         max_passes=max_passes, on_outcome=on_outcome):
+            yield model, attempt
+
+
+async def aiter_model_attempts(
+    keys: list,
+    model: str,
+    call_type: Optional[str],
+    session_logger: Optional[SessionLogger] = None,
+    log_prefix: str = "GEMINI",
+    deadline: float = None,
+) -> AsyncGenerator[tuple[str, KeyAttempt], None]:
+    """asyncio version of ``iter_model_attempts``."""
+    sequence = _LadderSequence(model, call_type, session_logger, deadline)
+    for model, max_passes, on_outcome in sequence.steps():
+        async for attempt in aiter_key_attempts(keys, session_logger, log_prefix=log_prefix, deadline=deadline,
+                                                max_passes=max_passes, on_outcome=on_outcome):
+            yield model, attempt
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incrementally serialized request bodies for multi-turn Gemini loops.
+
+The MCP tool loop sends the same tools, system instruction and generation
+config on every iteration, plus a ``contents`` list that only grows. A
+``PayloadBuilder`` serializes the static part once, keeps the turns already
+sent as bytes, and serializes only the turns appended since, so the
+per-iteration cost follows the new content rather than the whole body. The
+function-declarations fragment is shared by every builder made for the same
+declarations list (the tool catalog builds one list per catalog version).
+
+Bodies are sent as-is with ``data=`` (see ``post_payload``).
+``build_gemini_payload`` builds the plain dict body for one-shot calls, and
+``gemini_payload_builder`` the incremental one.
+"""
+
+import hashlib
+import json
+from typing import Optional
+
+from src.gemini.prompt_layout import (
+    append_volatile_parts,
+    latest_query_index,
+    layout_system_instruction,
+    with_volatile_parts,
+)
+
+# orjson serializes several times faster (optional import).
+try:
+    import orjson
+
+    def json_dumps(value) -> bytes:
+        return orjson.dumps(value)
+except ImportError:
+    def json_dumps(value) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+# Request members an explicit cachedContents entry can hold.
+CACHEABLE_KEYS = ("tools", "toolConfig", "systemInstruction")
+
+# (declarations list, its serialized "tools" fragment); keyed by identity
+_tools_fragment: Optional[tuple] = None
+
+
+def serialized_tools(declarations: list) -> bytes:
+    """The ``[{"functionDeclarations": ...}]`` bytes for ``declarations``,
+    serialized once per list object."""
+    global _tools_fragment
+    cached = _tools_fragment
+    if cached is not None and cached[0] is declarations:
+        return cached[1]
+    fragment = json_dumps([{"functionDeclarations": declarations}])
+    _tools_fragment = (declarations, fragment)
+    return fragment
+
+
+class PayloadBuilder:
+    """A generateContent body whose ``contents`` grows one turn at a time.
+
+    The static members are kept apart by whether an explicit ``cachedContents``
+    entry can hold them (tools, tool config, system instruction), so the same
+    builder can produce the body with them inline or with a ``cachedContent``
+    reference in their place (see ``src.gemini.context_cache``).
+
+    Args:
+        static_payload: Everything but ``contents`` and ``tools`` (as built by
+            ``gemini_payload_builder``).
+        tools: Optional function declarations; serialized once per list object.
+        volatile_parts: Parts added to the latest user query turn appended
+            (the prefix-stable prompt layout's datetime), the same turn
+            ``append_volatile_parts`` picks for a whole message list.
+    """
+
+    def __init__(self, static_payload: dict, tools: list = None, volatile_parts: list = None):
+        # "key":value members, serialized once
+        self._cacheable = []
+        self._uncached = []
+        if tools:
+            self._cacheable.append(b'"tools":' + serialized_tools(tools))
+        for key, value in static_payload.items():
+            if key == "contents":
+                continue
+            member = json_dumps(key) + b":" + json_dumps(value)
+            (self._cacheable if key in CACHEABLE_KEYS else self._uncached).append(member)
+        self._suffix = _close(self._uncached + self._cacheable)
+        self._prefix_hash = None
+        self._contents = bytearray(b'{"contents":[')
+        self._volatile_parts = volatile_parts or []
+        # (index in contents, byte span in _contents, turn without the parts)
+        # of the query turn currently carrying the volatile parts
+        self._volatile_turn = None
+        self.contents = []
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "PayloadBuilder":
+        """A builder holding a complete ``build_gemini_payload`` dict."""
+        builder = cls(payload)
+        builder.append(*payload.get("contents", ()))
+        return builder
+
+    def append(self, *turns: dict) -> None:
+        """Add turns (``{"role": ..., "parts": [...]}``); only these are serialized."""
+        carrier = latest_query_index(turns) if self._volatile_parts else None
+        if carrier is not None and self._volatile_turn is not None:
+            self._strip_volatile_parts()
+        for offset, turn in enumerate(turns):
+            plain = turn
+            if offset == carrier:
+                turn = with_volatile_parts(turn, self._volatile_parts)
+            if self.contents:
+                self._contents += b","
+            start = len(self._contents)
+            self._contents += json_dumps(turn)
+            if offset == carrier:
+                self._volatile_turn = (len(self.contents), start, len(self._contents), plain)
+            self.contents.append(turn)
+
+    def _strip_volatile_parts(self) -> None:
+        """Move the volatile parts off an earlier query turn (re-serializing
+        only that turn) before a later query turn takes them."""
+        index, start, end, plain = self._volatile_turn
+        serialized = json_dumps(plain)
+        self._contents[start:end] = serialized
+        self.contents[index] = plain
+        self._volatile_turn = None
+
+    def body(self, cached_content: str = None) -> bytes:
+        """The full request body for the turns appended so far; with
+        ``cached_content`` the cacheable members are replaced by that
+        ``cachedContents/...`` reference."""
+        if cached_content is None:
+            return bytes(self._contents) + self._suffix
+        reference = b'"cachedContent":' + json_dumps(cached_content)
+        return bytes(self._contents) + _close(self._uncached + [reference])
+
+    @property
+    def cacheable(self) -> bool:
+        return bool(self._cacheable)
+
+    def prefix_hash(self) -> str:
+        """Hash of the cacheable members (system prompt, tools), computed once."""
+        if self._prefix_hash is None:
+            self._prefix_hash = hashlib.sha256(b"\0".join(self._cacheable)).hexdigest()[:16]
+        return self._prefix_hash
+
+    def cache_request(self, model: str, ttl_seconds: int) -> bytes:
+        """A ``cachedContents.create`` body holding the cacheable members."""
+        members = [
+            b'"model":' + json_dumps(f"models/{model}"),
+            b'"ttl":' + json_dumps(f"{ttl_seconds}s"),
+            *self._cacheable,
+        ]
+        return b"{" + b",".join(members) + b"}"
+
+
+def _close(members: list) -> bytes:
+    """Close the contents array, then append the static members."""
+    return b"]" + b"".join(b"," + member for member in members) + b"}"
+
+
+def build_thinking_config(thinking_value: str, include_thoughts: bool = False) -> dict:
+    """Build thinking configuration for Gemini 3 models.
+
+    Args:
+        thinking_value: Thinking level ('minimal', 'low', 'medium', 'high')
+        include_thoughts: If True, includes thought summaries in the response
+
+    Returns:
+        dict: thinkingConfig for Gemini generationConfig
+    """
+    # Gemini 3 Flash valid levels
+    valid_levels = ["minimal", "low", "medium", "high"]
+    level = thinking_value.lower() if thinking_value.lower() in valid_levels else "low"
+
+    config = {
+        "thinkingConfig": {
+            "thinkingLevel": level  # Gemini 3 format (string)
+        }
+    }
+
+    if include_thoughts:
+        config["thinkingConfig"]["includeThoughts"] = True
+
+    return config
+
+
+def build_gemini_payload(
+    messages: list,
+    system_instruction: str,
+    tools: list = None,
+    temperature: float = 0.3,
+    thinking_level: str = None,
+    response_schema: dict = None,
+    include_thoughts: bool = False
+) -> dict:
+    """Build a generateContent / streamGenerateContent request body.
+
+    Shared by the blocking and asyncio clients so both send identical
+    payloads.
+    """
+    payload = {
+        "contents": messages,
+        "generationConfig": {
+            "temperature": temperature,
+        }
+    }
+
+    if system_instruction:
+        # The datetime goes either into the prompt or, for the prefix-stable
+        # layout, after the user's query (see src.gemini.prompt_layout)
+        system_text, volatile_parts = layout_system_instruction(system_instruction)
+        payload["systemInstruction"] = {"parts": [{"text": system_text}]}
+        payload["contents"] = append_volatile_parts(messages, volatile_parts)
+
+    if tools:
+        payload["tools"] = [{"functionDeclarations": tools}]
+
+    if thinking_level:
+        payload["generationConfig"].update(
+            build_thinking_config(thinking_level, include_thoughts=include_thoughts)
+        )
+
+    if response_schema:
+        payload["generationConfig"]["responseMimeType"] = "application/json"
+        payload["generationConfig"]["responseSchema"] = response_schema
+
+    return payload
+
+
+def gemini_payload_builder(
+    system_instruction: str,
+    tools: list = None,
+    temperature: float = 0.3,
+    thinking_level: str = None,
+    response_schema: dict = None,
+    include_thoughts: bool = False
+) -> PayloadBuilder:
+    """A ``PayloadBuilder`` for a multi-turn loop: the same body as
+    ``build_gemini_payload`` with the static part serialized once.
+
+    Pass it as ``payload_builder`` and ``append`` each new turn to it."""
+    static_payload = build_gemini_payload(
+        [], None, None, temperature, thinking_level,
+        response_schema, include_thoughts=include_thoughts
+    )
+    del static_payload["contents"]
+    volatile_parts = []
+    if system_instruction:
+        system_text, volatile_parts = layout_system_instruction(system_instruction)
+        static_payload["systemInstruction"] = {"parts": [{"text": system_text}]}
+    return PayloadBuilder(static_payload, tools, volatile_parts=volatile_parts)
+
+
+def post_payload(pool, url: str, payload, stream: bool = False, timeout: float = None):
+    """POST a payload dict, or a body already serialized by ``PayloadBuilder``."""
+    if isinstance(payload, (bytes, bytearray)):
+        return pool.post(url, data=payload, headers={"Content-Type": "application/json"},
+                         stream=stream, timeout=timeout)
+    return pool.post(url, json=payload, headers={"Content-Type": "application/json"},
+                     stream=stream, timeout=timeout)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Where volatile text goes in a Gemini request.
+
+Gemini's implicit context caching only reuses an identical request prefix
+(tools, system instruction, then contents). With the default ``inline``
+layout, ``{{CURRENT_DATETIME}}`` is substituted into the system instruction,
+so the large MCP / KB / synthesis prompts change every minute and never hit
+the cache.
+
+``config["gemini"]["prompt_layout"] = "prefix_stable"`` keeps every static
+byte first: the system instruction is sent with the placeholder replaced by a
+fixed reference, and the datetime itself travels as an extra text part at the
+end of the user's query turn, after the history. Cached tokens show up as
+``cached_input`` in the per-query token usage.
+"""
+
+from typing import Optional
+
+from src.config import get_current_datetime_ist, inject_datetime, load_config
+
+DATETIME_PLACEHOLDER = "{{CURRENT_DATETIME}}"
+# Stands in for the datetime inside a prefix-stable system instruction.
+DATETIME_REFERENCE = "(the current date and time given with the user's message)"
+
+LAYOUT_INLINE = "inline"
+LAYOUT_PREFIX_STABLE = "prefix_stable"
+
+
+def prompt_layout() -> str:
+    return load_config().get("gemini", {}).get("prompt_layout", LAYOUT_INLINE)
+
+
+def layout_system_instruction(system_instruction: str) -> tuple[str, list]:
+    """Split a system prompt into its text and the volatile parts to send
+    with the user's query turn (empty for the inline layout)."""
+    if prompt_layout() != LAYOUT_PREFIX_STABLE or DATETIME_PLACEHOLDER not in system_instruction:
+        return inject_datetime(system_instruction), []
+    text = system_instruction.replace(DATETIME_PLACEHOLDER, DATETIME_REFERENCE)
+    return text, [{"text": f"Current date and time: {get_current_datetime_ist()}"}]
+
+
+def is_query_turn(turn: dict) -> bool:
+    """A user turn carrying text (not a turn of function responses)."""
+    return turn.get("role") == "user" and any("text" in part for part in turn.get("parts", ()))
+
+
+def with_volatile_parts(turn: dict, volatile_parts: list) -> dict:
+    """A copy of ``turn`` with ``volatile_parts`` appended to its parts."""
+    return {**turn, "parts": [*turn.get("parts", []), *volatile_parts]}
+
+
+def latest_query_index(messages: list) -> Optional[int]:
+    """Index of the turn that carries the volatile parts: the latest query
+    turn, or None if there is none. Both ``append_volatile_parts`` and
+    ``PayloadBuilder`` place the parts by this rule."""
+    for index in range(len(messages) - 1, -1, -1):
+        if is_query_turn(messages[index]):
+            return index
+    return None
+
+
+def append_volatile_parts(messages: list, volatile_parts: list) -> list:
+    """``messages`` with ``volatile_parts`` added to the latest query turn
+    (the caller's list and turns are not modified)."""
+    if not volatile_parts:
+        return messages
+    index = latest_query_index(messages)
+    if index is None:
+        return [*messages, {"role": "user", "parts": list(volatile_parts)}]
+    return [*messages[:index], with_volatile_parts(messages[index], volatile_parts), *messages[index + 1:]]
@@ -13,17 +13,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+"""JSON-RPC client for the Data Commons MCP server (streamable HTTP).
+
+``McpClient`` keeps a pool of initialized MCP sessions over one keep-alive
+``requests.Session``. Each call checks out its own session for the duration
+of the request, so concurrent chats (Flask runs ``threaded=True``) neither
+share a session nor overwrite each other's ``Mcp-Session-Id``. Sessions are
+initialized lazily, up to ``config["mcp"]["session_pool"]["size"]``; a call
+that finds them all busy waits for one to be returned.
+
+Sidecar restarts are recovered from without help: a session the server no
+longer knows (404) or a dropped connection marks the pool's sessions stale,
+and new ones are initialized on demand. Initialization is serialized, and
+after a failed one the next is held back with exponential backoff (calls
+fail fast meanwhile), so a restart causes neither a burst of errors nor a
+herd of ``initialize`` calls. Idempotent calls (``tools/list`` and the tools
+in ``config["mcp"]["recovery"]["idempotent_tools"]``) are retried once on a
+fresh session.
+
+The module functions (``initialize_mcp``, ``call_tool``, ``mcp_request``) go
+through the process-wide client from ``get_mcp_client()``. The tool list is
+kept by ``src.mcp.tool_catalog``.
+"""
+
+import contextlib
 import logging
 import os
+import threading
 import time
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from src.config import load_config
+from src.deadline import Deadline, request_timeout
+from src.mcp.result_cache import get_result_cache
 from src.mcp.schema import fix_tool_arguments
+from src.mcp.single_flight import coalesce
 from src.session_logger import SessionLogger
+from src.sse import SSE_READ_SIZE, iter_sse_json
 
 logger = logging.getLogger(__name__)
 
@@ -31,147 +60,435 @@ logger = logging.getLogger(__name__)
 MCP_PORT = int(os.environ.get("MCP_PORT", 3000))
 MCP_URL = f"http://localhost:{MCP_PORT}/mcp"
 
-# Global state
-session_id = None
-tools_cache = None
+DEFAULT_SESSION_POOL_SIZE = 4
+DEFAULT_ACQUIRE_TIMEOUT_SECONDS = 30
+NOTIFICATION_TIMEOUT_SECONDS = 5
 
+DEFAULT_BACKOFF_INITIAL_SECONDS = 0.5
+DEFAULT_BACKOFF_MAX_SECONDS = 30
+DEFAULT_IDEMPOTENT_TOOLS = ("search_indicators", "get_observations")
+# JSON-RPC methods that are always safe to resend
+IDEMPOTENT_METHODS = ("tools/list",)
 
-def mcp_request(method: str, params: dict = None, is_notification: bool = False) -> dict:
-    """Send a JSON-RPC request or notification to the MCP server.
 
-    Args:
-        method: The JSON-RPC method name
-        params: Optional parameters
-        is_notification: If True, sends as notification (no id, no response expected)
-    """
-    global session_id  # Needed to SET the global session_id from response headers
+class McpSessionUnavailable(Exception):
+    """No MCP session could be checked out (initialize failed or pool busy)."""
+
 
-    payload = {
-        "jsonrpc": "2.0",
-        "method": method
-    }
+class McpSession:
+    """One initialized MCP session (the server's ``Mcp-Session-Id``)."""
 
-    # Notifications don't have an id
-    if not is_notification:
-        payload["id"] = int(time.time() * 1000)
+    __slots__ = ("session_id", "initialized", "generation", "broken")
 
-    if params:
-        payload["params"] = params
+    def __init__(self, generation: int = 0):
+        # None until the server assigns one (stateless servers never do)
+        self.session_id = None
+        self.initialized = False
+        # Sessions from before the last detected server restart are dropped
+        self.generation = generation
+        # Set when the server rejected the session or the connection failed
+        self.broken = False
 
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json, text/event-stream"
-    }
 
-    if session_id:
-        headers["Mcp-Session-Id"] = session_id
+class McpClient:
+    """Thread-safe MCP client with a pool of sessions on keep-alive connections.
+
+    Args:
+        url: The MCP endpoint.
+        pool_size: Max sessions (and keep-alive connections) held open.
+        acquire_timeout: Seconds a call waits for a free session.
+        backoff_initial: Seconds to hold back initialize after one failure;
+            doubles with each further failure in a row.
+        backoff_max: Cap on that backoff.
+    """
 
-    try:
-        # For notifications, we send but don't expect a response
-        if is_notification:
-            requests.post(
-                MCP_URL,
+    def __init__(self, url: str = MCP_URL, pool_size: int = DEFAULT_SESSION_POOL_SIZE,
+                 acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT_SECONDS,
+                 backoff_initial: float = DEFAULT_BACKOFF_INITIAL_SECONDS,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX_SECONDS):
+        self.url = url
+        self.pool_size = max(1, pool_size)
+        self.acquire_timeout = acquire_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self._http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
+
+        self._available = threading.Condition()
+        self._idle: list[McpSession] = []
+        self._open = 0  # Sessions created or being initialized
+        self._in_use = 0
+        self._counts = {"checkouts": 0, "waits": 0, "wait_ms": 0.0, "peak_in_use": 0,
+                        "initialized": 0, "init_failures": 0, "acquire_timeouts": 0,
+                        "recoveries": 0, "retries": 0}
+
+        # Recovery: sessions older than _generation are stale; initialize is
+        # serialized by _init_lock and held back until _init_retry_at
+        self._generation = 0
+        self._init_lock = threading.Lock()
+        self._init_failures_in_row = 0
+        self._init_retry_at = 0.0
+
+        # Called with (method, params) for server notifications seen in responses
+        self._notification_listeners: list[Callable[[str, dict], None]] = []
+
+    # -- Sessions ---------------------------------------------------------
+
+    @property
+    def ready(self) -> bool:
+        """True once at least one session has been initialized."""
+        with self._available:
+            return self._counts["initialized"] > 0
+
+    def initialize(self) -> bool:
+        """Make sure one session is initialized (opening it if none is idle)."""
+        try:
+            with self.session():
+                return True
+        except McpSessionUnavailable as e:
+            logger.error(f"Failed to initialize MCP: {e}")
+            return False
+
+    @contextlib.contextmanager
+    def session(self, deadline: Optional[Deadline] = None):
+        """Check out a session for one or more requests; returned on exit.
+
+        Raises:
+            McpSessionUnavailable: initialize failed, or every session stayed
+                busy past the acquire timeout (or the turn deadline).
+        """
+        mcp_session = self._acquire(deadline)
+        try:
+            yield mcp_session
+        finally:
+            self._release(mcp_session)
+
+    def _acquire(self, deadline: Optional[Deadline]) -> McpSession:
+        timeout = self.acquire_timeout
+        if deadline is not None:
+            timeout = min(timeout, max(deadline.spendable(), 0.0))
+        waited_from = None
+        with self._available:
+            while True:
+                if self._idle:
+                    mcp_session = self._idle.pop()
+                    if mcp_session.generation != self._generation:
+                        self._open -= 1  # Opened before a server restart
+                        continue
+                    break
+                if self._open < self.pool_size:
+                    self._open += 1
+                    mcp_session = None
+                    break
+                now = time.time()
+                if waited_from is None:
+                    waited_from = now
+                    self._counts["waits"] += 1
+                remaining = waited_from + timeout - now
+                if remaining <= 0:
+                    self._counts["acquire_timeouts"] += 1
+                    raise McpSessionUnavailable(f"all {self.pool_size} MCP sessions busy for {timeout:.1f}s")
+                self._available.wait(remaining)
+            self._checked_out(waited_from)
+
+        if mcp_session is None:
+            # Initialize outside the pool lock; the slot is already reserved
+            try:
+                mcp_session = self._open_session()
+            except McpSessionUnavailable:
+                with self._available:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._available.notify()
+                raise
+        return mcp_session
+
+    def _open_session(self) -> McpSession:
+        """Initialize a new session, one at a time and not during backoff."""
+        with self._init_lock:
+            wait = self._init_retry_at - time.time()
+            if wait > 0:
+                raise McpSessionUnavailable(f"MCP server unavailable; next initialize attempt in {wait:.1f}s")
+            mcp_session = McpSession(self._generation)
+            error = self._initialize(mcp_session)
+            if error is None:
+                self._init_failures_in_row = 0
+                return mcp_session
+            self._init_failures_in_row += 1
+            backoff = min(self.backoff_initial * 2 ** (self._init_failures_in_row - 1), self.backoff_max)
+            self._init_retry_at = time.time() + backoff
+        with self._available:
+            self._counts["init_failures"] += 1
+        logger.warning(f"MCP initialize failed ({error}); holding back for {backoff:.1f}s")
+        raise McpSessionUnavailable(str(error))
+
+    def _checked_out(self, waited_from: Optional[float]) -> None:
+        # Caller holds self._available
+        self._in_use += 1
+        self._counts["checkouts"] += 1
+        self._counts["peak_in_use"] = max(self._counts["peak_in_use"], self._in_use)
+        if waited_from is not None:
+            self._counts["wait_ms"] += (time.time() - waited_from) * 1000
+
+    def _release(self, mcp_session: McpSession) -> None:
+        with self._available:
+            self._in_use -= 1
+            if mcp_session.broken and mcp_session.generation == self._generation:
+                # Likely a server restart: every session opened so far is stale
+                self._generation += 1
+                self._counts["recoveries"] += 1
+                logger.warning("MCP session rejected or connection lost; re-initializing sessions")
+            if mcp_session.generation == self._generation:
+                self._idle.append(mcp_session)
+            else:
+                self._open -= 1
+            self._available.notify()
+
+    def _initialize(self, mcp_session: McpSession):
+        """Run the initialize handshake on a new session; returns an error or None."""
+        logger.info("Initializing MCP session...")
+        mcp_config = load_config().get("mcp", {})
+        result = self.request("initialize", {
+            "protocolVersion": mcp_config.get("protocol_version", "2024-11-05"),
+            "capabilities": {"roots": {"listChanged": True}},
+            "clientInfo": {
+                "name": mcp_config.get("client_name", "dc-mcp-proxy"),
+                "version": mcp_config.get("client_version", "1.0.0"),
+            },
+        }, mcp_session)
+        if "error" in result:
+            return result["error"]
+
+        mcp_session.initialized = True
+        with self._available:
+            self._counts["initialized"] += 1
+        logger.info(f"MCP session initialized: {mcp_session.session_id}")
+
+        # Send initialized notification (no id, no response expected)
+        self.request("notifications/initialized", {}, mcp_session, is_notification=True)
+        return None
+
+    # -- JSON-RPC ---------------------------------------------------------
+
+    def request(self, method: str, params: dict = None, mcp_session: McpSession = None,
+                is_notification: bool = False, deadline: Optional[Deadline] = None) -> dict:
+        """Send a JSON-RPC request or notification on ``mcp_session``.
+
+        Args:
+            method: The JSON-RPC method name
+            params: Optional parameters
+            mcp_session: The checked-out session; its id is updated from the
+                response headers.
+            is_notification: If True, sends as notification (no id, no response expected)
+            deadline: Optional turn ``Deadline``; the request timeout is the time it has left.
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "method": method
+        }
+
+        # Notifications don't have an id
+        if not is_notification:
+            payload["id"] = int(time.time() * 1000)
+
+        if params:
+            payload["params"] = params
+
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json, text/event-stream"
+        }
+
+        if mcp_session is not None and mcp_session.session_id:
+            headers["Mcp-Session-Id"] = mcp_session.session_id
+
+        try:
+            # For notifications, we send but don't expect a response
+            if is_notification:
+                self._http.post(
+                    self.url,
+                    json=payload,
+                    headers=headers,
+                    timeout=NOTIFICATION_TIMEOUT_SECONDS
+                ).close()
+                return {"result": "notification sent"}
+
+            response = self._http.post(
+                self.url,
                 json=payload,
                 headers=headers,
-                timeout=5
+                timeout=request_timeout(deadline),
+                stream=True
             )
-            return {"result": "notification sent"}
-
-        response = requests.post(
-            MCP_URL,
-            json=payload,
-            headers=headers,
-            timeout=300,
-            stream=True
-        )
-
-        # Log response details for debugging
-        logger.info(f"MCP Response - Status: {response.status_code}, Headers: {dict(response.headers)}")
-
-        # Get session ID from response (try multiple header variations)
-        session_header = (
-            response.headers.get("Mcp-Session-Id") or
-            response.headers.get("mcp-session-id") or
-            response.headers.get("MCP-Session-ID")
-        )
-        if session_header:
-            session_id = session_header
-            logger.info(f"Got MCP session ID from headers: {session_id}")
-        else:
-            logger.warning(f"No session ID in response headers. Available headers: {list(response.headers.keys())}")
-
-        content_type = response.headers.get("content-type", "")
-
-        if "text/event-stream" in content_type:
-            # Parse SSE response
-            result = None
-            for line in response.iter_lines():
-                if line:
-                    line_str = line.decode('utf-8')
-                    if line_str.startswith("data: "):
-                        try:
-                            data = json.loads(line_str[6:])
-                            if "result" in data:
-                                result = data["result"]
-                            elif "error" in data:
-                                return {"error": data["error"]}
-                        except json.JSONDecodeError:
-                            continue
-            return {"result": result} if result else {"error": "No result"}
-        else:
-            return response.json()
-
-    except requests.exceptions.ConnectionError:
-        return {"error": f"Cannot connect to MCP server at {MCP_URL}. Make sure it's running!"}
-    except Exception as e:
-        return {"error": str(e)}
-
-
-def initialize_mcp() -> bool:
-    """Initialize the MCP session."""
-    global session_id
-
-    logger.info("Initializing MCP session...")
 
-    mcp_config = load_config().get("mcp", {})
-    result = mcp_request("initialize", {
-        "protocolVersion": mcp_config.get("protocol_version", "2024-11-05"),
-        "capabilities": {"roots": {"listChanged": True}},
-        "clientInfo": {
-            "name": mcp_config.get("client_name", "dc-mcp-proxy"),
-            "version": mcp_config.get("client_version", "1.0.0"),
-        },
-    })
+            try:
+                # Log response details for debugging
+                logger.info(f"MCP Response - Status: {response.status_code}, Headers: {dict(response.headers)}")
+
+                # Get session ID from response (header lookup is case-insensitive)
+                session_header = response.headers.get("Mcp-Session-Id")
+                if session_header:
+                    if mcp_session is not None and mcp_session.session_id != session_header:
+                        mcp_session.session_id = session_header
+                        logger.info(f"Got MCP session ID from headers: {session_header}")
+                elif method == "initialize":
+                    logger.warning(f"No session ID in response headers. Available headers: {list(response.headers.keys())}")
+
+                if mcp_session is not None and mcp_session.session_id and _session_rejected(response):
+                    mcp_session.broken = True
+                    return {"error": f"MCP session expired (HTTP {response.status_code})"}
+
+                content_type = response.headers.get("content-type", "")
+
+                if "text/event-stream" in content_type:
+                    # Parse SSE response
+                    result = None
+                    for data in iter_sse_json(response.iter_content(chunk_size=SSE_READ_SIZE)):
+                        if "result" in data:
+                            result = data["result"]
+                        elif "error" in data:
+                            return {"error": data["error"]}
+                        elif "method" in data and "id" not in data:
+                            self._notify(data["method"], data.get("params", {}))
+                    return {"result": result} if result else {"error": "No result"}
+                else:
+                    return response.json()
+            finally:
+                # Hands the connection back to the keep-alive pool
+                response.close()
+
+        except requests.exceptions.ConnectionError:
+            if mcp_session is not None:
+                mcp_session.broken = True
+            return {"error": f"Cannot connect to MCP server at {self.url}. Make sure it's running!"}
+        except Exception as e:
+            return {"error": str(e)}
+
+    def call(self, method: str, params: dict = None, deadline: Optional[Deadline] = None,
+             idempotent: bool = None) -> dict:
+        """``request`` on a session checked out for just this call.
+
+        If the session turns out stale (server restarted) an idempotent call
+        (``idempotent``, default: ``method`` in ``IDEMPOTENT_METHODS``) is
+        retried once on a new session.
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        for attempt in range(2):
+            try:
+                with self.session(deadline) as mcp_session:
+                    result = self.request(method, params, mcp_session, deadline=deadline)
+            except McpSessionUnavailable as e:
+                return {"error": f"MCP session unavailable: {e}"}
+            if not mcp_session.broken or not idempotent or attempt:
+                return result
+            logger.warning(f"Retrying MCP {method} on a new session")
+            with self._available:
+                self._counts["retries"] += 1
+        return result
+
+    def add_notification_listener(self, listener: Callable[[str, dict], None]) -> None:
+        """Call ``listener(method, params)`` for each server notification
+        (e.g. ``notifications/tools/list_changed``) that arrives on a response stream."""
+        self._notification_listeners.append(listener)
+
+    def _notify(self, method: str, params: dict) -> None:
+        logger.info(f"MCP notification: {method}")
+        for listener in self._notification_listeners:
+            try:
+                listener(method, params)
+            except Exception as e:
+                logger.warning(f"MCP notification listener failed for {method}: {e}")
+
+    # -- Tools ------------------------------------------------------------
+
+    def list_tools(self) -> Optional[list]:
+        """Fetch the tool list from the MCP server; None if it could not be read."""
+        result = self.call("tools/list", {})
+        if "result" in result and result["result"] and "tools" in result["result"]:
+            return result["result"]["tools"]
+        return None
+
+    def stats(self) -> dict:
+        """Pool utilization for diagnostics."""
+        with self._available:
+            counts = dict(self._counts)
+            counts["wait_ms"] = round(counts["wait_ms"], 1)
+            return {
+                "url": self.url,
+                "generation": self._generation,
+                "init_backoff_s": round(max(self._init_retry_at - time.time(), 0.0), 1),
+                "pool_size": self.pool_size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "utilization": round(self._in_use / self.pool_size, 3),
+                **counts,
+            }
+
+
+_client: Optional[McpClient] = None
+_client_lock = threading.Lock()
+
+
+def get_mcp_client() -> McpClient:
+    """Return the process-wide MCP client, created from ``config["mcp"]["session_pool"]``."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                pool_config = load_config().get("mcp", {}).get("session_pool", {})
+                recovery_config = load_config().get("mcp", {}).get("recovery", {})
+                _client = McpClient(
+                    MCP_URL,
+                    pool_size=pool_config.get("size", DEFAULT_SESSION_POOL_SIZE),
+                    acquire_timeout=pool_config.get("acquire_timeout_seconds", DEFAULT_ACQUIRE_TIMEOUT_SECONDS),
+                    backoff_initial=recovery_config.get("backoff_initial_seconds", DEFAULT_BACKOFF_INITIAL_SECONDS),
+                    backoff_max=recovery_config.get("backoff_max_seconds", DEFAULT_BACKOFF_MAX_SECONDS),
+                )
+    return _client
+
+
+def get_mcp_stats() -> dict:
+    """MCP session pool stats, or an empty dict before the first MCP call."""
+    return _client.stats() if _client is not None else {}
+
+
+def mcp_request(method: str, params: dict = None, deadline: Optional[Deadline] = None,
+                idempotent: bool = None) -> dict:
+    """Send a JSON-RPC request to the MCP server on a pooled session."""
+    return get_mcp_client().call(method, params, deadline=deadline, idempotent=idempotent)
+
+
+def _session_rejected(response) -> bool:
+    """True if the server no longer knows the session we sent (it restarted)."""
+    if response.status_code == 404:
+        return True
+    return response.status_code == 400 and "session" in response.text.lower()
+
+
+def is_idempotent_tool(name: str) -> bool:
+    """Whether a ``tools/call`` of ``name`` may be resent after a session failure."""
+    recovery_config = load_config().get("mcp", {}).get("recovery", {})
+    return name in recovery_config.get("idempotent_tools", DEFAULT_IDEMPOTENT_TOOLS)
 
-    if "error" in result:
-        logger.error(f"Failed to initialize MCP: {result['error']}")
-        return False
 
-    logger.info(f"MCP session initialized: {session_id}")
-
-    # Send initialized notification (no id, no response expected)
-    mcp_request("notifications/initialized", {}, is_notification=True)
-    return True
-
-
-def get_tools() -> list:
-    """Get available tools from MCP server."""
-    global tools_cache
-
-    if tools_cache:
-        return tools_cache
-
-    result = mcp_request("tools/list", {})
-
-    if "result" in result and result["result"] and "tools" in result["result"]:
-        tools_cache = result["result"]["tools"]
-        return tools_cache
+def initialize_mcp() -> bool:
+    """Initialize an MCP session (a no-op once one is idle in the pool)."""
+    return get_mcp_client().initialize()
 
-    return []
 
+def call_tool(name: str, arguments: dict, session_logger: Optional[SessionLogger] = None,
+              deadline: Optional[Deadline] = None) -> Any:
+    """Call a tool on the MCP server with optional logging.
 
-def call_tool(name: str, arguments: dict, session_logger: Optional[SessionLogger] = None) -> Any:
-    """Call a tool on the MCP server with optional logging."""
+    Successful results of read-only tools are served from, and stored in,
+    the process-wide result cache (``src.mcp.result_cache``), and identical
+    calls already in flight are joined rather than repeated
+    (``src.mcp.single_flight``).
+    """
     # Fix common parameter mistakes
     fixed_args = fix_tool_arguments(name, arguments)
     if fixed_args != arguments:
@@ -183,10 +500,29 @@ def call_tool(name: str, arguments: dict, session_logger: Optional[SessionLogger
 
     start_time = time.time()
 
-    result = mcp_request("tools/call", {
-        "name": name,
-        "arguments": fixed_args
-    })
+    cache = get_result_cache()
+    if cache is not None and cache.ttl(name) > 0:
+        cached, tier = cache.get(name, fixed_args)
+        if session_logger:
+            session_logger.log("MCP_TOOL_CACHE", {"tool_name": name, "hit": cached is not None, "tier": tier})
+        if cached is not None:
+            if session_logger:
+                session_logger.log_mcp_tool_result(name, cached, (time.time() - start_time) * 1000, "success")
+            return cached
+
+    def fetch():
+        response = mcp_request("tools/call", {
+            "name": name,
+            "arguments": fixed_args
+        }, deadline=deadline, idempotent=is_idempotent_tool(name))
+        # Stored before coalesced callers are released, so later ones hit the cache
+        if cache is not None and "result" in response:
+            cache.put(name, fixed_args, response["result"])
+        return response
+
+    result, waited_ms = coalesce(name, fixed_args, fetch, timeout=request_timeout(deadline))
+    if waited_ms is not None and session_logger:
+        session_logger.log("MCP_TOOL_COALESCED", {"tool_name": name, "waited_ms": round(waited_ms, 1)})
 
     duration_ms = (time.time() - start_time) * 1000
 
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar compaction of ``get_observations`` results for Gemini.
+
+A child-place query (every district of a state over twenty years) returns
+one record per place, each repeating its field names, units and a
+``time_series`` of ``[date, value]`` pairs. That text goes to Gemini three
+times: as the ``functionResponse``, and inside ``mcp_results`` for synthesis
+and chart config.
+
+``compact_observations`` rewrites every list of such records as one dense
+table::
+
+    {"format": "table",
+     "common": {"unit": "USD"},                  # same in every record, once
+     "columns": ["place.dcid", "place.name", "2020", "2021"],
+     "rows": [["geoId/06", "California", 1.5, 1.7], ...]}
+
+Record fields (nested dicts flattened to dotted names) that are equal in
+every record are hoisted into ``common``; the rest become label columns,
+followed by one column per date (missing values are null). Everything outside
+these lists, such as ``source_metadata``, is kept as is.
+
+Settings under ``config["mcp"]["compaction"]``:
+
+- ``enabled``: default true
+- ``tools``: tools whose results are compacted (default ``get_observations``)
+- ``baseline_rate``: fraction of turns sent uncompacted, to measure the
+  Gemini latency against (default 0)
+
+The full result still goes to the frontend sidebar and to provenance and
+data-availability checks; only the text sent to Gemini is compacted, and only
+when it comes out shorter. Each compacted call logs ``MCP_RESULT_COMPACTED``.
+
+Each tool-loop Gemini call that carries observation results logs
+``MCP_FOLLOWUP_LATENCY`` (latency, prompt tokens, result chars sent), and
+``/api/stats`` averages them separately for compacted and uncompacted calls:
+the before/after of compaction on the call it is meant to speed up.
+"""
+
+import json
+import math
+import random
+import threading
+from typing import Any, Optional
+
+from src.config import load_config
+
+DEFAULT_TOOLS = ("get_observations",)
+SERIES_KEY = "time_series"
+TABLE_FORMAT = "table"
+# Rough chars-per-token ratio for JSON, for the logged token estimate
+CHARS_PER_TOKEN = 4
+
+
+def _settings() -> dict:
+    return load_config().get("mcp", {}).get("compaction", {})
+
+
+def compaction_enabled(name: str) -> bool:
+    """Whether results of tool ``name`` are compacted before reaching Gemini."""
+    settings = _settings()
+    return settings.get("enabled", True) and name in settings.get("tools", DEFAULT_TOOLS)
+
+
+def baseline_turn() -> bool:
+    """Whether this turn sends results uncompacted, as a latency baseline
+    (``baseline_rate`` of turns; never by default)."""
+    rate = _settings().get("baseline_rate", 0)
+    return rate > 0 and random.random() < rate
+
+
+def _flatten(record: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in record.items():
+        if key == SERIES_KEY and not prefix:
+            continue
+        if isinstance(value, dict) and value:
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _points(series: Any) -> list:
+    """``(date, value)`` pairs from ``[[date, value], ...]`` or
+    ``[{"date": ..., "value": ...}, ...]``."""
+    points = []
+    for point in series if isinstance(series, list) else []:
+        if isinstance(point, (list, tuple)) and len(point) == 2:
+            points.append((str(point[0]), point[1]))
+        elif isinstance(point, dict) and "date" in point:
+            points.append((str(point["date"]), point.get("value")))
+    return points
+
+
+def _cell(value: Any) -> Any:
+    # Whole floats print as ints ("14984" rather than "14984.0"); NaN is a gap
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer() and abs(value) < 2 ** 53:
+            return int(value)
+    return value
+
+
+def _grid(series_points: list, dates: list) -> list:
+    """Rows of values, one column per date."""
+    column = {date: i for i, date in enumerate(dates)}
+    rows = [[None] * len(dates) for _ in series_points]
+    for row, points in zip(rows, series_points):
+        for date, value in points:
+            row[column[date]] = _cell(value)
+    return rows
+
+
+def _table(records: list) -> dict:
+    flat = [_flatten(record) for record in records]
+    series_points = [_points(record.get(SERIES_KEY)) for record in records]
+    dates = sorted({date for points in series_points for date, _ in points})
+
+    keys = list(dict.fromkeys(key for attrs in flat for key in attrs))
+    common = {}
+    for key in keys:
+        first = flat[0].get(key)
+        if all(key in attrs and attrs[key] == first for attrs in flat):
+            common[key] = first
+    labels = [key for key in keys if key not in common]
+
+    values = _grid(series_points, dates)
+    return {
+        "format": TABLE_FORMAT,
+        "common": common,
+        "columns": labels + dates,
+        "rows": [[attrs.get(key) for key in labels] + row for attrs, row in zip(flat, values)],
+    }
+
+
+def _is_record_list(value: Any) -> bool:
+    return (isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+            and any(isinstance(v.get(SERIES_KEY), list) for v in value))
+
+
+def _compact(value: Any, counts: dict) -> Any:
+    if _is_record_list(value):
+        table = _table(value)
+        counts["tables"] += 1
+        counts["rows"] += len(table["rows"])
+        return table
+    if isinstance(value, dict):
+        if isinstance(value.get(SERIES_KEY), list):
+            # A lone record: a one-row table
+            return _compact([value], counts)
+        return {key: _compact(v, counts) for key, v in value.items()}
+    if isinstance(value, list):
+        return [_compact(v, counts) for v in value]
+    return value
+
+
+def compact_observations(payload: dict) -> tuple[Optional[dict], dict]:
+    """``(compacted payload, counts)``; the payload is None when it holds no
+    time series. ``payload`` itself is not modified."""
+    counts = {"tables": 0, "rows": 0}
+    compacted = _compact(payload, counts)
+    return (compacted if counts["tables"] else None), counts
+
+
+def compact_text(payload: dict, original_text: str) -> tuple[str, Optional[dict]]:
+    """The text to send Gemini for a parsed tool result and its compaction
+    metrics, or ``(original_text, None)`` when compaction does not shrink it."""
+    compacted, counts = compact_observations(payload)
+    if compacted is None:
+        return original_text, None
+    text = json.dumps(compacted, separators=(",", ":"), ensure_ascii=False)
+    if len(text) >= len(original_text):
+        return original_text, None
+    metrics = {
+        "original_chars": len(original_text),
+        "compact_chars": len(text),
+        "est_tokens_saved": (len(original_text) - len(text)) // CHARS_PER_TOKEN,
+        **counts,
+    }
+    return text, metrics
+
+
+class _LatencyBucket:
+    """Tool-loop Gemini calls carrying observation results, one kind."""
+
+    __slots__ = ("calls", "latency_ms", "token_calls", "input_tokens", "result_chars")
+
+    def __init__(self):
+        self.calls = 0
+        self.latency_ms = 0.0
+        self.token_calls = 0  # calls that reported usage
+        self.input_tokens = 0
+        self.result_chars = 0
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "avg_latency_ms": round(self.latency_ms / self.calls, 1) if self.calls else None,
+            "avg_input_tokens": round(self.input_tokens / self.token_calls) if self.token_calls else None,
+            "avg_result_chars": round(self.result_chars / self.calls) if self.calls else None,
+        }
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.original_chars = 0
+        self.compact_chars = 0
+        self.compaction_ms = 0.0
+        self.followups = {"compacted": _LatencyBucket(), "uncompacted": _LatencyBucket()}
+
+    def add(self, metrics: dict):
+        with self._lock:
+            self.calls += 1
+            self.original_chars += metrics["original_chars"]
+            self.compact_chars += metrics["compact_chars"]
+            self.compaction_ms += metrics["compaction_ms"]
+
+    def add_followup(self, compacted: bool, latency_ms: float, input_tokens: Optional[int], result_chars: int):
+        with self._lock:
+            bucket = self.followups["compacted" if compacted else "uncompacted"]
+            bucket.calls += 1
+            bucket.latency_ms += latency_ms
+            bucket.result_chars += result_chars
+            if input_tokens is not None:
+                bucket.token_calls += 1
+                bucket.input_tokens += input_tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "original_chars": self.original_chars,
+                "compact_chars": self.compact_chars,
+                "ratio": round(self.compact_chars / self.original_chars, 3) if self.original_chars else None,
+                "est_tokens_saved": (self.original_chars - self.compact_chars) // CHARS_PER_TOKEN,
+                "compaction_ms": round(self.compaction_ms, 1),
+                "gemini_followup": {kind: bucket.stats() for kind, bucket in self.followups.items()},
+            }
+
+
+_counters = _Counters()
+
+
+def record_compaction(metrics: dict) -> None:
+    _counters.add(metrics)
+
+
+def record_followup_latency(compacted: bool, latency_ms: float, input_tokens: Optional[int],
+                            result_chars: int) -> None:
+    """One tool-loop Gemini call that carried observation results."""
+    _counters.add_followup(compacted, latency_ms, input_tokens, result_chars)
+
+
+def get_compaction_stats() -> dict:
+    return _counters.stats()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process-wide cache of MCP tool results.
+
+The same ``search_indicators`` / ``get_observations`` calls (same variable,
+same place, ``date=latest``) come up again and again across users. ``call_tool``
+looks each call up here first, keyed by tool name plus the canonical JSON of
+its arguments (after ``fix_tool_arguments``, so equivalent spellings share an
+entry). Only successful results are stored.
+
+Settings under ``config["mcp"]["result_cache"]`` (read on first use):
+
+- ``enabled``: default true
+- ``ttl_seconds``: per-tool TTLs; tools not listed use ``default_ttl_seconds``
+  (default 0: not cached), so only known read-only tools are cached
+- ``max_bytes``: bound on the serialized results held in memory; least
+  recently used entries are evicted past it (default 32 MiB)
+- ``sqlite_path``: optional SQLite file used as a second tier, so results
+  survive restarts (rows expire with the same TTLs)
+"""
+
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from src.config import load_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 0
+DEFAULT_TOOL_TTLS = {
+    "search_indicators": 3600,
+    "get_observations": 900,
+}
+
+TIER_MEMORY = "memory"
+TIER_SQLITE = "sqlite"
+
+
+def cache_key(name: str, arguments: dict) -> str:
+    """Tool name plus canonical (sorted, compact) JSON of its arguments."""
+    return name + "\0" + json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def is_cacheable_result(result: Any) -> bool:
+    """True for a successful ``tools/call`` result."""
+    return isinstance(result, dict) and "error" not in result and not result.get("isError")
+
+
+class _SqliteTier:
+    """Write-through on-disk copy of the memory tier."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM tool_results WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, key: str) -> Optional[tuple[bytes, float]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM tool_results WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def put(self, key: str, value: bytes, expires_at: float) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tool_results (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+
+
+class ToolResultCache:
+    """Thread-safe LRU + TTL cache, bounded by serialized size.
+
+    Results are kept serialized, so callers always get their own copy.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttls: dict = None,
+        default_ttl: float = DEFAULT_TTL_SECONDS,
+        sqlite_path: Optional[str] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.ttls = DEFAULT_TOOL_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        # key -> (serialized result, expires_at), least recently used first
+        self._entries: collections.OrderedDict[str, tuple[bytes, float]] = collections.OrderedDict()
+        self._bytes = 0
+        self._counts = {"hits": 0, "sqlite_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._sqlite = None
+        if sqlite_path:
+            try:
+                self._sqlite = _SqliteTier(sqlite_path)
+            except sqlite3.Error as e:
+                logger.warning(f"Tool result cache: cannot open {sqlite_path} ({e}); memory only")
+
+    def ttl(self, name: str) -> float:
+        return self.ttls.get(name, self.default_ttl)
+
+    def get(self, name: str, arguments: dict) -> tuple[Any, Optional[str]]:
+        """``(result, tier)`` for a cached call, or ``(None, None)`` on a miss."""
+        if self.ttl(name) <= 0:
+            return None, None
+        key = cache_key(name, arguments)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counts["hits"] += 1
+                return json.loads(entry[0]), TIER_MEMORY
+
+        if self._sqlite is not None:
+            try:
+                row = self._sqlite.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Tool result cache: SQLite read failed: {e}")
+                row = None
+            if row is not None:
+                with self._lock:
+                    self._insert(key, *row)
+                    self._counts["sqlite_hits"] += 1
+                return json.loads(row[0]), TIER_SQLITE
+
+        with self._lock:
+            self._counts["misses"] += 1
+        return None, None
+
+    def put(self, name: str, arguments: dict, result: Any) -> None:
+        """Store a successful result under the tool's TTL."""
+        ttl = self.ttl(name)
+        if ttl <= 0 or not is_cacheable_result(result):
+            return
+        key = cache_key(name, arguments)
+        value = json.dumps(result, separators=(",", ":"), default=str).encode("utf-8")
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._insert(key, value, expires_at)
+            self._counts["stores"] += 1
+        if self._sqlite is not None:
+            try:
+                self._sqlite.put(key, value, expires_at)
+            except sqlite3.Error as e:
+                logger.warning(f"Tool result cache: SQLite write failed: {e}")
+
+    def _insert(self, key: str, value: bytes, expires_at: float) -> None:
+        # Caller holds self._lock
+        if len(value) > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (value, expires_at)
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._counts["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        # Caller holds self._lock
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["sqlite_hits"] + self._counts["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "sqlite": self._sqlite is not None,
+                "hit_rate": round((lookups - self._counts["misses"]) / lookups, 3) if lookups else None,
+                **self._counts,
+            }
+
+
+_cache: Optional[ToolResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ToolResultCache]:
+    """The process-wide cache, created from config on first use; None when disabled."""
+    global _cache
+    cache_config = load_config().get("mcp", {}).get("result_cache", {})
+    if not cache_config.get("enabled", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ToolResultCache(
+                    max_bytes=cache_config.get("max_bytes", DEFAULT_MAX_BYTES),
+                    ttls={**DEFAULT_TOOL_TTLS, **cache_config.get("ttl_seconds", {})},
+                    default_ttl=cache_config.get("default_ttl_seconds", DEFAULT_TTL_SECONDS),
+                    sqlite_path=cache_config.get("sqlite_path"),
+                )
+    return _cache
+
+
+def get_result_cache_stats() -> dict:
+    """Cache counters for diagnostics (empty before the first tool call)."""
+    return _cache.stats() if _cache is not None else {}
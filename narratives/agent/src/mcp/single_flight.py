@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Single-flight coalescing of identical in-flight MCP tool calls.
+
+When many users send the same suggested question at once, dozens of
+identical ``get_observations`` calls reach the MCP server together, before
+the first result can land in the result cache. With single-flight, the first
+caller for a canonical (tool, arguments) key makes the request and later
+callers with the same key wait for it and get a copy of its result.
+
+Settings under ``config["mcp"]["single_flight"]``:
+
+- ``enabled``: default true
+- ``tools``: tools to coalesce; only read-only tools belong here
+  (default ``search_indicators``, ``get_observations``)
+"""
+
+import copy
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from src.config import load_config
+from src.mcp.result_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOOLS = ("search_indicators", "get_observations")
+
+
+class _Flight:
+    """One upstream call that other callers can wait on."""
+
+    __slots__ = ("done", "result", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Thread-safe registry of in-flight calls by key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight] = {}
+        self._counts = {"leaders": 0, "coalesced": 0, "wait_timeouts": 0}
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> tuple[Any, Optional[float]]:
+        """Run ``fn`` unless a call with ``key`` is already in flight.
+
+        Returns ``(result, waited_ms)``: ``waited_ms`` is None for the caller
+        that ran ``fn``, and the time spent waiting for a coalesced one (which
+        gets its own copy of the result). A waiter gives up after ``timeout``
+        with an ``{"error": ...}`` result.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._counts["leaders"] += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self._counts["coalesced"] += 1
+                leader = False
+
+        if leader:
+            try:
+                flight.result = fn()
+            except Exception as e:
+                flight.result = {"error": str(e)}
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            return flight.result, None
+
+        start = time.time()
+        if not flight.done.wait(timeout):
+            with self._lock:
+                self._counts["wait_timeouts"] += 1
+            return {"error": "Timed out waiting for an identical in-flight tool call"}, (time.time() - start) * 1000
+        return copy.deepcopy(flight.result), (time.time() - start) * 1000
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._flights), **self._counts}
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight_stats() -> dict:
+    return _single_flight.stats()
+
+
+def coalesce(name: str, arguments: dict, fn: Callable[[], Any],
+             timeout: Optional[float] = None) -> tuple[Any, Optional[float]]:
+    """``SingleFlight.do`` for a tool call when single-flight applies to
+    ``name``; otherwise just ``(fn(), None)``."""
+    settings = load_config().get("mcp", {}).get("single_flight", {})
+    if not settings.get("enabled", True) or name not in settings.get("tools", DEFAULT_TOOLS):
+        return fn(), None
+    return _single_flight.do(cache_key(name, arguments), fn, timeout)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Speculative ``search_indicators`` prefetch for the MCP phase.
+
+The first tool-loop iteration usually spends seconds in Gemini thinking and
+then calls ``search_indicators`` with arguments close to the user's words.
+With ``config["mcp"]["speculative_search"]["enabled"]``, the MCP phase starts
+``search_indicators`` calls from a cheap local reading of the query as soon as
+the turn begins. They go through ``call_tool``, so their results land in the
+result cache and a matching call from Gemini either hits the cache or joins
+the prefetch still in flight (single-flight).
+
+A speculation "hits" when Gemini's own ``search_indicators`` call has the
+same canonical arguments. Each turn logs ``MCP_SPECULATION`` with what was
+prefetched and what matched; process-wide hit rates are in ``/api/stats``.
+"""
+
+import logging
+import re
+import threading
+from typing import Optional
+
+from src.deadline import Deadline
+from src.mcp.client import call_tool
+from src.mcp.result_cache import cache_key
+from src.mcp.schema import fix_tool_arguments
+from src.session_logger import SessionLogger
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TOOL = "search_indicators"
+DEFAULT_MAX_QUERIES = 2
+
+# Leading question / command words that never make it into the tool query
+_LEADING_WORDS = re.compile(
+    r"^(?:(?:please|can|could|you|what|which|how|show|tell|give|compare|list|find|plot|chart|"
+    r"display|is|are|was|were|does|do|did|me|us|the|many|much|about)\s+)+",
+    re.IGNORECASE,
+)
+# "<indicator> in|of|for|across [the] <Capitalized Place Name>". The query is
+# non-greedy, so the split is at the first connector whose whole tail is a
+# place phrase: "people live in the United States of America" splits before
+# "the United States", not inside the name at "of America".
+_TRAILING_PLACE = re.compile(
+    r"^(?P<query>.+?)\s+(?:in|of|for|across)\s+(?:the\s+)?"
+    r"(?P<place>[A-Z][\w.'-]*(?:,?\s+(?:[A-Z][\w.'-]*|of|and|the))*)$"
+)
+_PLACE_SEPARATOR = re.compile(r",\s*(?:and\s+)?|\s+and\s+")
+
+
+def speculative_search_args(message: str, max_queries: int = DEFAULT_MAX_QUERIES) -> list:
+    """Likely ``search_indicators`` arguments for a user message, best first.
+
+    e.g. "What is the population of India?" gives
+    ``{"query": "population", "places": ["India"]}`` then
+    ``{"query": "population of India"}``.
+    """
+    text = _LEADING_WORDS.sub("", " ".join(message.split())).strip(" ?.!")
+    if not text:
+        return []
+    candidates = []
+    place_match = _TRAILING_PLACE.match(text)
+    if place_match:
+        places = [p for p in _PLACE_SEPARATOR.split(place_match.group("place")) if p]
+        candidates.append({"query": place_match.group("query"), "places": places})
+    candidates.append({"query": text})
+    return candidates[:max_queries]
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.prefetched = 0
+        self.hits = 0
+
+    def add(self, prefetched: int, hits: int):
+        with self._lock:
+            self.turns += 1
+            self.prefetched += prefetched
+            self.hits += hits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "prefetched": self.prefetched,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.prefetched, 3) if self.prefetched else None,
+            }
+
+
+_counters = _Counters()
+
+
+def get_speculation_stats() -> dict:
+    return _counters.stats()
+
+
+class Speculation:
+    """The prefetches started for one turn."""
+
+    def __init__(self, args_list: list, deadline: Optional[Deadline] = None):
+        self.args_list = [fix_tool_arguments(SEARCH_TOOL, args) for args in args_list]
+        self._threads = [
+            threading.Thread(target=self._prefetch, args=(args, deadline), daemon=True)
+            for args in self.args_list
+        ]
+
+    def start(self) -> "Speculation":
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    @staticmethod
+    def _prefetch(args: dict, deadline: Optional[Deadline]):
+        try:
+            # No session logger: a prefetch is not one of the turn's tool calls
+            call_tool(SEARCH_TOOL, args, deadline=deadline)
+        except Exception as e:
+            logger.warning(f"Speculative {SEARCH_TOOL} failed: {e}")
+
+    def finish(self, tool_calls: list, session_logger: Optional[SessionLogger] = None) -> int:
+        """Count the prefetches Gemini's own calls matched; returns the hits."""
+        called = {
+            cache_key(SEARCH_TOOL, fix_tool_arguments(SEARCH_TOOL, tc.arguments))
+            for tc in tool_calls if tc.name == SEARCH_TOOL
+        }
+        matched = [args for args in self.args_list if cache_key(SEARCH_TOOL, args) in called]
+        _counters.add(len(self.args_list), len(matched))
+        if session_logger:
+            session_logger.log("MCP_SPECULATION", {
+                "prefetched": self.args_list,
+                "matched": matched,
+                "model_search_calls": len(called),
+            })
+        return len(matched)
+
+
+def start_speculation(user_message: str, config: dict,
+                      deadline: Optional[Deadline] = None) -> Optional[Speculation]:
+    """Start prefetching for a turn, or None when speculation is off."""
+    settings = config.get("mcp", {}).get("speculative_search", {})
+    if not settings.get("enabled", False):
+        return None
+    args_list = speculative_search_args(user_message, settings.get("max_queries", DEFAULT_MAX_QUERIES))
+    if not args_list:
+        return None
+    return Speculation(args_list, deadline).start()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The MCP tool catalog: tool list, Gemini declarations and /api/tools body.
+
+Everything derived from the MCP tool list is built once per catalog version:
+the Gemini function declarations (schemas run through
+``transform_schema_for_gemini``) and the ``/api/tools`` JSON body with its
+ETag. A version's contents are never modified; a refresh builds a new one
+and swaps it in, so a turn that took a version keeps using it unchanged.
+
+The catalog is refreshed when it is older than
+``config["mcp"]["tool_catalog"]["ttl_seconds"]`` (default 300) or after the
+server sends ``notifications/tools/list_changed``. Only one caller refreshes;
+the others keep using the current version meanwhile. A failed refresh keeps
+the current version.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+from src.config import load_config
+from src.mcp.client import get_mcp_client
+from src.mcp.schema import transform_schema_for_gemini
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 300
+LIST_CHANGED_NOTIFICATION = "notifications/tools/list_changed"
+
+
+def gemini_declarations(tools: list) -> list:
+    """Convert MCP tools to Gemini function declarations (transform schema to
+    remove unsupported constructs)."""
+    return [{
+        "name": t.get("name", ""),
+        "description": t.get("description", ""),
+        "parameters": transform_schema_for_gemini(
+            t.get("inputSchema", {"type": "object", "properties": {}})
+        )
+    } for t in tools]
+
+
+class CatalogVersion:
+    """One snapshot of the tool list and what is derived from it (only
+    ``checked_at`` changes, when a refresh finds the same tools)."""
+
+    __slots__ = ("number", "tools", "declarations", "api_body", "etag", "checked_at")
+
+    def __init__(self, number: int, tools: list):
+        self.number = number
+        self.tools = tools
+        self.declarations = gemini_declarations(tools)
+        self.api_body = json.dumps(
+            {"success": True, "tools": self.declarations, "raw_tools": tools}
+        ).encode("utf-8")
+        # Unquoted entity tag; the route quotes it
+        self.etag = hashlib.sha256(self.api_body).hexdigest()[:16]
+        self.checked_at = time.time()
+
+
+class ToolCatalog:
+    """Lazily loaded, periodically refreshed tool catalog."""
+
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._version: Optional[CatalogVersion] = None
+        self._stale = False
+        self._refresh_lock = threading.Lock()
+        self._counts = {"refreshes": 0, "refresh_failures": 0, "list_changed": 0}
+
+    def current(self) -> Optional[CatalogVersion]:
+        """The catalog version to use, refreshing it when due; None if the
+        tools were never loaded."""
+        version = self._version
+        if version is not None and not self._stale and time.time() - version.checked_at < self.ttl_seconds:
+            return version
+        if version is None:
+            # Nothing to serve yet: wait for whoever is loading
+            with self._refresh_lock:
+                if self._version is None:
+                    self._refresh()
+                return self._version
+        if self._refresh_lock.acquire(blocking=False):
+            try:
+                self._refresh()
+            finally:
+                self._refresh_lock.release()
+        return self._version
+
+    def _refresh(self) -> None:
+        # Caller holds self._refresh_lock
+        self._stale = False
+        tools = get_mcp_client().list_tools()
+        if not tools:
+            self._counts["refresh_failures"] += 1
+            if self._version is not None:
+                logger.warning("Tool list refresh failed; keeping the current catalog")
+            return
+        current = self._version
+        if current is not None and tools == current.tools:
+            current.checked_at = time.time()
+            return
+        self._counts["refreshes"] += 1
+        self._version = CatalogVersion(current.number + 1 if current else 1, tools)
+        logger.info(f"Tool catalog v{self._version.number}: {len(tools)} tools")
+
+    def invalidate(self) -> None:
+        """Refresh on next use (the current version stays in use until then)."""
+        self._stale = True
+
+    def on_notification(self, method: str, params: dict) -> None:
+        if method == LIST_CHANGED_NOTIFICATION:
+            self._counts["list_changed"] += 1
+            self.invalidate()
+
+    def stats(self) -> dict:
+        version = self._version
+        return {
+            "version": version.number if version else None,
+            "tool_count": len(version.tools) if version else 0,
+            "etag": version.etag if version else None,
+            "age_s": round(time.time() - version.checked_at, 1) if version else None,
+            "ttl_seconds": self.ttl_seconds,
+            **self._counts,
+        }
+
+
+_catalog: Optional[ToolCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_tool_catalog() -> ToolCatalog:
+    """Return the process-wide catalog, created from config on first use."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                catalog_config = load_config().get("mcp", {}).get("tool_catalog", {})
+                _catalog = ToolCatalog(catalog_config.get("ttl_seconds", DEFAULT_TTL_SECONDS))
+                get_mcp_client().add_notification_listener(_catalog.on_notification)
+    return _catalog
+
+
+def get_tool_catalog_stats() -> dict:
+    return _catalog.stats() if _catalog is not None else {}
+
+
+def get_tools() -> list:
+    """Get available tools from MCP server."""
+    version = get_tool_catalog().current()
+    return version.tools if version else []
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Concurrent execution of the functionCalls from one Gemini turn.
+
+Gemini often asks for several tools at once (``get_observations`` for three
+to five places or variables). ``run_tool_calls`` runs them on a process-wide
+bounded executor, so an iteration takes as long as its slowest call rather
+than the sum, and hands the results back in the order of the calls.
+
+Tunables under ``config["mcp"]["parallel_tools"]`` (read on first use):
+
+- ``enabled``: set false to run calls one after another (default true)
+- ``max_workers``: executor threads shared by every chat (default 8)
+- ``per_tool_limit``: max concurrent calls of any one tool, process-wide
+  (default 4); ``per_tool_limits`` overrides it by tool name. Calls over
+  the cap wait for their tool, outside the executor
+- ``call_timeout_seconds``: a call still running this long after it
+  started (or past the turn deadline) is answered with an error (default 60)
+- ``start_during_stream``: start each call as soon as its ``functionCall``
+  part is parsed from the Gemini stream, rather than once the stream ends
+  (``StreamedToolCalls``; default true)
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+from src.config import load_config
+from src.deadline import Deadline
+from src.mcp.client import call_tool
+from src.mcp.result_cache import cache_key
+from src.session_logger import SessionLogger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PER_TOOL_LIMIT = 4
+DEFAULT_CALL_TIMEOUT_SECONDS = 60
+
+
+class _ToolCall:
+    """One submitted call: waits in its tool's lane until a slot is free."""
+
+    __slots__ = ("name", "arguments", "session_logger", "deadline", "future", "started", "started_at")
+
+    def __init__(self, name: str, arguments: dict, session_logger: Optional[SessionLogger],
+                 deadline: Optional[Deadline]):
+        self.name = name
+        self.arguments = arguments
+        self.session_logger = session_logger
+        self.deadline = deadline
+        self.future = Future()
+        self.started = threading.Event()
+        self.started_at = None
+
+
+class _Lane:
+    """Running count and waiting calls of one tool."""
+
+    __slots__ = ("limit", "running", "waiting")
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.running = 0
+        self.waiting = collections.deque()
+
+
+class ToolExecutor:
+    """Bounded thread pool plus per-tool concurrency caps.
+
+    The per-tool cap is applied before a call reaches the pool: a call over
+    its tool's cap waits in that tool's lane, not on a pool thread, so one
+    busy tool never holds threads other tools (and chats) need. Each call's
+    timeout counts from when it starts running.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        per_tool_limit: int = DEFAULT_PER_TOOL_LIMIT,
+        per_tool_limits: dict = None,
+        call_timeout: float = DEFAULT_CALL_TIMEOUT_SECONDS,
+    ):
+        self.max_workers = max_workers
+        self.per_tool_limit = per_tool_limit
+        self.per_tool_limits = per_tool_limits or {}
+        self.call_timeout = call_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mcp-tool")
+        self._lock = threading.Lock()
+        self._lanes: dict[str, _Lane] = {}
+        self._counts = {"batches": 0, "calls": 0, "parallel_calls": 0, "queued_for_tool_limit": 0,
+                        "timeouts": 0, "not_started": 0,
+                        "started_during_stream": 0, "reused_after_stream_retry": 0,
+                        "cancelled_stream_starts": 0, "unused_stream_starts": 0}
+
+    def _lane(self, name: str) -> _Lane:
+        # Callers hold self._lock
+        lane = self._lanes.get(name)
+        if lane is None:
+            lane = self._lanes[name] = _Lane(self.per_tool_limits.get(name, self.per_tool_limit))
+        return lane
+
+    def _run(self, call: _ToolCall) -> None:
+        try:
+            if not call.future.set_running_or_notify_cancel():
+                return
+            call.started_at = time.time()
+            call.started.set()
+            logger.info(f"Executing MCP tool: {call.name}")
+            try:
+                result = call_tool(call.name, call.arguments, session_logger=call.session_logger,
+                                   deadline=call.deadline)
+            except Exception as e:
+                call.future.set_exception(e)
+            else:
+                call.future.set_result(result)
+        finally:
+            self._finished(call.name)
+
+    def _finished(self, name: str) -> None:
+        """Free ``name``'s slot and hand it to the next waiting call."""
+        with self._lock:
+            lane = self._lanes[name]
+            lane.running -= 1
+            while lane.waiting:
+                call = lane.waiting.popleft()
+                if not call.future.cancelled():
+                    lane.running += 1
+                    break
+            else:
+                return
+        self._executor.submit(self._run, call)
+
+    def submit(self, function_call: dict, session_logger: Optional[SessionLogger] = None,
+               deadline: Optional[Deadline] = None) -> _ToolCall:
+        """Start one Gemini ``functionCall`` now, or as soon as its tool is
+        under its concurrency cap."""
+        call = _ToolCall(function_call.get("name", ""), function_call.get("args", {}), session_logger, deadline)
+        with self._lock:
+            lane = self._lane(call.name)
+            if lane.running >= lane.limit:
+                lane.waiting.append(call)
+                self._counts["queued_for_tool_limit"] += 1
+                return call
+            lane.running += 1
+        self._executor.submit(self._run, call)
+        return call
+
+    def cancel(self, call: _ToolCall) -> bool:
+        """Drop a call that has not started yet; False if it already has."""
+        return call.future.cancel()
+
+    def collect(self, function_calls: list, calls: list, session_logger: Optional[SessionLogger] = None,
+                deadline: Optional[Deadline] = None) -> list:
+        """Wait for the ``submit``-ted calls and return their results in order.
+
+        A call that does not finish within the call timeout of its own start
+        (or by the turn deadline) gets an ``{"error": ...}`` result; its
+        thread finishes in the background and its late result is dropped. A
+        call still waiting for a slot at the turn deadline is dropped unrun.
+        """
+        with self._lock:
+            self._counts["batches"] += 1
+            self._counts["calls"] += len(function_calls)
+            if len(function_calls) > 1:
+                self._counts["parallel_calls"] += len(function_calls)
+
+        results = []
+        for fc, call in zip(function_calls, calls):
+            limit = None if deadline is None else time.time() + max(deadline.spendable(), 0.0)
+            if not call.started.wait(timeout=None if limit is None else max(limit - time.time(), 0.0)):
+                if self.cancel(call):
+                    results.append(self._not_started(call.name, session_logger))
+                    continue
+                call.started.wait()  # started just now
+            timeout = call.started_at + self.call_timeout
+            if limit is not None:
+                timeout = min(timeout, limit)
+            try:
+                results.append(call.future.result(timeout=max(timeout - time.time(), 0.0)))
+            except FutureTimeoutError:
+                results.append(self._timed_out(fc.get("name", ""), time.time() - call.started_at, session_logger))
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
+
+    def run(self, function_calls: list, session_logger: Optional[SessionLogger] = None,
+            deadline: Optional[Deadline] = None) -> list:
+        """Run ``function_calls`` (Gemini ``functionCall`` dicts) concurrently;
+        one ``call_tool`` result per call, in the same order."""
+        calls = [self.submit(fc, session_logger, deadline) for fc in function_calls]
+        return self.collect(function_calls, calls, session_logger, deadline)
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Add ``n`` to the ``name`` counter reported in ``stats``."""
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + n
+
+    def _timed_out(self, name: str, elapsed: float, session_logger: Optional[SessionLogger]) -> dict:
+        with self._lock:
+            self._counts["timeouts"] += 1
+        logger.warning(f"MCP tool {name} still running after {elapsed:.1f}s; answering with a timeout")
+        if session_logger:
+            session_logger.log("MCP_TOOL_TIMEOUT", {"tool_name": name, "elapsed_ms": round(elapsed * 1000, 1)})
+        return {"error": f"Tool call timed out after {elapsed:.1f}s"}
+
+    def _not_started(self, name: str, session_logger: Optional[SessionLogger]) -> dict:
+        with self._lock:
+            self._counts["not_started"] += 1
+        logger.warning(f"MCP tool {name} still waiting for a slot at the turn deadline; dropped")
+        if session_logger:
+            session_logger.log("MCP_TOOL_TIMEOUT", {"tool_name": name, "elapsed_ms": 0, "not_started": True})
+        return {"error": "Tool call not started before the turn deadline"}
+
+    def stats(self) -> dict:
+        with self._lock:
+            waiting = {name: len(lane.waiting) for name, lane in self._lanes.items() if lane.waiting}
+            return {"max_workers": self.max_workers, "per_tool_limit": self.per_tool_limit,
+                    "waiting_for_tool_limit": waiting, **self._counts}
+
+
+_executor: Optional[ToolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ToolExecutor:
+    """Return the process-wide executor, created from config on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                parallel_config = load_config().get("mcp", {}).get("parallel_tools", {})
+                _executor = ToolExecutor(
+                    max_workers=parallel_config.get("max_workers", DEFAULT_MAX_WORKERS),
+                    per_tool_limit=parallel_config.get("per_tool_limit", DEFAULT_PER_TOOL_LIMIT),
+                    per_tool_limits=parallel_config.get("per_tool_limits", {}),
+                    call_timeout=parallel_config.get("call_timeout_seconds", DEFAULT_CALL_TIMEOUT_SECONDS),
+                )
+    return _executor
+
+
+def get_tool_executor_stats() -> dict:
+    """Executor counters for diagnostics (empty before the first tool call)."""
+    return _executor.stats() if _executor is not None else {}
+
+
+def _settings() -> dict:
+    return load_config().get("mcp", {}).get("parallel_tools", {})
+
+
+def run_tool_calls(function_calls: list, session_logger: Optional[SessionLogger] = None,
+                   deadline: Optional[Deadline] = None) -> list:
+    """Results of ``function_calls`` in call order; concurrent unless
+    ``mcp.parallel_tools.enabled`` is false."""
+    if not _settings().get("enabled", True):
+        results = []
+        for fc in function_calls:
+            logger.info(f"Executing MCP tool: {fc.get('name', '')}")
+            results.append(call_tool(fc.get("name", ""), fc.get("args", {}),
+                                     session_logger=session_logger, deadline=deadline))
+        return results
+    return get_tool_executor().run(function_calls, session_logger, deadline)
+
+
+class StreamedToolCalls:
+    """Tool calls started while the Gemini stream is still arriving.
+
+    Pass ``on_function_call`` as the ``function_call_callback`` of
+    ``gemini_request_with_thought_streaming``: each complete ``functionCall``
+    part is started as soon as it is parsed, overlapping tool latency with the
+    rest of the model's output. ``results`` then matches the final response's
+    calls to those already started (by tool name and canonical arguments),
+    starts any that were not, and returns the results in call order.
+
+    When a stream breaks and is sent again, the calls its parts started that
+    are still waiting to run are cancelled; running ones are kept aside, and
+    the same call from the new stream reuses them rather than starting a
+    duplicate. Starts the final response does not contain are cancelled if
+    they have not started (``results`` or ``abandon``); one already running
+    finishes unused.
+    """
+
+    def __init__(self, session_logger: Optional[SessionLogger] = None, deadline: Optional[Deadline] = None):
+        self.session_logger = session_logger
+        self.deadline = deadline
+        self._executor = get_tool_executor()
+        self._lock = threading.Lock()
+        self._stream_attempt = 0
+        # cache_key -> calls started by the current stream / by broken ones
+        self._started: dict[str, collections.deque] = {}
+        self._abandoned: dict[str, collections.deque] = {}
+
+    def on_function_call(self, part: dict, stream_attempt: int = 0) -> None:
+        function_call = part.get("functionCall", {})
+        key = cache_key(function_call.get("name", ""), function_call.get("args", {}))
+        with self._lock:
+            if stream_attempt != self._stream_attempt:
+                # The stream was sent again: drop its starts still waiting to
+                # run; running ones may be reused by the new stream
+                for started_key, calls in self._started.items():
+                    running = [call for call in calls if not self._executor.cancel(call)]
+                    self._executor.count("cancelled_stream_starts", len(calls) - len(running))
+                    self._abandoned.setdefault(started_key, collections.deque()).extend(running)
+                self._started = {}
+                self._stream_attempt = stream_attempt
+            reusable = self._abandoned.get(key)
+            call = reusable.popleft() if reusable else None
+        if call is None:
+            call = self._executor.submit(function_call, self.session_logger, self.deadline)
+            self._executor.count("started_during_stream")
+        else:
+            self._executor.count("reused_after_stream_retry")
+        with self._lock:
+            self._started.setdefault(key, collections.deque()).append(call)
+
+    def _take_all(self) -> list:
+        # Callers hold self._lock
+        calls = [call for started in (self._started, self._abandoned)
+                 for queue in started.values() for call in queue]
+        self._started = {}
+        self._abandoned = {}
+        return calls
+
+    def _drop(self, calls: list) -> None:
+        cancelled = sum(1 for call in calls if self._executor.cancel(call))
+        if cancelled:
+            self._executor.count("cancelled_stream_starts", cancelled)
+        if len(calls) > cancelled:
+            self._executor.count("unused_stream_starts", len(calls) - cancelled)
+        if calls:
+            logger.info(f"{len(calls)} tool call(s) started during the stream were not in the final response "
+                        f"({cancelled} cancelled before running)")
+
+    def results(self, function_calls: list) -> list:
+        started = []
+        with self._lock:
+            for fc in function_calls:
+                queue = self._started.get(cache_key(fc.get("name", ""), fc.get("args", {})))
+                started.append(queue.popleft() if queue else None)
+            unused = self._take_all()
+        started = [call if call is not None else self._executor.submit(fc, self.session_logger, self.deadline)
+                   for fc, call in zip(function_calls, started)]
+        self._drop(unused)
+        return self._executor.collect(function_calls, started, self.session_logger, self.deadline)
+
+    def abandon(self) -> None:
+        """Drop every start: the response has no tool calls to collect."""
+        with self._lock:
+            unused = self._take_all()
+        self._drop(unused)
+
+
+def streamed_tool_calls(session_logger: Optional[SessionLogger] = None,
+                        deadline: Optional[Deadline] = None) -> Optional[StreamedToolCalls]:
+    """A ``StreamedToolCalls`` for one tool-loop iteration, or None when
+    calls should wait for the end of the stream (``run_tool_calls``)."""
+    settings = _settings()
+    if not settings.get("enabled", True) or not settings.get("start_during_stream", True):
+        return None
+    return StreamedToolCalls(session_logger, deadline)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""One MCP tool call's result, analyzed once.
+
+The tool loop builds a ``ToolResult`` for each call as its result arrives:
+the text sent back to Gemini, the parsed JSON payload, the provenance source
+and the emptiness flags are all worked out here, once. The rest of the turn
+(the data-availability check, provenance for the sidebar and for synthesis,
+the tool-call events) reads these fields instead of re-parsing and re-scanning
+the result text.
+
+``model_text`` is what Gemini sees (in the ``functionResponse`` and in
+``mcp_results``): the compacted form (``src.mcp.compaction``) when it applies,
+else ``text``.
+"""
+
+import json
+import re
+import time
+from typing import Any, Optional
+
+from src.mcp.compaction import compact_text, record_compaction
+
+SEARCH_TOOL = "search_indicators"
+OBSERVATIONS_TOOL = "get_observations"
+
+# "time_series": [["2024", 14984.0]] has data; "time_series": [] does not
+_TIME_SERIES_WITH_DATA = re.compile(r'"time_series":\s*\[\s*\[')
+_NO_VARIABLES_MARKERS = ('no indicators found', '"variables": []', 'no matching', 'could not find')
+_EMPTY_OBSERVATIONS_MARKERS = ('no data', '"observations": []', '"time_series": []', '"time_series":[]',
+                               'no observations')
+
+
+def result_text(result: Any) -> str:
+    """The text form of a tool result, as sent back to Gemini."""
+    if isinstance(result, dict):
+        if "content" in result and isinstance(result["content"], list):
+            return "\n".join([c.get("text", json.dumps(c)) for c in result["content"]])
+        return json.dumps(result)
+    return str(result)
+
+
+def _parse_payload(text: str) -> Optional[dict]:
+    # Tool text content is usually a JSON document; older servers wrapped it
+    # in another {"content": [{"text": ...}]} layer
+    try:
+        payload = json.loads(text)
+        if isinstance(payload, dict) and payload.get("content"):
+            payload = json.loads(payload["content"][0].get("text", "{}"))
+    except (json.JSONDecodeError, KeyError, TypeError, IndexError, AttributeError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+class ToolResult:
+    """A tool call (name, model arguments) and its analyzed result."""
+
+    __slots__ = ("name", "arguments", "text", "model_text", "compaction", "payload", "status",
+                 "provenance", "no_variables", "has_observations", "empty_observations")
+
+    def __init__(self, name: str, arguments: dict, result: Any, compact: bool = False):
+        self.name = name
+        self.arguments = arguments
+        self.text = result_text(result)
+        text_lower = self.text.lower()
+        self.status = "error" if "error" in text_lower else "success"
+
+        # Only get_observations (provenance) and compacted payloads are needed
+        self.payload = _parse_payload(self.text) if name == OBSERVATIONS_TOOL or compact else None
+        self.provenance = None
+        if self.payload is not None:
+            metadata = self.payload.get("source_metadata")
+            if isinstance(metadata, dict) and metadata.get("provenance_url"):
+                self.provenance = {
+                    "name": metadata.get("import_name") or "Data Source",
+                    "url": metadata["provenance_url"],
+                }
+
+        self.no_variables = name == SEARCH_TOOL and (
+            any(marker in text_lower for marker in _NO_VARIABLES_MARKERS)
+            or ('"indicators":' in text_lower and '[]' in text_lower)
+        )
+        self.has_observations = (name == OBSERVATIONS_TOOL
+                                 and _TIME_SERIES_WITH_DATA.search(self.text) is not None)
+        self.empty_observations = name == OBSERVATIONS_TOOL and any(
+            marker in text_lower for marker in _EMPTY_OBSERVATIONS_MARKERS
+        )
+
+        # Metrics dict when the text for Gemini was compacted, else None
+        self.model_text = self.text
+        self.compaction = None
+        if compact and self.payload is not None:
+            start = time.perf_counter()
+            self.model_text, self.compaction = compact_text(self.payload, self.text)
+            if self.compaction is not None:
+                self.compaction["compaction_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                record_compaction(self.compaction)
+
+    def to_event(self) -> dict:
+        """The ``tool_call`` event sent to the frontend sidebar."""
+        return {
+            "type": "tool_call",
+            "name": self.name,
+            "arguments": self.arguments,
+            "result": self.text,  # No truncation - full result for source extraction
+            "status": self.status,
+        }
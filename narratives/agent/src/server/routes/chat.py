@@ -19,14 +19,10 @@ import time
 
 from flask import Blueprint, jsonify, request, Response, stream_with_context
 
-from src.config import get_query_param_key
+from src.config import get_query_param_key, load_config
+from src.deadline import Deadline
 from src.session_logger import SessionLogger
-from src.workflows.chat_pipeline import (
-    run_followups,
-    run_kb_phase,
-    run_mcp_phase,
-    run_synthesis_phase,
-)
+from src.workflows.chat_pipeline import run_chat_pipeline
 
 logger = logging.getLogger(__name__)
 
@@ -106,9 +102,8 @@ def chat_stream():
         chart_result_holder = {'config': {"should_render": False}}
         chart_thread = [None]  # Use list to avoid nonlocal issues
 
-        # Shared mutable context threaded through the phase generators so the
-        # threading/queue behavior and cross-phase state match the original
-        # inline generator exactly.
+        # Shared mutable context threaded through the phase generators; the
+        # phase graph runs MCP and KB concurrently and keeps event order.
         ctx = {
             'user_message': user_message,
             'history': history,
@@ -116,16 +111,17 @@ def chat_stream():
             'query_params': query_params,
             'demo_mode': demo_mode,
             'request_start_time': request_start_time,
+            # One latency budget for the whole turn, respected by every phase
+            'deadline': Deadline.from_config(load_config(), start=request_start_time),
             'full_text': full_text,
             'chart_result_holder': chart_result_holder,
             'chart_thread': chart_thread,
             'effective_config': None,
             'mcp_results': "",
             'tool_calls_list': [],
+            'mcp_sources': [],
             'kb_response': "",
             'kb_sources': [],
-            'thought_queue': None,
-            'thought_callback': None,
             'chart_config': None,
             'aborted': False,
         }
@@ -133,10 +129,7 @@ def chat_stream():
         # Send session ID first so frontend can display it
         yield f"data: {json.dumps({'session_id': session_logger.session_id})}\n\n"
 
-        yield from run_mcp_phase(ctx)
-        yield from run_kb_phase(ctx)
-        yield from run_synthesis_phase(ctx)
-        yield from run_followups(ctx)
+        yield from run_chat_pipeline(ctx)
 
     return Response(
         stream_with_context(generate()),
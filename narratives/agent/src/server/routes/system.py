@@ -16,8 +16,20 @@
 from flask import Blueprint, jsonify
 
 from src.config import load_config
-from src.mcp.client import MCP_PORT, MCP_URL
+from src.gemini.context_cache import get_context_cache_stats
+from src.gemini.http_pool import get_pool_stats
+from src.gemini.key_scheduler import get_key_stats
+from src.gemini.model_ladder import get_model_stats
+from src.mcp.client import MCP_PORT, MCP_URL, get_mcp_stats
+from src.mcp.compaction import get_compaction_stats
+from src.mcp.result_cache import get_result_cache_stats
+from src.mcp.single_flight import get_single_flight_stats
+from src.mcp.speculation import get_speculation_stats
+from src.mcp.tool_catalog import get_tool_catalog_stats
+from src.mcp.tool_executor import get_tool_executor_stats
 from src.server.app import PROXY_PORT
+from src.workflows.chart_planner import get_chart_planner_stats
+from src.workflows.data_presence import get_chart_validation_stats
 
 system_bp = Blueprint("system", __name__)
 
@@ -30,6 +42,33 @@ def health():
     return jsonify({"status": "ok", "mcp_url": MCP_URL})
 
 
+@system_bp.route("/api/stats", methods=["GET"])
+def stats():
+    """Runtime stats for the shared Gemini connection pool, API key health,
+    model health (fallback ladder), the explicit context cache, the MCP
+    session pool, the parallel tool executor, the tool result cache,
+    single-flight coalescing, speculative search prefetch, the tool
+    catalog, tool result compaction, the rule-based chart planner and
+    local chart validation.
+
+    Keys are reported by fingerprint only, never by value."""
+    return jsonify({
+        "gemini_pool": get_pool_stats(),
+        "gemini_keys": get_key_stats(),
+        "gemini_models": get_model_stats(),
+        "gemini_context_cache": get_context_cache_stats(),
+        "mcp_sessions": get_mcp_stats(),
+        "mcp_tool_executor": get_tool_executor_stats(),
+        "mcp_result_cache": get_result_cache_stats(),
+        "mcp_single_flight": get_single_flight_stats(),
+        "mcp_speculation": get_speculation_stats(),
+        "mcp_tool_catalog": get_tool_catalog_stats(),
+        "mcp_compaction": get_compaction_stats(),
+        "chart_planner": get_chart_planner_stats(),
+        "chart_validation": get_chart_validation_stats(),
+    })
+
+
 @system_bp.route("/", methods=["GET"])
 def index():
     return f"""
@@ -44,6 +83,7 @@ def index():
         <li><a href="/api/tools">/api/tools</a> - List tools</li>
         <li>POST /api/call - Execute tool</li>
         <li><a href="/api/config">/api/config</a> - Get backend config (no API key)</li>
+        <li><a href="/api/stats">/api/stats</a> - Connection pool and API key health stats</li>
         <li>POST /api/chat/stream - Full chat with streaming</li>
         <li><a href="/logs?key=">/logs</a> - Query Analytics Dashboard (requires ?key=SECRET)</li>
     </ul>
@@ -15,11 +15,10 @@
 
 import logging
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 
-import src.mcp.client as mcp_client
-from src.mcp.client import call_tool, get_tools, initialize_mcp
-from src.mcp.schema import transform_schema_for_gemini
+from src.mcp.client import call_tool, get_mcp_client, initialize_mcp
+from src.mcp.tool_catalog import get_tool_catalog
 
 logger = logging.getLogger(__name__)
 
@@ -29,30 +28,27 @@ tools_bp = Blueprint("tools", __name__)
 @tools_bp.route("/api/tools", methods=["GET"])
 def list_tools():
     """List available tools."""
-    if not mcp_client.session_id:
+    if not get_mcp_client().ready:
         if not initialize_mcp():
             return jsonify({"success": False, "error": "Cannot connect to MCP server. Make sure it's running on port 3000!"}), 503
 
-    tools = get_tools()
-    if not tools:
+    catalog = get_tool_catalog().current()
+    if catalog is None or not catalog.tools:
         return jsonify({"success": False, "error": "No tools available"}), 503
 
-    # Convert to Gemini format (transform schema to remove unsupported constructs)
-    gemini_tools = [{
-        "name": t.get("name", ""),
-        "description": t.get("description", ""),
-        "parameters": transform_schema_for_gemini(
-            t.get("inputSchema", {"type": "object", "properties": {}})
-        )
-    } for t in tools]
-
-    return jsonify({"success": True, "tools": gemini_tools, "raw_tools": tools})
+    # Body (Gemini-format declarations plus raw tools) is prebuilt per catalog version
+    if request.if_none_match.contains(catalog.etag):
+        response = Response(status=304)
+    else:
+        response = Response(catalog.api_body, mimetype="application/json")
+    response.set_etag(catalog.etag)
+    return response
 
 
 @tools_bp.route("/api/call", methods=["POST"])
 def tool_call():
     """Execute a tool call."""
-    if not mcp_client.session_id:
+    if not get_mcp_client().ready:
         if not initialize_mcp():
             return jsonify({"success": False, "error": "Cannot connect to MCP server"}), 503
 
@@ -51,8 +51,12 @@ class SessionLogger:
         # gated behind ?debug=tokens on the client. `output` includes thinking
         # tokens (thoughtsTokenCount) since Gemini bills those as output.
         # Guarded by a lock because MCP/KB/chart calls run in parallel threads.
-        self.token_usage = {"input": 0, "output": 0, "total": 0}
+        # `hedge_input` is the part of `input` spent on cancelled hedge
+        # duplicates (see src/gemini/hedging.py).
+        self.token_usage = {"input": 0, "output": 0, "total": 0, "hedge_input": 0, "cached_input": 0}
         self._usage_lock = threading.Lock()
+        # Phases and parallel tool calls log from several threads
+        self._write_lock = threading.Lock()
         self._write_header()
 
     def add_usage(self, usage_metadata: Optional[dict]) -> None:
@@ -68,12 +72,30 @@ class SessionLogger:
         candidates = usage_metadata.get("candidatesTokenCount", 0) or 0
         thoughts = usage_metadata.get("thoughtsTokenCount", 0) or 0
         total = usage_metadata.get("totalTokenCount", 0) or 0
+        # Part of promptTokenCount served from Gemini's context cache
+        cached = usage_metadata.get("cachedContentTokenCount", 0) or 0
         with self._usage_lock:
             self.token_usage["input"] += prompt
+            self.token_usage["cached_input"] += cached
             self.token_usage["output"] += candidates + thoughts
             # Fall back to input+output when the API omits a total.
             self.token_usage["total"] += total or (prompt + candidates + thoughts)
 
+    def add_hedge_usage(self, usage_metadata: Optional[dict], duplicates: int = 1) -> None:
+        """Account for hedge duplicates that were sent and then cancelled.
+
+        Each one was billed for the same prompt as the winning call, so the
+        winner's promptTokenCount is added once per duplicate. Their partial
+        output is never reported by the API and is not counted.
+        """
+        if not usage_metadata or duplicates <= 0:
+            return
+        prompt = (usage_metadata.get("promptTokenCount", 0) or 0) * duplicates
+        with self._usage_lock:
+            self.token_usage["input"] += prompt
+            self.token_usage["total"] += prompt
+            self.token_usage["hedge_input"] += prompt
+
     def _generate_session_id(self) -> str:
         """Generate a short readable session ID.
 
@@ -107,13 +129,13 @@ class SessionLogger:
             "event_type": event_type,
             "data": data
         }
-        self.entries.append(entry)
+        text = f"\n--- {event_type} @ {timestamp} ---\n{json.dumps(data, indent=2, default=str)}\n"
 
         # Write to file immediately
-        with open(self.log_file, 'a') as f:
-            f.write(f"\n--- {event_type} @ {timestamp} ---\n")
-            f.write(json.dumps(data, indent=2, default=str))
-            f.write("\n")
+        with self._write_lock:
+            self.entries.append(entry)
+            with open(self.log_file, 'a') as f:
+                f.write(text)
 
     def log_user_message(self, message: str, history_count: int = 0):
         """Log the user's input message."""
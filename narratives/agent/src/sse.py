@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental Server-Sent Events decoding for Gemini, KB and MCP streams.
+
+``SSEDecoder`` works on raw response bytes as they arrive (no per-line
+``decode('utf-8')``) and follows the SSE framing rules: CRLF / LF / CR line
+endings, ``data:`` with or without the space, multi-line ``data:`` fields
+joined with ``\\n``, comments and other fields ignored, and an event
+dispatched on the blank line that ends it.
+
+On top of it:
+
+- ``iter_sse_json`` / ``aiter_sse_json`` yield each event's JSON payload
+  (events that are not valid JSON are skipped, as before).
+- ``iter_gemini_events`` / ``aiter_gemini_events`` flatten Gemini
+  ``streamGenerateContent`` payloads into ``(kind, value)`` tuples:
+
+  ========================  =========================================
+  ``EVENT_THOUGHT``         thought summary text (str)
+  ``EVENT_TEXT``            answer text (str)
+  ``EVENT_FUNCTION_CALL``   the whole part dict holding ``functionCall``
+  ``EVENT_GROUNDING``       the candidate's ``groundingMetadata`` dict
+  ``EVENT_USAGE``           the payload's ``usageMetadata`` dict
+  ========================  =========================================
+
+JSON is parsed with orjson when it is installed, else the stdlib.
+``benchmarks/bench_sse.py`` compares this against the old line-based loop.
+"""
+
+import json
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+# orjson parses Gemini chunks several times faster (optional import).
+try:
+    import orjson
+    json_loads = orjson.loads
+    _ORJSON_AVAILABLE = True
+except ImportError:
+    _ORJSON_AVAILABLE = False
+
+    def json_loads(payload: bytes):
+        # Decoding first skips json.loads' byte-encoding sniffing.
+        return json.loads(payload.decode("utf-8"))
+
+# Bytes asked of the transport per read. Chunked / HTTP/2 responses hand back
+# each chunk as soon as it arrives (up to this size), so this only bounds how
+# much is decoded per call; it does not delay events.
+SSE_READ_SIZE = 16 * 1024
+
+EVENT_THOUGHT = "thought"
+EVENT_TEXT = "text"
+EVENT_FUNCTION_CALL = "functionCall"
+EVENT_GROUNDING = "groundingMetadata"
+EVENT_USAGE = "usage"
+
+
+class SSEDecoder:
+    """Byte-level incremental SSE decoder.
+
+    ``feed(chunk)`` returns the data payloads (bytes) of the events completed
+    by ``chunk``; ``flush()`` returns a trailing event the stream ended
+    without terminating.
+    """
+
+    __slots__ = ("_buffer", "_data", "_skip_lf")
+
+    def __init__(self):
+        self._buffer = b""
+        self._data = []
+        self._skip_lf = False
+
+    def feed(self, chunk: bytes) -> list:
+        if self._skip_lf:
+            # The previous read ended on the CR of a CRLF split across reads.
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        if self._buffer:
+            chunk = self._buffer + chunk
+        if not chunk:
+            return []
+        # bytes.splitlines() splits on exactly the SSE line endings (CRLF,
+        # LF, CR) in C; only an unterminated last line has to be carried over.
+        lines = chunk.splitlines()
+        last = chunk[-1:]
+        if last == b"\n":
+            self._buffer = b""
+        elif last == b"\r":
+            self._buffer = b""
+            self._skip_lf = True
+        else:
+            self._buffer = lines.pop()
+
+        events = []
+        data = self._data
+        for line in lines:
+            if not line:
+                if data:
+                    events.append(data[0] if len(data) == 1 else b"\n".join(data))
+                    data = self._data = []
+            elif line[:5] == b"data:":
+                data.append(line[6:] if line[5:6] == b" " else line[5:])
+            # event:, id:, retry: and ":" comment lines carry nothing we use
+        return events
+
+    def flush(self) -> list:
+        events = self.feed(b"\n\n") if self._buffer else []
+        if self._data:
+            events.append(b"\n".join(self._data))
+            self._data = []
+        return events
+
+
+def _parse(payloads: list) -> list:
+    parsed = []
+    for payload in payloads:
+        try:
+            parsed.append(json_loads(payload))
+        except ValueError:  # JSONDecodeError, orjson.JSONDecodeError, UnicodeDecodeError
+            continue
+    return parsed
+
+
+def iter_sse_json(chunks: Iterable[bytes]) -> Iterator:
+    """Yield the JSON payload of every SSE event in a stream of byte chunks."""
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        if chunk:
+            yield from _parse(decoder.feed(chunk))
+    yield from _parse(decoder.flush())
+
+
+async def aiter_sse_json(chunks: AsyncIterable[bytes]) -> AsyncIterator:
+    """asyncio version of ``iter_sse_json``."""
+    decoder = SSEDecoder()
+    async for chunk in chunks:
+        if chunk:
+            for data in _parse(decoder.feed(chunk)):
+                yield data
+    for data in _parse(decoder.flush()):
+        yield data
+
+
+def gemini_events(data: dict) -> list:
+    """Typed ``(kind, value)`` events carried by one Gemini stream payload."""
+    events = []
+    if "usageMetadata" in data:
+        events.append((EVENT_USAGE, data["usageMetadata"]))
+    candidates = data.get("candidates")
+    if candidates:
+        candidate = candidates[0]
+        if "groundingMetadata" in candidate:
+            events.append((EVENT_GROUNDING, candidate["groundingMetadata"]))
+        for part in candidate.get("content", {}).get("parts", ()):
+            if "functionCall" in part:
+                events.append((EVENT_FUNCTION_CALL, part))
+            elif "text" in part:
+                events.append((EVENT_THOUGHT if part.get("thought") else EVENT_TEXT, part["text"]))
+    return events
+
+
+def iter_gemini_events(chunks: Iterable[bytes]) -> Iterator[tuple]:
+    """Yield typed events from the raw bytes of a Gemini SSE response."""
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        if chunk:
+            for data in _parse(decoder.feed(chunk)):
+                yield from gemini_events(data)
+    for data in _parse(decoder.flush()):
+        yield from gemini_events(data)
+
+
+async def aiter_gemini_events(chunks: AsyncIterable[bytes]) -> AsyncIterator[tuple]:
+    """asyncio version of ``iter_gemini_events``."""
+    async for data in aiter_sse_json(chunks):
+        for event in gemini_events(data):
+            yield event
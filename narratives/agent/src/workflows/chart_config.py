@@ -15,10 +15,14 @@
 
 import json
 import logging
+from typing import Optional
 
 from src.config import load_config
+from src.deadline import Deadline
 from src.gemini.client import gemini_request
 from src.gemini.schemas import CHART_CONFIG_SCHEMA, DATA_VALIDATION_SCHEMA
+from src.workflows.chart_planner import plan_chart_config
+from src.workflows.data_presence import check_data_presence, record_validation
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +30,21 @@ logger = logging.getLogger(__name__)
 SYNTHESIS_PREVIEW_LENGTH = 2000
 
 
-def get_chart_config(mcp_results: str, user_message: str) -> dict:
+def get_chart_config(mcp_results: str, user_message: str, deadline: Optional[Deadline] = None,
+                     tool_calls: Optional[list] = None) -> dict:
     """Get chart configuration using structured output.
 
     Supports multiple charts for variables with different units/scales.
+    Given the turn's ``tool_calls`` (``ToolResult`` list), the config is first
+    planned from them by rules (``chart_planner``); Gemini is only asked when
+    that is not confident. The request is bounded by the optional turn
+    ``deadline``.
     """
+    if tool_calls is not None:
+        chart_config = plan_chart_config(tool_calls)
+        if chart_config is not None:
+            return chart_config
+
     config = load_config()
     mcp_model = config.get("gemini", {}).get("mcp_model", "gemini-3-flash-preview")
 
@@ -67,7 +81,8 @@ Set should_render to false if no meaningful data for visualization."""
         temperature=0.2,
         thinking_level="minimal",  # Fastest for simple extraction
         response_schema=CHART_CONFIG_SCHEMA,
-        stream=False
+        stream=False,
+        deadline=deadline
     )
 
     try:
@@ -82,7 +97,7 @@ Set should_render to false if no meaningful data for visualization."""
     return {"should_render": False}
 
 
-def validate_data_response(synthesis_text: str, user_message: str) -> bool:
+def validate_data_response(synthesis_text: str, user_message: str, deadline: Optional[Deadline] = None) -> bool:
     """Quick validation: did synthesis actually answer with data?
 
     Called after synthesis completes to determine if charts should be shown.
@@ -106,7 +121,8 @@ Return false if the response says data is "not available", "not found", "doesn't
         temperature=0,
         thinking_level="none",  # Fastest - no thinking needed
         response_schema=DATA_VALIDATION_SCHEMA,
-        stream=False
+        stream=False,
+        deadline=deadline
     )
 
     try:
@@ -118,3 +134,21 @@ Return false if the response says data is "not available", "not found", "doesn't
         logger.error(f"Data validation parse error: {e}")
 
     return True  # Default to showing charts on error
+
+
+def validate_charts(synthesis_text: str, user_message: str, tool_calls: list, chart_config: dict,
+                    deadline: Optional[Deadline] = None) -> tuple[bool, str]:
+    """Should the turn's charts be shown? Returns ``(show_charts, reason)``.
+
+    Decided locally from the tool results and the synthesis text
+    (``check_data_presence``). Ambiguous answers are shown, unless
+    ``config["charts"]["validation"]["llm_tie_breaker"]`` asks Gemini
+    (``validate_data_response``) to decide them.
+    """
+    show_charts, reason = check_data_presence(synthesis_text, tool_calls, chart_config)
+    tie_breaker = load_config().get("charts", {}).get("validation", {}).get("llm_tie_breaker", False)
+    llm_called = show_charts is None and tie_breaker
+    record_validation(show_charts, llm_called)
+    if llm_called:
+        return validate_data_response(synthesis_text, user_message, deadline=deadline), "gemini tie-breaker"
+    return show_charts is not False, reason
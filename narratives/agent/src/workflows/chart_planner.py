@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rule-based chart configs from the turn's ``get_observations`` results.
+
+``get_chart_config`` used to send the whole tool-result text to Gemini to get
+back variable DCIDs, place DCIDs, units and a viz type. Those are already in
+the parsed ``get_observations`` arguments and payloads (``ToolResult``), so
+``plan_chart_config`` applies the same rules as the chart prompt directly:
+
+- series are grouped by unit (``source_metadata.unit``) and place scope
+  (explicit places, or a parent place's children), then split where their
+  magnitudes (median absolute value) are more than ``max_magnitude_ratio``
+  apart (default 100x)
+- a chart is a line chart when its longest time series has at least
+  ``min_line_points`` dates (default 3), else a bar chart with the shared
+  latest date when there is one
+- at most three charts
+
+It returns None, and Gemini is asked as before, when it is not confident:
+no observation data, a result it cannot read, non-numeric values, or more
+groups than charts. Settings are under ``config["charts"]["fast_path"]``;
+``/api/stats`` reports how many calls took the fast path and why the others
+did not.
+"""
+
+import collections
+import logging
+import statistics
+import threading
+from typing import Optional
+
+from src.config import load_config
+from src.mcp.tool_result import OBSERVATIONS_TOOL, ToolResult
+
+logger = logging.getLogger(__name__)
+
+MAX_CHARTS = 3
+DEFAULT_MAX_MAGNITUDE_RATIO = 100
+DEFAULT_MIN_LINE_POINTS = 3
+# Variable names listed in a title before it switches to "and N more"
+TITLE_VARIABLES = 2
+
+
+class NotConfident(Exception):
+    """The rules cannot plan the charts; the reason is the message."""
+
+
+class _Series:
+    """One variable's observations from one ``get_observations`` call."""
+
+    __slots__ = ("variable", "variable_name", "unit", "scope", "places", "parent_name",
+                 "values", "points", "latest_dates")
+
+    def __init__(self, variable: str, variable_name: str, unit: str, scope: tuple):
+        self.variable = variable
+        self.variable_name = variable_name
+        self.unit = unit
+        # ("places",) or ("children", parent_dcid, child_place_type)
+        self.scope = scope
+        self.places = {}  # dcid -> name
+        self.parent_name = None
+        self.values = []
+        self.points = 0  # longest time series
+        self.latest_dates = set()
+
+
+def dcid_and_name(value) -> tuple:
+    """``(dcid, name)`` of a place or variable given as a dict or a bare DCID."""
+    if isinstance(value, dict):
+        return value.get("dcid"), value.get("name") or value.get("dcid")
+    return value, value
+
+
+def _series_from(tool_result: ToolResult) -> Optional[_Series]:
+    payload = tool_result.payload
+    if payload is None:
+        raise NotConfident("unparsed observations")
+    place_observations = payload.get("place_observations")
+    if not isinstance(place_observations, list):
+        raise NotConfident("unrecognized observations")
+
+    args = tool_result.arguments or {}
+    variable, variable_name = dcid_and_name(payload.get("variable"))
+    variable = args.get("variable_dcid") or variable
+    if not variable:
+        raise NotConfident("no variable")
+
+    metadata = payload.get("source_metadata") or {}
+    unit = str(metadata.get("unit") or "")
+    child_place_type = args.get("child_place_type") or payload.get("child_place_type")
+    if child_place_type:
+        parent, parent_name = dcid_and_name(payload.get("resolved_parent_place") or args.get("place_dcid"))
+        if not parent:
+            raise NotConfident("no parent place")
+        scope = ("children", parent, child_place_type)
+    else:
+        parent_name = None
+        scope = ("places",)
+
+    series = _Series(variable, variable_name or variable, unit, scope)
+    series.parent_name = parent_name
+    for observation in place_observations:
+        if not isinstance(observation, dict):
+            raise NotConfident("unrecognized observations")
+        points = [p for p in observation.get("time_series") or []
+                  if isinstance(p, (list, tuple)) and len(p) == 2]
+        if not points:
+            continue
+        if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for _, v in points):
+            raise NotConfident("non-numeric values")
+        dcid, name = dcid_and_name(observation.get("place"))
+        if dcid:
+            series.places[dcid] = name
+        series.values.extend(v for _, v in points)
+        series.points = max(series.points, len(points))
+        series.latest_dates.add(str(max(str(d) for d, _ in points)))
+    return series if series.values else None
+
+
+def _medians(series_list: list) -> list:
+    return [statistics.median(abs(v) for v in s.values) for s in series_list]
+
+
+def _magnitude_clusters(series_list: list, max_ratio: float) -> list:
+    """Split series whose medians are more than ``max_ratio`` apart."""
+    medians = _medians(series_list)
+    order = sorted(range(len(series_list)), key=lambda i: medians[i])
+    clusters = []
+    floor = None
+    for i in order:
+        if floor is None or medians[i] > max(floor, 1e-12) * max_ratio:
+            clusters.append([])
+            floor = medians[i]
+        clusters[-1].append(i)
+    # Charts keep the order the model called the tools in
+    return [[series_list[i] for i in sorted(cluster)] for cluster in sorted(clusters, key=min)]
+
+
+def _title(series_list: list) -> str:
+    names = list(dict.fromkeys(s.variable_name for s in series_list))
+    title = " and ".join(names[:TITLE_VARIABLES])
+    if len(names) > TITLE_VARIABLES:
+        title = f"{', '.join(names[:TITLE_VARIABLES])} and {len(names) - TITLE_VARIABLES} more"
+    scope = series_list[0].scope
+    if scope[0] == "children":
+        return f"{title} by {scope[2]} in {series_list[0].parent_name or scope[1]}"
+    places = {}
+    for s in series_list:
+        places.update(s.places)
+    if len(places) == 1:
+        return f"{title} in {next(iter(places.values()))}"
+    return title
+
+
+def _chart(series_list: list, min_line_points: int) -> dict:
+    chart = {
+        "viz_type": "line" if max(s.points for s in series_list) >= min_line_points else "bar",
+        "title": _title(series_list),
+        "variable_dcids": list(dict.fromkeys(s.variable for s in series_list)),
+    }
+    scope = series_list[0].scope
+    if scope[0] == "children":
+        chart["parent_place"] = scope[1]
+        chart["child_place_type"] = scope[2]
+    else:
+        chart["place_dcids"] = list(dict.fromkeys(p for s in series_list for p in s.places))
+    if chart["viz_type"] == "bar":
+        latest = set().union(*(s.latest_dates for s in series_list))
+        if len(latest) == 1:
+            chart["date"] = latest.pop()
+    return chart
+
+
+def plan_charts(tool_calls: list, max_ratio: float = DEFAULT_MAX_MAGNITUDE_RATIO,
+                min_line_points: int = DEFAULT_MIN_LINE_POINTS) -> dict:
+    """A ``CHART_CONFIG_SCHEMA`` config for the turn's tool calls.
+
+    Raises:
+        NotConfident: when Gemini should plan the charts instead.
+    """
+    series_list = []
+    for tool_result in tool_calls:
+        if tool_result.name == OBSERVATIONS_TOOL and tool_result.has_observations:
+            series = _series_from(tool_result)
+            if series is not None:
+                series_list.append(series)
+    if not series_list:
+        raise NotConfident("no observation data")
+
+    groups = collections.defaultdict(list)
+    for series in series_list:
+        groups[(series.unit, series.scope)].append(series)
+    charts = [
+        _chart(cluster, min_line_points)
+        for group in groups.values()
+        for cluster in _magnitude_clusters(group, max_ratio)
+    ]
+    if len(charts) > MAX_CHARTS:
+        raise NotConfident("too many chart groups")
+    return {"should_render": True, "charts": charts}
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fast_path = 0
+        self.fallbacks = collections.Counter()
+
+    def add(self, reason: Optional[str]):
+        with self._lock:
+            if reason is None:
+                self.fast_path += 1
+            else:
+                self.fallbacks[reason] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.fast_path + sum(self.fallbacks.values())
+            return {
+                "fast_path": self.fast_path,
+                "llm_fallback": total - self.fast_path,
+                "fast_path_rate": round(self.fast_path / total, 3) if total else None,
+                "fallback_reasons": dict(self.fallbacks),
+            }
+
+
+_counters = _Counters()
+
+
+def get_chart_planner_stats() -> dict:
+    return _counters.stats()
+
+
+def plan_chart_config(tool_calls: list) -> Optional[dict]:
+    """The rule-based chart config, or None when Gemini should plan it
+    (fast path disabled or not confident)."""
+    settings = load_config().get("charts", {}).get("fast_path", {})
+    if not settings.get("enabled", True):
+        return None
+    try:
+        chart_config = plan_charts(
+            tool_calls,
+            max_ratio=settings.get("max_magnitude_ratio", DEFAULT_MAX_MAGNITUDE_RATIO),
+            min_line_points=settings.get("min_line_points", DEFAULT_MIN_LINE_POINTS),
+        )
+    except NotConfident as e:
+        _counters.add(str(e))
+        logger.info(f"Chart planner not confident ({e}); asking Gemini")
+        return None
+    _counters.add(None)
+    logger.info(f"📊 Chart config planned from tool results: {len(chart_config['charts'])} chart(s)")
+    return chart_config
@@ -15,31 +15,37 @@
 
 """Chat streaming pipeline phases.
 
-The SSE-emitting phases extracted verbatim from the original inline
-``chat_stream`` generator. Each phase is a generator that yields the exact same
-SSE strings in the same order and communicates results back to the next phase
-through a shared mutable ``ctx`` dict (preserving the threading/queue behavior
-of the original inline closures).
+The SSE-emitting phases extracted from the original inline ``chat_stream``
+generator. Each phase is a generator that yields SSE strings and
+communicates results to later phases through a shared mutable ``ctx`` dict.
+
+``run_chat_pipeline`` runs them as a dependency graph (``PhaseGraph``): setup,
+then MCP and KB at the same time (the KB search does not need MCP results),
+then synthesis and follow-ups. Events still reach the client in phase order.
 """
 
 import json
 import logging
-import queue
 import threading
 import time
 
-import src.mcp.client as mcp_client
 from src.config import apply_query_overrides, load_config
+from src.deadline import STAGE_CHARTS, STAGE_KB
 from src.gemini.client import gemini_request
-from src.mcp.client import get_tools, initialize_mcp
+from src.gemini.hedging import CALL_TYPE_SYNTHESIS
+from src.mcp.client import get_mcp_client, get_mcp_stats, initialize_mcp
 from src.mcp.data_utils import (
     check_data_availability,
     extract_provenance_from_mcp_results,
 )
-from src.workflows.chart_config import get_chart_config, validate_data_response
+from src.mcp.speculation import start_speculation
+from src.mcp.tool_catalog import get_tools
+from src.workflows.chart_config import get_chart_config, validate_charts
+from src.workflows.event_channel import EventChannel
 from src.workflows.follow_up import generate_follow_up_questions
-from src.workflows.kb_search import execute_kb_query
+from src.workflows.kb_search import execute_kb_query, execute_kb_query_async
 from src.workflows.mcp_loop import execute_mcp_tool_loop
+from src.workflows.phase_graph import Phase, PhaseGraph
 
 logger = logging.getLogger(__name__)
 
@@ -49,21 +55,23 @@ logger = logging.getLogger(__name__)
 CHART_CONFIG_JOIN_TIMEOUT_SECONDS = 5
 
 
-def run_mcp_phase(ctx):
-    """Phase 1: run config/MCP setup then execute the MCP tool loop.
+def _stopped(ctx) -> bool:
+    """The turn was aborted, or its consumer has gone (``PhaseGraph`` sets
+    ``ctx['cancelled']``); checked before each remote call."""
+    return ctx['aborted'] or ctx['cancelled'].is_set()
+
 
-    Reads ``user_message``, ``history``, ``session_logger``, ``query_params``,
-    ``demo_mode`` and the chart holders from ``ctx``; writes ``effective_config``,
-    ``mcp_results``, ``tool_calls_list``, ``thought_queue`` and
-    ``thought_callback`` back into ``ctx`` for later phases. Sets
+def run_setup_phase(ctx):
+    """Phase 0: log the turn and load the effective config.
+
+    Reads ``user_message``, ``history``, ``session_logger``, ``query_params``
+    and ``demo_mode`` from ``ctx``; writes ``effective_config``. Sets
     ``ctx['aborted']`` if the backend config fails to load."""
     session_logger = ctx['session_logger']
     query_params = ctx['query_params']
     demo_mode = ctx['demo_mode']
     user_message = ctx['user_message']
     history = ctx['history']
-    chart_result_holder = ctx['chart_result_holder']
-    chart_thread = ctx['chart_thread']
 
     # Log query params if present
     if query_params:
@@ -84,16 +92,35 @@ def run_mcp_phase(ctx):
         return
 
     # Apply query param overrides to config
-    effective_config = apply_query_overrides(config, query_params)
-    ctx['effective_config'] = effective_config
+    ctx['effective_config'] = apply_query_overrides(config, query_params)
+
+
+def run_mcp_phase(ctx):
+    """Phase 1: MCP setup then the MCP tool loop.
+
+    Reads ``effective_config``, ``user_message``, ``history``,
+    ``session_logger``, ``demo_mode``, ``deadline`` and the chart holders from
+    ``ctx``; writes ``mcp_results``, ``tool_calls_list`` and ``mcp_sources``
+    for later phases, and starts the background chart-config thread."""
+    if _stopped(ctx):
+        return
+    session_logger = ctx['session_logger']
+    effective_config = ctx['effective_config']
+    demo_mode = ctx['demo_mode']
+    user_message = ctx['user_message']
+    history = ctx['history']
+    chart_result_holder = ctx['chart_result_holder']
+    chart_thread = ctx['chart_thread']
+    deadline = ctx['deadline']
+    cancelled = ctx['cancelled']
 
     # Ensure MCP is initialized (fix for tool calls not showing)
     mcp_ready = False
-    if not mcp_client.session_id:
+    if not get_mcp_client().ready:
         logger.info("MCP session not initialized, attempting to connect...")
-        session_logger.log("MCP_INIT_ATTEMPT", {"reason": "session_id was None"})
+        session_logger.log("MCP_INIT_ATTEMPT", {"reason": "no MCP session initialized"})
         if initialize_mcp():
-            session_logger.log("MCP_INIT_SUCCESS", {"mcp_session_id": mcp_client.session_id})
+            session_logger.log("MCP_INIT_SUCCESS", {"mcp_sessions": get_mcp_stats()})
             mcp_ready = True
         else:
             # Even if init returns False, try to get tools anyway
@@ -102,58 +129,51 @@ def run_mcp_phase(ctx):
     else:
         mcp_ready = True
 
-    # Double-check: if we have tools, MCP is working regardless of session_id
+    # Double-check: if we have tools, MCP is working even without a session ID
     tools = get_tools()
     if tools:
         mcp_ready = True
         session_logger.log("MCP_TOOLS_AVAILABLE", {"tool_count": len(tools), "tools": [t.get("name") for t in tools]})
     else:
-        session_logger.log("MCP_NO_TOOLS", {"session_id": mcp_client.session_id})
-
-    # Create thought queue for streaming thoughts from background threads
-    thought_queue = queue.Queue()
-    ctx['thought_queue'] = thought_queue
-
-    def thought_callback(thought_text: str, phase: str):
-        """Callback to put thoughts into queue for streaming."""
-        thought_queue.put({'thought': thought_text, 'phase': phase})
-    ctx['thought_callback'] = thought_callback
+        session_logger.log("MCP_NO_TOOLS", {"mcp_sessions": get_mcp_stats()})
 
     # Phase 1: MCP Tools
     mcp_enabled = effective_config.get("mcp", {}).get("enabled", True)
     mcp_results = ""
     tool_calls_list = []
+    mcp_sources = []
 
     if mcp_enabled and mcp_ready:
         yield f"data: {json.dumps({'status': 'mcp_start', 'message': 'Querying data tools...'})}\n\n"
 
+        # Prefetch likely search_indicators results while Gemini plans
+        speculation = start_speculation(user_message, effective_config, deadline)
+
         # Run MCP in thread to enable thought streaming
         mcp_result_holder = {'results': '', 'tool_calls': [], 'text': ''}
 
-        def run_mcp():
+        def run_mcp(channel: EventChannel):
             try:
                 mcp_result_holder['results'], mcp_result_holder['tool_calls'], mcp_result_holder['text'] = execute_mcp_tool_loop(
                     user_message, history, session_logger=session_logger,
                     effective_config=effective_config,
-                    thought_callback=lambda t: thought_callback(t, 'mcp'),
-                    demo_mode=demo_mode
+                    thought_callback=lambda t: channel.thought(t, 'mcp'),
+                    demo_mode=demo_mode,
+                    deadline=deadline,
+                    cancelled=cancelled
                 )
             except Exception as e:
                 logger.error(f"MCP thread error: {e}")
                 mcp_result_holder['text'] = f"Error: {e}"
 
-        mcp_thread = threading.Thread(target=run_mcp)
-        mcp_thread.start()
+        # Stream thoughts while MCP runs; the channel ends when run_mcp returns
+        mcp_channel = EventChannel()
+        mcp_channel.start(run_mcp, name="mcp")
+        for _, thought_data in mcp_channel:
+            yield f"data: {json.dumps(thought_data)}\n\n"
 
-        # Stream thoughts while MCP runs
-        while mcp_thread.is_alive() or not thought_queue.empty():
-            try:
-                thought_data = thought_queue.get(timeout=0.1)
-                yield f"data: {json.dumps(thought_data)}\n\n"
-            except queue.Empty:
-                continue
-
-        mcp_thread.join()
+        if speculation is not None:
+            speculation.finish(mcp_result_holder['tool_calls'], session_logger)
 
         # Signal MCP thinking complete
         yield f"data: {json.dumps({'thinking_complete': 'mcp'})}\n\n"
@@ -164,7 +184,7 @@ def run_mcp_phase(ctx):
 
         # Send each tool call for left sidebar
         for tc in tool_calls_list:
-            yield f"data: {json.dumps({'type': 'tool_call', 'name': tc['name'], 'arguments': tc['arguments'], 'result': tc['result'], 'status': tc['status']})}\n\n"
+            yield f"data: {json.dumps(tc.to_event())}\n\n"
 
         yield f"data: {json.dumps({'status': 'mcp_complete', 'tool_count': len(tool_calls_list)})}\n\n"
 
@@ -178,9 +198,13 @@ def run_mcp_phase(ctx):
             yield f"data: {json.dumps({'mcp_sources': mcp_sources})}\n\n"
 
         # Start chart config in background (runs parallel with KB + synthesis)
-        if mcp_results:
+        if mcp_results and not cancelled.is_set():
             def run_chart_config():
-                chart_result_holder['config'] = get_chart_config(mcp_results, user_message)
+                if cancelled.is_set():
+                    return
+                chart_result_holder['config'] = get_chart_config(
+                    mcp_results, user_message, deadline=deadline, tool_calls=tool_calls_list
+                )
             chart_thread[0] = threading.Thread(target=run_chart_config)
             chart_thread[0].start()
 
@@ -190,59 +214,100 @@ def run_mcp_phase(ctx):
 
     ctx['mcp_results'] = mcp_results
     ctx['tool_calls_list'] = tool_calls_list
+    ctx['mcp_sources'] = mcp_sources
 
 
 def run_kb_phase(ctx):
     """Phase 2: KB Query (if enabled).
 
     Reads ``effective_config``, ``user_message``, ``session_logger``,
-    ``demo_mode``, ``thought_queue`` and ``thought_callback`` from ``ctx``;
-    writes ``kb_response`` and ``kb_sources`` back into ``ctx``."""
-    if ctx['aborted']:
+    ``demo_mode`` and ``deadline`` from ``ctx``; writes ``kb_response`` and
+    ``kb_sources`` back into ``ctx``. Runs alongside the MCP phase, so the
+    deadline is checked while waiting for the search: once less than
+    ``skip_kb_below_seconds`` is left, a result not yet in is dropped and
+    synthesis answers from MCP data alone."""
+    if _stopped(ctx):
         return
     session_logger = ctx['session_logger']
     effective_config = ctx['effective_config']
     user_message = ctx['user_message']
     demo_mode = ctx['demo_mode']
-    thought_queue = ctx['thought_queue']
-    thought_callback = ctx['thought_callback']
+    deadline = ctx['deadline']
 
     # Phase 2: KB Query (if enabled)
     kb_response = ""
     kb_sources = []
     kb_enabled = effective_config.get("knowledge_base", {}).get("enabled", False)
 
+    # Budget already too short to start the search (see the wait below)
+    if kb_enabled and deadline is not None and deadline.degrade(STAGE_KB, session_logger):
+        kb_enabled = False
+        yield f"data: {json.dumps({'status': 'kb_skipped', 'message': 'Skipping knowledge base search to answer in time'})}\n\n"
+
     if kb_enabled:
         yield f"data: {json.dumps({'status': 'kb_start', 'message': 'Searching knowledge base...'})}\n\n"
 
-        # Run KB in thread to enable thought streaming
+        # Run KB off this thread to enable thought streaming: on the shared
+        # event loop (asyncio client), or on a thread of its own
         kb_result_holder = {'response': '', 'sources': []}
 
-        def run_kb():
+        def store_kb_result(kb_result: dict):
+            kb_result_holder['response'] = kb_result.get("response", "")
+            kb_result_holder['sources'] = kb_result.get("sources", [])
+
+        def run_kb(channel: EventChannel):
             try:
-                kb_result = execute_kb_query(
+                store_kb_result(execute_kb_query(
                     user_message, session_logger=session_logger,
-                    thought_callback=lambda t: thought_callback(t, 'kb'),
+                    thought_callback=lambda t: channel.thought(t, 'kb'),
                     demo_mode=demo_mode,
-                    effective_config=effective_config
-                )
-                kb_result_holder['response'] = kb_result.get("response", "")
-                kb_result_holder['sources'] = kb_result.get("sources", [])
+                    effective_config=effective_config,
+                    deadline=deadline
+                ))
             except Exception as e:
                 logger.error(f"KB thread error: {e}")
 
-        kb_thread = threading.Thread(target=run_kb)
-        kb_thread.start()
-
-        # Stream thoughts while KB runs
-        while kb_thread.is_alive() or not thought_queue.empty():
+        async def run_kb_async(channel: EventChannel):
             try:
-                thought_data = thought_queue.get(timeout=0.1)
+                store_kb_result(await execute_kb_query_async(
+                    user_message, session_logger=session_logger,
+                    thought_callback=lambda t: channel.thought(t, 'kb'),
+                    demo_mode=demo_mode,
+                    effective_config=effective_config,
+                    deadline=deadline
+                ))
+            except Exception as e:
+                logger.error(f"KB query error: {e}")
+
+        # Stream thoughts while KB runs; the channel ends when run_kb returns,
+        # or we stop waiting when the deadline reaches the skip-KB threshold
+        give_up_at = deadline.expires_at - deadline.thresholds[STAGE_KB] if deadline is not None else None
+        kb_channel = EventChannel()
+        kb_task = None
+        if effective_config.get("knowledge_base", {}).get("asyncio", True):
+            kb_task = kb_channel.start_coroutine(run_kb_async)
+        else:
+            kb_channel.start(run_kb, name="kb")
+        try:
+            for _, thought_data in kb_channel.events(until=give_up_at):
                 yield f"data: {json.dumps(thought_data)}\n\n"
-            except queue.Empty:
-                continue
-
-        kb_thread.join()
+        except GeneratorExit:
+            # The turn was cancelled; stop the search rather than finish it
+            if kb_task is not None:
+                kb_task.cancel()
+            raise
+
+        # The wait only ends open at the skip-KB threshold: the first thing
+        # dropped when the turn runs long. The search is cancelled (asyncio)
+        # or finishes in the background, unused; its result is never read.
+        if not kb_channel.closed:
+            if kb_task is not None:
+                kb_task.cancel()
+            deadline.mark_degraded(STAGE_KB, session_logger)
+            yield f"data: {json.dumps({'status': 'kb_skipped', 'message': 'Skipping knowledge base search to answer in time'})}\n\n"
+            ctx['kb_response'] = ""
+            ctx['kb_sources'] = []
+            return
 
         # Signal KB thinking complete
         yield f"data: {json.dumps({'thinking_complete': 'kb'})}\n\n"
@@ -263,12 +328,14 @@ def run_kb_phase(ctx):
 def run_synthesis_phase(ctx):
     """Phase 3: Synthesis with streaming, chart validation and the done event.
 
-    Reads the MCP/KB results, chart holders and ``request_start_time`` from
-    ``ctx``; writes ``full_text`` and ``chart_config`` back into ``ctx``. Sets
+    Reads the MCP/KB results, chart holders, ``deadline`` and
+    ``request_start_time`` from ``ctx``; writes ``full_text`` and ``chart_config`` back into ``ctx``. Sets
     ``ctx['aborted']`` if the synthesis request returns an error dict or the
     stream breaks part-way, so chart validation, the ``done`` event and
-    follow-ups are skipped for a response that was never completed."""
-    if ctx['aborted']:
+    follow-ups are skipped for a response that was never completed.
+    Synthesis always runs, with the deadline's synthesis reserve; near the
+    turn deadline charts are dropped rather than validated and waited for."""
+    if _stopped(ctx):
         return
     session_logger = ctx['session_logger']
     effective_config = ctx['effective_config']
@@ -277,12 +344,14 @@ def run_synthesis_phase(ctx):
     demo_mode = ctx['demo_mode']
     mcp_results = ctx['mcp_results']
     tool_calls_list = ctx['tool_calls_list']
+    mcp_sources = ctx['mcp_sources']
     kb_response = ctx['kb_response']
     kb_sources = ctx['kb_sources']
     chart_result_holder = ctx['chart_result_holder']
     chart_thread = ctx['chart_thread']
     request_start_time = ctx['request_start_time']
     full_text = ctx['full_text']
+    deadline = ctx['deadline']
 
     # Phase 3: Synthesis with streaming
     yield f"data: {json.dumps({'status': 'synthesis_start', 'message': 'Generating response...'})}\n\n"
@@ -295,7 +364,6 @@ def run_synthesis_phase(ctx):
     context_parts = []
     if mcp_results:
         # Format extracted sources as markdown links for synthesis
-        mcp_sources = extract_provenance_from_mcp_results(tool_calls_list)
         if mcp_sources:
             source_links = ", ".join([f"[{s['name']}]({s['url']})" for s in mcp_sources])
         else:
@@ -336,7 +404,9 @@ Please provide a comprehensive response combining all available information."""
             stream=True,
             session_logger=session_logger,
             include_thoughts=True,  # Enable thought streaming
-            demo_mode=demo_mode
+            demo_mode=demo_mode,
+            call_type=CALL_TYPE_SYNTHESIS,
+            deadline=deadline.for_synthesis() if deadline is not None else None
         )
 
         if isinstance(stream_gen, dict) and "error" in stream_gen:
@@ -373,21 +443,29 @@ Please provide a comprehensive response combining all available information."""
         ctx['aborted'] = True
         return
 
-    # Quick validation: should we show charts based on synthesis response?
-    show_charts = True
-    if full_text and chart_thread[0]:
-        show_charts = validate_data_response(full_text, user_message)
-        if not show_charts:
-            session_logger.log("CHART_VALIDATION", {"data_found": False, "action": "hide_charts"})
+    # Last thing dropped when the turn runs long: send the answer without charts
+    drop_charts = bool(chart_thread[0]) and deadline is not None and deadline.degrade(STAGE_CHARTS, session_logger)
 
     # Wait for chart config thread (started after MCP, runs parallel with KB + synthesis)
-    if chart_thread[0]:
-        chart_thread[0].join(timeout=CHART_CONFIG_JOIN_TIMEOUT_SECONDS)
-    chart_config = chart_result_holder['config']
-
-    # Add hide_charts flag if validation determined no data was found
-    if not show_charts:
-        chart_config['hide_charts'] = True
+    if drop_charts:
+        chart_config = {"should_render": False}
+    else:
+        if chart_thread[0]:
+            join_timeout = CHART_CONFIG_JOIN_TIMEOUT_SECONDS
+            if deadline is not None:
+                join_timeout = max(min(join_timeout, deadline.remaining()), 0)
+            chart_thread[0].join(timeout=join_timeout)
+        chart_config = chart_result_holder['config']
+
+    # Should we show charts? Checked locally against the tool results and the
+    # synthesis text; Gemini is only asked to break ties when configured
+    if full_text and chart_thread[0] and not drop_charts:
+        show_charts, reason = validate_charts(full_text, user_message, tool_calls_list, chart_config,
+                                              deadline=deadline)
+        if not show_charts:
+            session_logger.log("CHART_VALIDATION", {"data_found": False, "action": "hide_charts", "reason": reason})
+            # Add hide_charts flag since validation determined no data was found
+            chart_config['hide_charts'] = True
 
     # Log final response
     total_duration_ms = (time.time() - request_start_time) * 1000
@@ -410,9 +488,9 @@ Please provide a comprehensive response combining all available information."""
 def run_followups(ctx):
     """Emit follow-up questions grounded in the resolved chart topics.
 
-    Reads ``chart_config`` and ``user_message`` from ``ctx``. Runs after the
-    ``done`` event, matching the original order."""
-    if ctx['aborted']:
+    Reads ``chart_config``, ``user_message`` and ``deadline`` from ``ctx``.
+    Runs after the ``done`` event, matching the original order."""
+    if _stopped(ctx):
         return
     user_message = ctx['user_message']
     chart_config = ctx['chart_config']
@@ -428,8 +506,36 @@ def run_followups(ctx):
                 topics.append(title)
         if not topics and chart_config.get('title'):  # legacy single-chart shape
             topics.append(chart_config['title'])
-        follow_ups = generate_follow_up_questions(user_message, topics)
+        follow_ups = generate_follow_up_questions(user_message, topics, deadline=ctx['deadline'])
         if follow_ups:
             yield f"data: {json.dumps({'follow_up_questions': follow_ups})}\n\n"
     except Exception as e:
         logger.error(f"Follow-up emit error: {e}")
+
+
+# The chat turn as a dependency graph: each phase's inputs are the ctx keys
+# later phases wait for (the rest of ctx is set up by the route)
+CHAT_PHASES = [
+    Phase("setup", run_setup_phase,
+          inputs=("user_message", "history", "session_logger", "query_params", "demo_mode"),
+          outputs=("effective_config",)),
+    Phase("mcp", run_mcp_phase,
+          inputs=("effective_config", "user_message", "history", "deadline"),
+          outputs=("mcp_results", "tool_calls_list", "mcp_sources")),
+    Phase("kb", run_kb_phase,
+          inputs=("effective_config", "user_message", "deadline"),
+          outputs=("kb_response", "kb_sources")),
+    Phase("synthesis", run_synthesis_phase,
+          inputs=("mcp_results", "tool_calls_list", "mcp_sources", "kb_response", "kb_sources"),
+          outputs=("full_text", "chart_config")),
+    Phase("followups", run_followups, inputs=("chart_config", "user_message", "deadline")),
+]
+
+
+def run_chat_pipeline(ctx):
+    """Run every phase of a chat turn over ``ctx``, yielding SSE strings.
+
+    MCP and KB run concurrently unless
+    ``config["pipeline"]["concurrent_phases"]`` is false."""
+    concurrent = load_config().get("pipeline", {}).get("concurrent_phases", True)
+    yield from PhaseGraph(CHAT_PHASES, concurrent=concurrent).run(ctx, ctx['session_logger'])
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local check for whether a turn's charts are backed by data.
+
+After synthesis, charts are hidden when the answer turned out to have no
+data. That used to be one more Gemini call at the end of every turn
+(``validate_data_response``). ``check_data_presence`` decides it locally from:
+
+- the structured tool results: is there a non-empty ``get_observations``
+  series for a charted variable and place (or parent place)?
+- a phrase matcher over the synthesis text ("not available", "could not
+  find", ...) and whether the text quotes any figures
+
+No series behind the charts, or a "no data" answer without figures, hides
+them; series and no "no data" phrases show them. An answer that has both
+figures and "no data" phrases is ambiguous: with
+``config["charts"]["validation"]["llm_tie_breaker"]`` Gemini decides, as
+before; otherwise the charts are shown.
+"""
+
+import re
+import threading
+from typing import Optional
+
+from src.mcp.tool_result import OBSERVATIONS_TOOL
+from src.workflows.chart_planner import dcid_and_name
+
+REASON_NO_CHARTS = "no charts"
+REASON_NO_SERIES = "no series for charted data"
+REASON_NO_DATA_ANSWER = "answer reports no data"
+REASON_DATA = "series and answer agree"
+REASON_AMBIGUOUS = "answer has figures and no-data phrases"
+
+_NO_DATA_PHRASES = re.compile(
+    r"\b(?:no data|not available|unavailable|not found|no (?:matching )?(?:records|observations|statistics)|"
+    r"(?:does not|doesn't|do not|don't) (?:exist|have (?:any )?data)|"
+    r"(?:could not|couldn't|unable to|was unable to) (?:find|locate|retrieve))\b",
+    re.IGNORECASE,
+)
+# Numbers other than bare years (1900-2099)
+_FIGURE = re.compile(r"(?<![\w.])(?!(?:19|20)\d\d\b)\d[\d,]*(?:\.\d+)?")
+
+
+def _observed_series(tool_calls: list) -> list:
+    """``(variable, places)`` for each ``get_observations`` call with data."""
+    observed = []
+    for tool_result in tool_calls:
+        if tool_result.name != OBSERVATIONS_TOOL or not tool_result.has_observations:
+            continue
+        args = tool_result.arguments or {}
+        payload = tool_result.payload or {}
+        variable = args.get("variable_dcid") or dcid_and_name(payload.get("variable"))[0]
+        places = {args.get("place_dcid"), dcid_and_name(payload.get("resolved_parent_place"))[0]}
+        for observation in payload.get("place_observations") or []:
+            if isinstance(observation, dict) and observation.get("time_series"):
+                places.add(dcid_and_name(observation.get("place"))[0])
+        places.discard(None)
+        observed.append((variable, places))
+    return observed
+
+
+def _chart_backed(chart: dict, observed: list) -> bool:
+    variables = set(chart.get("variable_dcids") or [])
+    places = set(chart.get("place_dcids") or [])
+    if chart.get("parent_place"):
+        places.add(chart["parent_place"])
+    for variable, observed_places in observed:
+        # A series whose variable is unknown still counts as data
+        if variable and variables and variable not in variables:
+            continue
+        if not places or not observed_places or places & observed_places:
+            return True
+    return False
+
+
+def check_data_presence(synthesis_text: str, tool_calls: list, chart_config: dict) -> tuple[Optional[bool], str]:
+    """``(show_charts, reason)``; ``show_charts`` is None when ambiguous."""
+    charts = chart_config.get("charts") or []
+    if not chart_config.get("should_render") or not charts:
+        return True, REASON_NO_CHARTS
+    observed = _observed_series(tool_calls)
+    if not any(_chart_backed(chart, observed) for chart in charts):
+        return False, REASON_NO_SERIES
+    if not _NO_DATA_PHRASES.search(synthesis_text):
+        return True, REASON_DATA
+    if not _FIGURE.search(synthesis_text):
+        return False, REASON_NO_DATA_ANSWER
+    return None, REASON_AMBIGUOUS
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.shown = 0
+        self.hidden = 0
+        self.ambiguous = 0
+        self.llm_calls = 0
+
+    def add(self, show_charts: Optional[bool], llm_called: bool):
+        with self._lock:
+            if show_charts is None:
+                self.ambiguous += 1
+            elif show_charts:
+                self.shown += 1
+            else:
+                self.hidden += 1
+            self.llm_calls += llm_called
+
+    def stats(self) -> dict:
+        with self._lock:
+            decided = self.shown + self.hidden
+            total = decided + self.ambiguous
+            return {
+                "shown": self.shown,
+                "hidden": self.hidden,
+                "ambiguous": self.ambiguous,
+                "llm_calls": self.llm_calls,
+                "local_rate": round(decided / total, 3) if total else None,
+            }
+
+
+_counters = _Counters()
+
+
+def record_validation(show_charts: Optional[bool], llm_called: bool) -> None:
+    _counters.add(show_charts, llm_called)
+
+
+def get_chart_validation_stats() -> dict:
+    return _counters.stats()
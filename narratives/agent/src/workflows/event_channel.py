@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Event channel between a phase's worker thread and its SSE generator.
+
+The MCP and KB phases used to run their work on a thread and spin on
+``thought_queue.get(timeout=0.1)`` while ``thread.is_alive()``: up to 100 ms
+late at every phase boundary, and ten wakeups a second per open stream while
+Gemini is thinking. Here the producer pushes typed events and completion is
+sent in-band, so the consumer blocks until there is an event and sees the
+end as soon as the worker returns::
+
+    channel = EventChannel()
+    channel.start(work)            # work(channel) on a thread; closes when done
+    for kind, data in channel:     # blocks; ends when work returns
+        ...
+
+``start_coroutine`` runs an ``async def work(channel)`` on the shared event
+loop instead, so the wait holds no thread of its own.
+
+``benchmarks/bench_event_channel.py`` compares this with the polling loop.
+"""
+
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional
+
+from src.gemini.async_client import run_coroutine
+
+EVENT_THOUGHT = "thought"
+
+_CLOSED = object()
+
+
+class EventChannel:
+    """Single-consumer stream of ``(kind, data)`` events from producer threads."""
+
+    def __init__(self):
+        self._events = queue.Queue()
+        self._error = None
+        self.closed = False
+
+    def put(self, kind: str, data: Any = None) -> None:
+        self._events.put((kind, data))
+
+    def thought(self, text: str, phase: str) -> None:
+        """A thought chunk, as the SSE ``{"thought", "phase"}`` payload."""
+        self.put(EVENT_THOUGHT, {'thought': text, 'phase': phase})
+
+    def close(self, error: BaseException = None) -> None:
+        """End the stream; ``error`` is raised to the consumer after the
+        events already sent."""
+        self._error = error
+        self._events.put(_CLOSED)
+
+    def start(self, work: Callable[["EventChannel"], None], name: str = None) -> threading.Thread:
+        """Run ``work(channel)`` on a new thread; the channel closes when it returns."""
+        def run():
+            try:
+                work(self)
+            except BaseException as e:
+                self.close(e)
+            else:
+                self.close()
+
+        thread = threading.Thread(target=run, name=name)
+        thread.start()
+        return thread
+
+    def start_coroutine(self, work: Callable) -> concurrent.futures.Future:
+        """Run the coroutine ``work(channel)`` on the shared event loop
+        (``run_coroutine``); the channel closes when it returns or is cancelled."""
+        async def run():
+            try:
+                await work(self)
+            except asyncio.CancelledError:
+                self.close()
+                raise
+            except Exception as e:
+                self.close(e)
+            else:
+                self.close()
+
+        return run_coroutine(run())
+
+    def __iter__(self) -> Iterator[tuple]:
+        return self.events()
+
+    def events(self, until: Optional[float] = None) -> Iterator[tuple]:
+        """The events until the channel closes, or until ``until`` (a
+        ``time.time()`` value) if that comes first; ``closed`` tells which."""
+        while True:
+            try:
+                event = self._events.get(timeout=None if until is None else max(until - time.time(), 0))
+            except queue.Empty:
+                return
+            if event is _CLOSED:
+                self.closed = True
+                if self._error is not None:
+                    raise self._error
+                return
+            yield event
@@ -16,8 +16,10 @@
 import json
 import logging
 import re
+from typing import Optional
 
 from src.config import load_config
+from src.deadline import Deadline
 from src.gemini.client import gemini_request
 from src.gemini.schemas import DEFAULT_FOLLOW_UP_PROMPT, FOLLOW_UP_SCHEMA
 
@@ -27,16 +29,20 @@ logger = logging.getLogger(__name__)
 MAX_FOLLOW_UP_QUESTIONS = 3
 
 
-def generate_follow_up_questions(user_message: str, topics: list) -> list:
+def generate_follow_up_questions(user_message: str, topics: list, deadline: Optional[Deadline] = None) -> list:
     """Generate self-contained follow-up questions grounded in the resolved topics.
 
     Mirrors datacommons.org's related.generate_follow_up_questions: returns []
     when there are no topics (no static fallback), uses a structured Gemini call,
     and filters out any question that leaks a context-dependent pronoun.
+    Also returns [] once the turn ``deadline`` has passed.
     """
     topics = [t.strip() for t in (topics or []) if isinstance(t, str) and t.strip()]
     if not topics or not user_message:
         return []
+    if deadline is not None and deadline.expired():
+        logger.info("Turn deadline passed, skipping follow-up questions")
+        return []
 
     config = load_config()
     model = config.get("gemini", {}).get("mcp_model", "gemini-3-flash-preview")
@@ -56,7 +62,8 @@ Generate the self-contained follow-up questions now."""
             temperature=0.8,  # higher for varied phrasing
             thinking_level="minimal",
             response_schema=FOLLOW_UP_SCHEMA,
-            stream=False
+            stream=False,
+            deadline=deadline
         )
         questions = []
         if "candidates" in response:
@@ -13,22 +13,160 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import asyncio
 import logging
-import random
 import time
 from typing import Optional
 
-import requests
-
-from src.config import get_api_keys, inject_datetime, load_config
-from src.gemini.client import build_thinking_config, get_api_key_filestore_mapping
+from src.config import get_api_keys, load_config
+from src.deadline import Deadline, request_timeout, retry_deadline
+from src.gemini import async_client
+from src.gemini.call_plan import StreamCollector, api_base, report_failure
+from src.gemini.client import get_api_key_filestore_mapping
+from src.gemini.hedging import CALL_TYPE_KB, open_hedged_stream
+from src.gemini.model_ladder import aiter_model_attempts, iter_model_attempts
+from src.gemini.payload import build_thinking_config
+from src.gemini.prompt_layout import layout_system_instruction
 from src.session_logger import SessionLogger
+from src.sse import iter_gemini_events
 
 logger = logging.getLogger(__name__)
 
 
-def execute_kb_query(user_message: str, session_logger: Optional[SessionLogger] = None, thought_callback: callable = None, demo_mode: bool = False, effective_config: dict = None) -> dict:
+def build_kb_payload(user_message: str, store_id: str, config: dict) -> dict:
+    """File-search request body for one API key's filestore."""
+    kb_config = config.get("knowledge_base", {})
+    kb_prompt = config.get("prompts", {}).get("kb", "")
+    system_text, volatile_parts = layout_system_instruction(kb_prompt)
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": user_message}, *volatile_parts]}],
+        "systemInstruction": {"parts": [{"text": system_text}]},
+        "generationConfig": {
+            "temperature": kb_config.get("temperature", 0.3),
+        },
+        "tools": [{
+            "fileSearch": {
+                "dynamicFileSearchConfig": {
+                    "mode": "MODE_DYNAMIC",
+                    "dynamicThreshold": kb_config.get("dynamic_threshold", 0.3)
+                }
+            }
+        }],
+        "toolConfig": {
+            "fileSearch": {
+                "vectorStore": {"storeResourceId": store_id}
+            }
+        }
+    }
+
+    # Add thinking config with includeThoughts for streaming
+    thinking_level = config.get("thinking", {}).get("kb_level", "low")
+    if thinking_level:
+        payload["generationConfig"].update(
+            build_thinking_config(thinking_level, include_thoughts=True)
+        )
+    return payload
+
+
+def extract_kb_sources(grounding_metadata: dict) -> list:
+    """Source citations from grounding metadata, deduplicated by title."""
+    sources = []
+    seen_titles = set()
+    for chunk in grounding_metadata.get("groundingChunks", []):
+        retrieved_context = chunk.get("retrievedContext", {})
+        if retrieved_context:
+            title = retrieved_context.get("title", "Unknown")
+            uri = retrieved_context.get("uri", "")
+            if title not in seen_titles:
+                seen_titles.add(title)
+                sources.append({
+                    "title": title,
+                    "uri": uri
+                })
+    return sources
+
+
+class _KbQuery:
+    """One KB query's keys, per-key request and result accounting; shared by
+    ``execute_kb_query`` and ``execute_kb_query_async``, which only differ
+    in how they wait."""
+
+    __slots__ = ("user_message", "config", "model", "key_filestore_map", "all_keys", "kb_keys",
+                 "api_base", "session_logger")
+
+    def __init__(self, user_message: str, config: dict, key_filestore_map: dict, all_keys: list,
+                 session_logger: Optional[SessionLogger]):
+        self.user_message = user_message
+        self.config = config
+        self.model = config.get("gemini", {}).get("kb_model", "gemini-3-flash-preview")
+        self.key_filestore_map = key_filestore_map
+        self.all_keys = all_keys
+        # Only keys paired with a filestore can serve a file-search query
+        self.kb_keys = [k for k in all_keys if key_filestore_map.get(k)]
+        if len(self.kb_keys) < len(all_keys):
+            logger.warning(f"No filestore configured for {len(all_keys) - len(self.kb_keys)} API key(s), skipping them...")
+        self.api_base = api_base(config)
+        self.session_logger = session_logger
+
+    def request_for(self, model: str) -> callable:
+        """``request_for(api_key) -> (url, body)`` for ``open_hedged_stream``;
+        a hedge on another key searches that key's own filestore."""
+        def request(api_key):
+            store_id = self.key_filestore_map[api_key]
+            logger.info(f"KB query using filestore: {store_id[:50]}...")
+            return (
+                f"{self.api_base}/{model}:streamGenerateContent?key={api_key}&alt=sse",
+                build_kb_payload(self.user_message, store_id, self.config)
+            )
+        return request
+
+    def finish(self, collector: StreamCollector, hedge_duplicates: int) -> dict:
+        """Log the usage, sources and thoughts of a completed search; returns
+        the query result."""
+        collector.log_usage(self.session_logger, hedge_duplicates)
+        sources = extract_kb_sources(collector.grounding)
+        if self.session_logger:
+            duration_ms = (time.time() - collector.start_time) * 1000
+            self.session_logger.log_kb_query(self.user_message, collector.text, duration_ms)
+            if sources:
+                self.session_logger.log("KB_SOURCES", {"sources": sources})
+            if collector.thoughts:
+                self.session_logger.log("KB_THOUGHTS_STREAMED", {"thoughts_length": len(collector.thoughts)})
+        return {"response": collector.text, "sources": sources}
+
+    def failed(self, attempt, error: Exception) -> None:
+        report_failure(attempt, error, self.session_logger, error_event="KB_QUERY_ERROR",
+                       details={"query": self.user_message, "attempt": attempt.number}, label="KB ")
+
+    def exhausted(self, attempt) -> dict:
+        last_error = attempt.last_error if attempt else None
+        logger.error(f"KB query failed: All {len(self.all_keys)} API keys exhausted. Last error: {last_error}")
+        if self.session_logger:
+            self.session_logger.log_error("KB_ALL_KEYS_EXHAUSTED", f"All keys failed: {last_error}", {"total_keys": len(self.all_keys)})
+        return {"response": "", "sources": []}
+
+
+def _prepare_kb_query(user_message: str, session_logger: Optional[SessionLogger], demo_mode: bool,
+                      effective_config: Optional[dict]) -> Optional[_KbQuery]:
+    """The ``_KbQuery`` to run, or None when the KB is disabled or has no keys."""
+    config = effective_config if effective_config else load_config()
+    if not config.get("knowledge_base", {}).get("enabled", False):
+        return None
+
+    # Get API key -> filestore mapping (demo or regular based on mode)
+    key_filestore_map = get_api_key_filestore_mapping(demo_mode=demo_mode)
+    if not key_filestore_map:
+        logger.warning("No API key to filestore mapping configured")
+        return None
+
+    # Get all available keys (demo or regular based on mode)
+    all_keys = get_api_keys(demo_mode=demo_mode)
+    if not all_keys:
+        return None
+    return _KbQuery(user_message, config, key_filestore_map, all_keys, session_logger)
+
+
+def execute_kb_query(user_message: str, session_logger: Optional[SessionLogger] = None, thought_callback: callable = None, demo_mode: bool = False, effective_config: dict = None, deadline: Optional[Deadline] = None) -> dict:
     """Execute Knowledge Base query using file search with key rotation and thought streaming.
 
     Each API key automatically uses its paired filestore from the config mapping.
@@ -40,195 +178,97 @@ def execute_kb_query(user_message: str, session_logger: Optional[SessionLogger]
                          Signature: callback(thought_text: str) -> None
         demo_mode: If True, uses demo API keys and filestores reserved for internal demos.
         effective_config: Optional config dict with query param overrides applied.
+        deadline: Optional turn ``Deadline`` bounding timeouts and key retries.
 
     Returns:
         dict with keys:
         - response: str (the response text)
         - sources: list of dicts with 'title' and 'uri'
     """
-    config = effective_config if effective_config else load_config()
-    kb_config = config.get("knowledge_base", {})
-
-    if not kb_config.get("enabled", False):
+    query = _prepare_kb_query(user_message, session_logger, demo_mode, effective_config)
+    if query is None:
         return {"response": "", "sources": []}
 
-    kb_prompt = config.get("prompts", {}).get("kb", "")
-    kb_model = config.get("gemini", {}).get("kb_model", "gemini-3-flash-preview")
-    kb_temperature = kb_config.get("temperature", 0.3)
-    kb_dynamic_threshold = kb_config.get("dynamic_threshold", 0.3)
-
-    # Get API key -> filestore mapping (demo or regular based on mode)
-    key_filestore_map = get_api_key_filestore_mapping(demo_mode=demo_mode)
+    # Keys are tried healthiest-first (see key_scheduler), each at most once;
+    # with a "kb" fallback ladder, then on the next model
+    attempt = None
+    for kb_model, attempt in iter_model_attempts(query.kb_keys, query.model, CALL_TYPE_KB, session_logger,
+                                                 log_prefix="KB", deadline=retry_deadline(deadline)):
+        collector = StreamCollector()
 
-    if not key_filestore_map:
-        logger.warning("No API key to filestore mapping configured")
-        return {"response": "", "sources": []}
-
-    # Get all available keys (demo or regular based on mode)
-    all_keys = get_api_keys(demo_mode=demo_mode)
-    if not all_keys:
-        return {"response": "", "sources": []}
+        try:
+            # Use streaming endpoint to get thoughts in real-time
+            hedged = open_hedged_stream(
+                attempt, query.kb_keys, query.request_for(kb_model),
+                CALL_TYPE_KB, session_logger, timeout=request_timeout(deadline), label="KB "
+            )
+            # A hedge on another key may have won the race
+            attempt = hedged.attempt
 
-    api_base = config.get("gemini", {}).get("api_base", "https://generativelanguage.googleapis.com/v1beta/models")
+            # Check for rate limit / server errors - immediately switch key
+            if attempt.retry_on_status(hedged.response, label="KB "):
+                continue
+            # The key stays in flight while the stream is read
+            attempt.succeeded(hold=True)
 
-    # Shuffle keys for random order
-    keys_to_try = all_keys.copy()
-    random.shuffle(keys_to_try)
+            # Collect response while streaming thoughts
+            for kind, value in iter_gemini_events(hedged.chunks):
+                thought = collector.add(kind, value)
+                if thought and thought_callback:
+                    thought_callback(thought)
 
-    last_error = None
-    attempt_count = 0
+            attempt.release()
+            return query.finish(collector, hedged.duplicates)
 
-    for api_key in keys_to_try:
-        # Get the filestore for this specific API key
-        store_id = key_filestore_map.get(api_key, "")
-        if not store_id:
-            logger.warning(f"No filestore configured for API key, skipping...")
+        except Exception as e:
+            query.failed(attempt, e)
             continue
 
-        logger.info(f"KB query using filestore: {store_id[:50]}...")
-
-        # Build payload with this key's filestore and thinking config
-        thinking_level = config.get("thinking", {}).get("kb_level", "low")
-        payload = {
-            "contents": [{"role": "user", "parts": [{"text": user_message}]}],
-            "systemInstruction": {"parts": [{"text": inject_datetime(kb_prompt)}]},
-            "generationConfig": {
-                "temperature": kb_temperature,
-            },
-            "tools": [{
-                "fileSearch": {
-                    "dynamicFileSearchConfig": {
-                        "mode": "MODE_DYNAMIC",
-                        "dynamicThreshold": kb_dynamic_threshold
-                    }
-                }
-            }],
-            "toolConfig": {
-                "fileSearch": {
-                    "vectorStore": {"storeResourceId": store_id}
-                }
-            }
-        }
+    # All keys exhausted
+    return query.exhausted(attempt)
 
-        # Add thinking config with includeThoughts for streaming
-        if thinking_level:
-            payload["generationConfig"].update(
-                build_thinking_config(thinking_level, include_thoughts=True)
-            )
 
-        attempt_count += 1
-        start_time = time.time()
+async def execute_kb_query_async(user_message: str, session_logger: Optional[SessionLogger] = None, thought_callback: callable = None, demo_mode: bool = False, effective_config: dict = None, deadline: Optional[Deadline] = None) -> dict:
+    """asyncio version of ``execute_kb_query`` (same arguments and result).
+
+    The KB phase runs this on the shared event loop (``knowledge_base.asyncio``).
+    ``thought_callback`` may be a plain function or a coroutine function.
+    """
+    query = _prepare_kb_query(user_message, session_logger, demo_mode, effective_config)
+    if query is None:
+        return {"response": "", "sources": []}
 
-        # Log retry attempt (if not first attempt)
-        if attempt_count > 1 and session_logger:
-            session_logger.log("KB_KEY_ROTATION", {
-                "attempt": attempt_count,
-                "total_keys": len(all_keys),
-                "reason": str(last_error)
-            })
+    attempt = None
+    async for kb_model, attempt in aiter_model_attempts(query.kb_keys, query.model, CALL_TYPE_KB, session_logger,
+                                                        log_prefix="KB", deadline=retry_deadline(deadline)):
+        collector = StreamCollector()
 
         try:
-            # Use streaming endpoint to get thoughts in real-time
-            url = f"{api_base}/{kb_model}:streamGenerateContent?key={api_key}&alt=sse"
-            response = requests.post(
-                url,
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                stream=True,
-                timeout=300
+            hedged = await async_client.open_hedged_stream(
+                attempt, query.kb_keys, query.request_for(kb_model),
+                CALL_TYPE_KB, session_logger, timeout=request_timeout(deadline), label="KB "
             )
+            # A hedge on another key may have won the race
+            attempt = hedged.attempt
 
-            # Check for rate limit - immediately switch key
-            if response.status_code == 429:
-                last_error = "Rate limited (429)"
-                logger.warning(f"KB API key rate limited, switching to next key...")
+            if await async_client.retry_on_status(attempt, hedged.response, label="KB "):
                 continue
+            attempt.succeeded(hold=True)
 
-            # Check for other retryable errors
-            if response.status_code in [500, 503]:
-                last_error = f"Server error ({response.status_code})"
-                logger.warning(f"KB server error {response.status_code}, switching to next key...")
-                continue
+            async for kind, value in async_client.iter_stream_events(hedged):
+                thought = collector.add(kind, value)
+                if thought and thought_callback:
+                    await async_client.call_thought_callback(thought_callback, thought)
 
-            # Collect response while streaming thoughts
-            result_text = ""
-            sources = []
-            collected_thoughts = ""
-            grounding_metadata = {}
-            kb_usage = None
-
-            for line in response.iter_lines():
-                if line:
-                    line_str = line.decode('utf-8')
-                    if line_str.startswith('data: '):
-                        try:
-                            data = json.loads(line_str[6:])
-                            if 'usageMetadata' in data:
-                                kb_usage = data['usageMetadata']
-                            if 'candidates' in data and data['candidates']:
-                                candidate = data['candidates'][0]
-
-                                # Extract grounding metadata when available
-                                if 'groundingMetadata' in candidate:
-                                    grounding_metadata = candidate['groundingMetadata']
-
-                                if 'content' in candidate and 'parts' in candidate['content']:
-                                    for part in candidate['content']['parts']:
-                                        if 'text' in part:
-                                            is_thought = part.get('thought', False)
-                                            if is_thought:
-                                                collected_thoughts += part['text']
-                                                if thought_callback:
-                                                    thought_callback(part['text'])
-                                            else:
-                                                result_text += part['text']
-                        except json.JSONDecodeError:
-                            continue
-
-            # Accumulate this call's token usage into the request total.
-            if session_logger:
-                session_logger.add_usage(kb_usage)
-
-            # Extract source citations from grounding metadata
-            grounding_chunks = grounding_metadata.get("groundingChunks", [])
-            seen_titles = set()
-            for chunk in grounding_chunks:
-                retrieved_context = chunk.get("retrievedContext", {})
-                if retrieved_context:
-                    title = retrieved_context.get("title", "Unknown")
-                    uri = retrieved_context.get("uri", "")
-                    # Deduplicate by title
-                    if title not in seen_titles:
-                        seen_titles.add(title)
-                        sources.append({
-                            "title": title,
-                            "uri": uri
-                        })
-
-            # Log KB query
-            if session_logger:
-                duration_ms = (time.time() - start_time) * 1000
-                session_logger.log_kb_query(user_message, result_text, duration_ms)
-                if sources:
-                    session_logger.log("KB_SOURCES", {"sources": sources})
-                if collected_thoughts:
-                    session_logger.log("KB_THOUGHTS_STREAMED", {"thoughts_length": len(collected_thoughts)})
-
-            return {"response": result_text, "sources": sources}
-
-        except requests.exceptions.Timeout:
-            last_error = "Request timeout"
-            logger.warning(f"KB request timeout, trying next key...")
-            continue
+            attempt.release()
+            return query.finish(collector, hedged.duplicates)
+
+        except asyncio.CancelledError:
+            # The turn stopped waiting for the search (deadline)
+            attempt.cancelled()
+            raise
         except Exception as e:
-            last_error = str(e)
-            logger.error(f"KB query error: {e}")
-            if session_logger:
-                session_logger.log_error("KB_QUERY_ERROR", str(e), {"query": user_message, "attempt": attempt_count})
+            query.failed(attempt, e)
             continue
 
-    # All keys exhausted
-    logger.error(f"KB query failed: All {len(all_keys)} API keys exhausted. Last error: {last_error}")
-    if session_logger:
-        session_logger.log_error("KB_ALL_KEYS_EXHAUSTED", f"All keys failed: {last_error}", {"total_keys": len(all_keys)})
-    return {"response": "", "sources": []}
+    return query.exhausted(attempt)
@@ -13,14 +13,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import logging
+import threading
+import time
 from typing import Optional
 
 from src.config import load_config
+from src.deadline import STAGE_MCP, Deadline
 from src.gemini.client import gemini_request_with_thought_streaming
-from src.mcp.client import call_tool, get_tools
-from src.mcp.schema import transform_schema_for_gemini
+from src.gemini.hedging import CALL_TYPE_MCP
+from src.gemini.payload import gemini_payload_builder
+from src.mcp.compaction import baseline_turn, compaction_enabled, record_followup_latency
+from src.mcp.tool_catalog import get_tool_catalog
+from src.mcp.tool_executor import run_tool_calls, streamed_tool_calls
+from src.mcp.tool_result import OBSERVATIONS_TOOL, ToolResult
 from src.session_logger import SessionLogger
 
 logger = logging.getLogger(__name__)
@@ -33,7 +39,9 @@ def execute_mcp_tool_loop(
     session_logger: Optional[SessionLogger] = None,
     effective_config: dict = None,
     thought_callback: callable = None,
-    demo_mode: bool = False
+    demo_mode: bool = False,
+    deadline: Optional[Deadline] = None,
+    cancelled: Optional[threading.Event] = None
 ) -> tuple:
     """Execute the MCP tool calling loop with optional thought streaming.
 
@@ -46,47 +54,71 @@ def execute_mcp_tool_loop(
         thought_callback: Optional callback for streaming thought chunks.
                          Signature: callback(thought_text: str) -> None
         demo_mode: If True, uses demo API keys reserved for internal demos.
+        deadline: Optional turn ``Deadline``. Calls are bounded by it, and no
+                  further iteration starts once too little time is left.
+        cancelled: Optional event set when the turn's consumer has gone away;
+                   checked before each Gemini call and each batch of tool calls.
 
     Returns:
-        tuple: (tool_results_text, tool_calls_list, final_response_text)
+        tuple: (tool_results_text, tool_calls_list, final_response_text);
+        tool_calls_list holds a ``ToolResult`` per call
     """
     config = effective_config if effective_config else load_config()
     mcp_prompt = config.get("prompts", {}).get("mcp", "")
     mcp_model = config.get("gemini", {}).get("mcp_model", "gemini-3-flash-preview")
     thinking_level = config.get("thinking", {}).get("mcp_level", "low")
 
-    # Get MCP tools
-    tools = get_tools()
-    if not tools:
+    # Get MCP tools; this turn keeps the catalog version it starts with
+    catalog = get_tool_catalog().current()
+    if catalog is None or not catalog.tools:
         if session_logger:
             session_logger.log_error("MCP_TOOLS_UNAVAILABLE", "No MCP tools available")
         return "", [], "MCP tools not available"
 
-    # Convert tools to Gemini format (transform schema to remove unsupported constructs)
-    gemini_tools = [{
-        "name": t.get("name", ""),
-        "description": t.get("description", ""),
-        "parameters": transform_schema_for_gemini(
-            t.get("inputSchema", {"type": "object", "properties": {}})
-        )
-    } for t in tools]
+    # Static parts (tools, system prompt, generation config) are serialized
+    # once; each iteration only serializes the turns it adds
+    gemini_tools = catalog.declarations
+    payload = gemini_payload_builder(
+        mcp_prompt, gemini_tools, temperature=1.0,
+        thinking_level=thinking_level, include_thoughts=True
+    )
 
     # Build conversation - NO history for MCP calls (fresh search every time)
     # History is only used in synthesis phase for context
-    contents = []
-    contents.append({"role": "user", "parts": [{"text": user_message}]})
+    payload.append({"role": "user", "parts": [{"text": user_message}]})
 
     tool_calls_list = []
     all_tool_results = []
+    # Some turns skip compaction as a baseline for the latency comparison
+    compact_results = not baseline_turn()
+    # Observation results the next Gemini call carries: (compacted, chars sent)
+    followup = None
 
     for iteration in range(max_iterations):
+        if cancelled is not None and cancelled.is_set():
+            return _cancelled(all_tool_results, tool_calls_list, iteration, session_logger)
+
+        # Out of turn budget: answer from the tool results gathered so far
+        if iteration and deadline is not None and deadline.degrade(STAGE_MCP, session_logger):
+            tool_results_text = "\n\n".join(all_tool_results)
+            if session_logger:
+                session_logger.log("MCP_LOOP_DEADLINE", {
+                    "iterations_used": iteration,
+                    "tools_called": len(tool_calls_list)
+                })
+            return tool_results_text, tool_calls_list, "Turn deadline reached"
+
         logger.info(f"MCP Tool Loop - Iteration {iteration + 1}/{max_iterations}")
 
         if session_logger:
             session_logger.log("MCP_LOOP_ITERATION", {"iteration": iteration + 1, "max": max_iterations})
 
+        # Tool calls may start while the rest of the response is streaming
+        streamed = streamed_tool_calls(session_logger, deadline)
+
+        call_started = time.time()
         response = gemini_request_with_thought_streaming(
-            messages=contents,
+            messages=payload.contents,
             system_instruction=mcp_prompt,
             model=mcp_model,
             tools=gemini_tools,
@@ -94,10 +126,20 @@ def execute_mcp_tool_loop(
             thinking_level=thinking_level,
             session_logger=session_logger,
             thought_callback=thought_callback,
-            demo_mode=demo_mode
+            demo_mode=demo_mode,
+            call_type=CALL_TYPE_MCP,
+            deadline=deadline,
+            payload_builder=payload,
+            function_call_callback=streamed.on_function_call if streamed else None
         )
 
+        if followup is not None and "error" not in response:
+            _record_followup(followup, iteration, (time.time() - call_started) * 1000,
+                             response.get("usageMetadata"), session_logger)
+
         if "error" in response:
+            if streamed is not None:
+                streamed.abandon()
             if session_logger:
                 session_logger.log_error("MCP_LOOP_ERROR", response['error'])
             return "", tool_calls_list, f"Error: {response['error']}"
@@ -105,6 +147,8 @@ def execute_mcp_tool_loop(
         # Check for function calls
         candidates = response.get("candidates", [])
         if not candidates:
+            if streamed is not None:
+                streamed.abandon()
             if session_logger:
                 session_logger.log_error("MCP_NO_CANDIDATES", "No response from model")
             return "", tool_calls_list, "No response from model"
@@ -124,6 +168,8 @@ def execute_mcp_tool_loop(
 
         # If no function calls, we're done
         if not function_calls:
+            if streamed is not None:
+                streamed.abandon()
             tool_results_text = "\n\n".join(all_tool_results)
             if session_logger:
                 session_logger.log("MCP_LOOP_COMPLETE", {
@@ -133,48 +179,71 @@ def execute_mcp_tool_loop(
                 })
             return tool_results_text, tool_calls_list, text_response
 
-        # Execute function calls
-        contents.append({"role": "model", "parts": parts})
+        if cancelled is not None and cancelled.is_set():
+            if streamed is not None:
+                streamed.abandon()
+            return _cancelled(all_tool_results, tool_calls_list, iteration + 1, session_logger)
+
+        # Execute function calls (concurrently; results come back in call order)
+        model_turn = {"role": "model", "parts": parts}
         function_responses = []
+        if streamed is not None:
+            results = streamed.results(function_calls)
+        else:
+            results = run_tool_calls(function_calls, session_logger=session_logger, deadline=deadline)
 
-        for fc in function_calls:
+        for fc, result in zip(function_calls, results):
+            # Parsed and analyzed once; later phases read the ToolResult
             tool_name = fc.get("name", "")
-            tool_args = fc.get("args", {})
-
-            logger.info(f"Executing MCP tool: {tool_name}")
-            result = call_tool(tool_name, tool_args, session_logger=session_logger)
-
-            # Convert result to string
-            if isinstance(result, dict):
-                if "content" in result and isinstance(result["content"], list):
-                    result_text = "\n".join([
-                        c.get("text", json.dumps(c)) for c in result["content"]
-                    ])
-                else:
-                    result_text = json.dumps(result)
-            else:
-                result_text = str(result)
-
-            tool_call_info = {
-                "name": tool_name,
-                "arguments": tool_args,
-                "result": result_text,  # No truncation - full result for source extraction
-                "status": "error" if "error" in result_text.lower() else "success"
-            }
-            tool_calls_list.append(tool_call_info)
-            all_tool_results.append(f"Tool: {tool_name}\nResult: {result_text}")
-
+            tool_result = ToolResult(tool_name, fc.get("args", {}), result,
+                                     compact=compact_results and compaction_enabled(tool_name))
+            tool_calls_list.append(tool_result)
+            if tool_result.compaction and session_logger:
+                session_logger.log("MCP_RESULT_COMPACTED", {"tool_name": tool_name, **tool_result.compaction})
+
+            # Gemini gets the compacted text; the sidebar keeps the full result
+            all_tool_results.append(f"Tool: {tool_name}\nResult: {tool_result.model_text}")
             function_responses.append({
                 "functionResponse": {
                     "name": tool_name,
-                    "response": {"result": result_text}
+                    "response": {"result": tool_result.model_text}
                 }
             })
 
-        contents.append({"role": "user", "parts": function_responses})
+        payload.append(model_turn, {"role": "user", "parts": function_responses})
+        batch = [tr for tr in tool_calls_list[-len(function_calls):] if tr.name == OBSERVATIONS_TOOL]
+        followup = (any(tr.compaction for tr in batch), sum(len(tr.model_text) for tr in batch)) if batch else None
 
     # Max iterations reached
     tool_results_text = "\n\n".join(all_tool_results)
     if session_logger:
         session_logger.log("MCP_LOOP_MAX_ITERATIONS", {"tools_called": len(tool_calls_list)})
     return tool_results_text, tool_calls_list, "Max tool iterations reached"
+
+
+def _cancelled(all_tool_results: list, tool_calls_list: list, iterations_used: int,
+               session_logger: Optional[SessionLogger]) -> tuple:
+    """The loop's result when the turn was cancelled before its next remote call."""
+    if session_logger:
+        session_logger.log("MCP_LOOP_CANCELLED", {
+            "iterations_used": iterations_used,
+            "tools_called": len(tool_calls_list)
+        })
+    return "\n\n".join(all_tool_results), tool_calls_list, "Turn cancelled"
+
+
+def _record_followup(followup: tuple, iteration: int, latency_ms: float, usage: Optional[dict],
+                     session_logger: Optional[SessionLogger]) -> None:
+    """Latency of a Gemini call answering observation results, for the
+    compacted vs uncompacted comparison."""
+    compacted, result_chars = followup
+    input_tokens = (usage or {}).get("promptTokenCount")
+    record_followup_latency(compacted, latency_ms, input_tokens, result_chars)
+    if session_logger:
+        session_logger.log("MCP_FOLLOWUP_LATENCY", {
+            "iteration": iteration + 1,
+            "compacted": compacted,
+            "latency_ms": round(latency_ms, 1),
+            "input_tokens": input_tokens,
+            "result_chars": result_chars,
+        })
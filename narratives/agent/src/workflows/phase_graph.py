@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Dependency-graph executor for the chat pipeline phases.
+
+Each ``Phase`` is an SSE generator over the shared ``ctx`` dict that declares
+the ``ctx`` keys it reads (``inputs``) and writes (``outputs``). A phase
+depends on the phases that write its inputs, and starts, on its own thread,
+as soon as they have finished; phases that do not depend on each other (MCP
+and KB) run at the same time.
+
+Events are multiplexed deterministically: the response carries the phases'
+events in declaration order, as if they had run one after another. The
+earliest unfinished phase streams live; later phases that are already
+running are buffered and flushed when their turn comes. So the frontend sees
+the same event order as before, while the work overlaps.
+
+If the consumer stops reading (Flask closes the generator when the client
+disconnects) or a phase fails, the run sets the ``threading.Event`` it keeps
+in ``ctx["cancelled"]``: no further phase starts, running phases are closed
+at their next event, and phases check the event before their next remote
+call.
+
+When a run ends, ``PIPELINE_TIMINGS`` is logged with each phase's start, end
+and duration (ms from the start of the run) and the critical path: the chain
+of phases, each gated by the last of its dependencies to finish, that ends
+at the phase finishing last.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Iterator, Optional
+
+from src.session_logger import SessionLogger
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Phase:
+    """One pipeline phase: ``run(ctx)`` yields SSE strings."""
+
+    __slots__ = ("name", "run", "inputs", "outputs")
+
+    def __init__(self, name: str, run: Callable[[dict], Iterator[str]],
+                 inputs: tuple = (), outputs: tuple = ()):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+
+class _PhaseRun:
+    """Timing and error of one phase in one run."""
+
+    __slots__ = ("start", "end", "error", "cancelled")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.end = None
+        self.error = None
+        self.cancelled = False
+
+
+class PhaseGraph:
+    """Phases in declaration order; a phase may only depend on earlier ones.
+
+    Args:
+        phases: The phases; each ``ctx`` key is written by at most one.
+        concurrent: When False, phases run one at a time in declaration
+            order (the same events, without the overlap).
+    """
+
+    def __init__(self, phases: list, concurrent: bool = True):
+        self.phases = list(phases)
+        self.concurrent = concurrent
+        writers = {}
+        self.dependencies = {}
+        for phase in self.phases:
+            self.dependencies[phase.name] = sorted(
+                {writers[key] for key in phase.inputs if key in writers},
+                key=[p.name for p in self.phases].index,
+            )
+            for key in phase.outputs:
+                if key in writers:
+                    raise ValueError(f"ctx key {key!r} is written by both {writers[key]} and {phase.name}")
+                writers[key] = phase.name
+        self.external_inputs = {
+            key for phase in self.phases for key in phase.inputs if key not in writers
+        }
+
+    def run(self, ctx: dict, session_logger: Optional[SessionLogger] = None) -> Iterator[str]:
+        """Run the phases over ``ctx`` and yield their SSE events in order.
+
+        Sets ``ctx["cancelled"]`` (a ``threading.Event``) if the run ends
+        early, on a phase error or when this generator is closed."""
+        missing = self.external_inputs - ctx.keys()
+        if missing:
+            raise KeyError(f"Pipeline inputs missing from ctx: {sorted(missing)}")
+
+        cancelled = ctx['cancelled'] = threading.Event()
+        started_at = time.time()
+        events = queue.Queue()  # (phase name, event or _DONE) from all phases
+        runs: dict[str, _PhaseRun] = {}
+        finished = set()
+        buffered = {phase.name: [] for phase in self.phases}
+
+        def worker(phase: Phase):
+            phase_events = phase.run(ctx)
+            try:
+                for event in phase_events:
+                    if cancelled.is_set():
+                        # Nobody will read it; closing the generator stops
+                        # the phase here, as the sequential pipeline did
+                        runs[phase.name].cancelled = True
+                        phase_events.close()
+                        break
+                    events.put((phase.name, event))
+            except Exception as e:
+                runs[phase.name].error = e
+            finally:
+                runs[phase.name].end = time.time()
+                events.put((phase.name, _DONE))
+
+        def start_ready():
+            for phase in self.phases:
+                if cancelled.is_set():
+                    break
+                if phase.name in runs:
+                    continue
+                if not all(dep in finished for dep in self.dependencies[phase.name]):
+                    if self.concurrent:
+                        continue
+                    break
+                if not self.concurrent and len(runs) > len(finished):
+                    break
+                runs[phase.name] = _PhaseRun(time.time())
+                threading.Thread(target=worker, args=(phase,), daemon=True,
+                                 name=f"phase-{phase.name}").start()
+
+        start_ready()
+        emitting = 0  # index of the phase whose events go out live
+        try:
+            while emitting < len(self.phases):
+                name, event = events.get()
+                if event is not _DONE:
+                    if name == self.phases[emitting].name:
+                        yield event
+                    else:
+                        buffered[name].append(event)
+                    continue
+
+                finished.add(name)
+                start_ready()
+                # Flush every phase whose turn has come, in order
+                while emitting < len(self.phases):
+                    current = self.phases[emitting].name
+                    for buffered_event in buffered[current]:
+                        yield buffered_event
+                    buffered[current].clear()
+                    if current not in finished:
+                        break
+                    if runs[current].error is not None:
+                        raise runs[current].error
+                    emitting += 1
+        finally:
+            if emitting < len(self.phases):
+                cancelled.set()
+                logger.info(f"Pipeline stopped at phase {self.phases[emitting].name}; "
+                            f"cancelling {len(runs) - len(finished)} running phase(s)")
+            self._log_timings(runs, started_at, session_logger, cancelled.is_set())
+
+    def critical_path(self, runs: dict) -> list:
+        """Phase names along the critical path, first to last."""
+        if not runs:
+            return []
+        path = [max(runs, key=lambda name: runs[name].end or 0)]
+        while True:
+            deps = [dep for dep in self.dependencies[path[-1]] if dep in runs]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda name: runs[name].end or 0))
+        return path[::-1]
+
+    def _log_timings(self, runs: dict, started_at: float, session_logger: Optional[SessionLogger],
+                     cancelled: bool = False) -> None:
+        def ms(t):
+            return round((t - started_at) * 1000, 1) if t is not None else None
+
+        phases = {
+            name: {
+                "start_ms": ms(run.start),
+                "end_ms": ms(run.end),
+                "duration_ms": round((run.end - run.start) * 1000, 1) if run.end is not None else None,
+                "depends_on": self.dependencies[name],
+                **({"cancelled": True} if run.cancelled else {}),
+            }
+            for name, run in runs.items()
+        }
+        path = self.critical_path(runs)
+        timings = {
+            "concurrent": self.concurrent,
+            "cancelled": cancelled,
+            "phases": phases,
+            "critical_path": path,
+            "critical_path_ms": sum(phases[name]["duration_ms"] or 0 for name in path),
+            "wall_ms": ms(time.time()),
+        }
+        logger.info(f"Pipeline timings: critical path {' -> '.join(path)}, {timings['wall_ms']}ms")
+        if session_logger:
+            session_logger.log("PIPELINE_TIMINGS", timings)
@@ -52,6 +52,9 @@ export function Header() {
           aria-label="Token usage for the latest query"
         >
           <div>Tokens IN: {latestUsage.input.toLocaleString()}</div>
+          {latestUsage.cached_input ? (
+            <div>Cached IN: {latestUsage.cached_input.toLocaleString()}</div>
+          ) : null}
           <div>Tokens OUT: {latestUsage.output.toLocaleString()}</div>
           <div>Total: {latestUsage.total.toLocaleString()}</div>
         </div>
@@ -165,6 +165,8 @@ export interface TokenUsage {
   output: number;
   /** Total tokens billed for the query. */
   total: number;
+  /** Part of `input` served from Gemini's context cache (billed at a discount). */
+  cached_input?: number;
 }
 
 /** Accumulated UI state for one user message and its streamed response. */